@@ -0,0 +1,89 @@
+"""
+Benchmarks end-to-end /molecule and /result throughput of a FractalServer for each
+available JSON backend (and msgpack if installed).
+
+Requires an active MongoDB instance at localhost:27017.
+
+    python benchmark_serialization.py --nmolecules 500 --repeats 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import qcfractal.interface as portal
+from qcfractal import FractalServer
+from qcfractal.interface import serialization
+from qcfractal.testing import active_loop, find_open_port, pristine_loop
+
+parser = argparse.ArgumentParser(description='Benchmarks FractalServer serialization throughput.')
+parser.add_argument('--nmolecules', type=int, default=500, help='The number of molecules and results to transfer')
+parser.add_argument('--natoms', type=int, default=30, help='The number of atoms in each molecule')
+parser.add_argument('--repeats', type=int, default=5, help='The number of timed repeats for each backend')
+
+args = parser.parse_args()
+
+
+def build_data(client):
+    """Adds random molecules and gradient results to the server
+    """
+    rng = np.random.RandomState(0)
+
+    mols = {}
+    for x in range(args.nmolecules):
+        geom = rng.rand(args.natoms, 3) * 10
+        mols[str(x)] = {"symbols": ["He"] * args.natoms, "geometry": geom.ravel().tolist()}
+    mol_ids = client.add_molecules(mols)
+
+    results = []
+    for num, (key, mol_id) in enumerate(mol_ids.items()):
+        results.append({
+            "molecule_id": mol_id,
+            "method": "bench",
+            "basis": "bench",
+            "options": "default",
+            "program": "bench",
+            "driver": "gradient",
+            "return_result": rng.rand(args.natoms * 3).tolist(),
+            "hash_index": "bench" + key,
+        })
+    client._request("post", "result", {"meta": {}, "data": results})
+
+    return list(mol_ids.values())
+
+
+def time_call(func):
+    timings = []
+    for x in range(args.repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+with pristine_loop() as loop:
+    server = FractalServer(
+        port=find_open_port(), storage_project_name="qcf_serialization_benchmark", io_loop=loop, ssl_options=False)
+    server.storage.client.drop_database(server.storage._project_name)
+    server.storage.init_database()
+
+    with active_loop(loop):
+        mol_ids = build_data(portal.FractalClient(server.get_address(""), verify=False))
+
+        runs = [("json", x) for x in sorted(serialization._json_backends)]
+        if serialization.msgpack is not None:
+            runs.append(("msgpack", serialization.get_json_backend()))
+
+        print("{:>10s} {:>10s} {:>14s} {:>14s}".format("encoding", "backend", "molecule/s", "result/s"))
+        for encoding, backend in runs:
+            serialization.set_json_backend(backend)
+            client = portal.FractalClient(server.get_address(""), verify=False, encoding=encoding)
+
+            mol_time = time_call(lambda: client.get_molecules(mol_ids, index="id"))
+            result_time = time_call(lambda: client.get_results(method="bench"))
+
+            print("{:>10s} {:>10s} {:14.1f} {:14.1f}".format(encoding, backend, len(mol_ids) / mol_time,
+                                                              len(mol_ids) / result_time))
+
+    server.storage.client.drop_database(server.storage._project_name)
@@ -6,6 +6,7 @@ from . import data
 from . import dict_utils
 from . import orm
 from . import schema
+from . import serialization
 from .client import FractalClient
 from . import collections
 # Add imports here
@@ -1,20 +1,150 @@
 """Provides an interface the QCDB Server instance"""
 
+import contextlib
+import copy
 import json
 import os
+import pandas as pd
 import requests
 import yaml
 
 from collections import defaultdict
 
 from .collections import collection_factory
+from .collections.collection_utils import collection_etag
 
 from . import molecule
 from . import orm
+from . import serialization
+
+
+class BatchFuture:
+    """
+    The result of a FractalClient call gathered into a batch, available once the batch has been sent.
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exception = None
+
+    def _set_result(self, result):
+        self._result = result
+        self._done = True
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done = True
+
+    def done(self):
+        """Returns True if the batch has been sent."""
+        return self._done
+
+    def result(self):
+        """Returns the result of the call or raises its exception.
+
+        Returns
+        -------
+        object
+            The value the FractalClient call returned
+        """
+        if not self._done:
+            raise RuntimeError(
+                "The batch has not been sent yet, results are available after the `batch` context exits.")
+
+        if self._exception is not None:
+            raise self._exception
+
+        return self._result
+
+
+class _GatheredRequest(Exception):
+    """
+    Stops a FractalClient call once its request has been recorded for a batch.
+    """
+
+
+class _BatchSlot:
+    """
+    Stands in for the first request of a gathered call. The request is recorded while the batch is
+    gathered and answered with its response from the batch once the batch has been sent.
+    """
+
+    def __init__(self):
+        self.request = None
+        self.response = None
+        self.pending = True
+
+    def answer(self, method, service, payload):
+        self.pending = False
+
+        if self.response is None:
+            self.request = {"endpoint": service, "method": method, "payload": copy.deepcopy(payload)}
+            raise _GatheredRequest
+
+        if self.response["status"] != 200:
+            raise requests.exceptions.HTTPError("Server communication failure. Reason: {}".format(
+                self.response["reason"]))
+
+        return self.response["response"]
+
+    def replay(self, response):
+        self.response = response
+        self.pending = True
+
+
+class _BatchProxy:
+    """
+    Gathers FractalClient calls, each call returns a BatchFuture.
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self._calls = []
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            raise AttributeError("Only FractalClient methods may be batched, found '{}'.".format(name))
+
+        def gather(*args, **kwargs):
+            future = BatchFuture()
+            self._calls.append((future, name, args, kwargs))
+            return future
+
+        return gather
+
+    def _send(self):
+
+        # Each call runs on a copy of the client which records its first request without sending it
+        pending = []
+        for future, name, args, kwargs in self._calls:
+            client = copy.copy(self._client)
+            client._batch_slot = _BatchSlot()
+            try:
+                future._set_result(getattr(client, name)(*args, **kwargs))
+            except _GatheredRequest:
+                pending.append((future, client, name, args, kwargs))
+            except Exception as e:
+                future._set_exception(e)
+
+        if len(pending) == 0:
+            return
+
+        gathered = [client._batch_slot.request for future, client, name, args, kwargs in pending]
+        responses = self._client._request("post", "batch", {"meta": {}, "data": gathered})["data"]
+
+        # Replay each call against its response, any further requests (e.g. pages) are sent directly
+        for (future, client, name, args, kwargs), response in zip(pending, responses):
+            client._batch_slot.replay(response)
+            try:
+                future._set_result(getattr(client, name)(*args, **kwargs))
+            except Exception as e:
+                future._set_exception(e)
 
 
 class FractalClient(object):
-    def __init__(self, address, username=None, password=None, verify=True):
+    def __init__(self, address, username=None, password=None, verify=True, encoding="json"):
         """Initializes a FractalClient instance from an address and verification information.
 
         Parameters
@@ -29,6 +159,9 @@ class FractalClient(object):
             Verifies the SSL connection with a third party server. This may be False if a
             FractalServer was not provided a SSL certificate and defaults back to self-signed
             SSL keys.
+        encoding : str, optional
+            The wire format used to communicate with the server ("json", "msgpack"). The
+            msgpack encoding transfers numeric arrays as typed binary buffers.
         """
         if "http" not in address:
             address = "https://" + address
@@ -45,6 +178,17 @@ class FractalClient(object):
         self._verify = verify
         self._headers = {}
 
+        # Answers the first request of a call gathered by `batch`
+        self._batch_slot = None
+
+        # Maps {(collection_type, name) : response} for revalidation with entity tags
+        self._collection_cache = {}
+
+        self.encoding = encoding.lower()
+        mime_type = serialization.get_mime_type(self.encoding)
+        self._headers["Content-Type"] = mime_type
+        self._headers["Accept"] = mime_type
+
         # If no 3rd party verification, quiet urllib
         if self._verify is False:
             from urllib3.exceptions import InsecureRequestWarning
@@ -66,19 +210,87 @@ class FractalClient(object):
         ret += "username='{}')".format(self.username)
         return ret
 
-    def _request(self, method, service, payload):
+    def _request(self, method, service, payload, headers=None):
+
+        if (self._batch_slot is not None) and self._batch_slot.pending:
+            return self._batch_slot.answer(method, service, payload)
 
         addr = self.address + service
+        data = serialization.serialize(payload, self.encoding)
+
+        if headers is None:
+            headers = self._headers
+        else:
+            headers = {**self._headers, **headers}
+
         if method == "get":
-            r = requests.get(addr, json=payload, headers=self._headers, verify=self._verify)
+            r = requests.get(addr, data=data, headers=headers, verify=self._verify)
         elif method == "post":
-            r = requests.post(addr, json=payload, headers=self._headers, verify=self._verify)
+            r = requests.post(addr, data=data, headers=headers, verify=self._verify)
+        elif method == "put":
+            r = requests.put(addr, data=data, headers=headers, verify=self._verify)
         else:
             raise KeyError("Method not understood: {}".format(method))
 
+        # Not modified since the entity tag passed in the headers
+        if r.status_code == 304:
+            return None
+
         if r.status_code != 200:
             raise requests.exceptions.HTTPError("Server communication failure. Reason: {}".format(r.reason))
 
+        encoding = serialization.get_encoding(r.headers.get("Content-Type", None))
+        return serialization.deserialize(r.content, encoding)
+
+    def _stream_request(self, service, payload):
+
+        addr = self.address + service
+        payload["meta"]["stream"] = True
+        data = serialization.serialize(payload, self.encoding)
+
+        with requests.get(addr, data=data, headers=self._headers, verify=self._verify, stream=True) as r:
+            if r.status_code != 200:
+                raise requests.exceptions.HTTPError("Server communication failure. Reason: {}".format(r.reason))
+
+            # Documents are decoded as they arrive
+            encoding = serialization.get_encoding(r.headers.get("Content-Type", None))
+            yield from serialization.deserialize_stream(r.iter_content(chunk_size=None), encoding)
+
+    def _iter_pages(self, service, payload, limit=None, cursor=None):
+        """Runs a GET request page by page, yielding the response of each page as it arrives.
+        """
+
+        if limit is not None:
+            payload["meta"]["limit"] = limit
+        if cursor is not None:
+            payload["meta"]["cursor"] = cursor
+
+        while True:
+            r = self._request("get", service, payload)
+            yield r
+
+            if not r["meta"].get("next_cursor", None):
+                break
+            payload["meta"]["cursor"] = r["meta"]["next_cursor"]
+
+    def _paged_request(self, service, payload, limit=None, cursor=None):
+        """Runs a GET request page by page. If a `limit` is given only a single page is returned
+        whose "next_cursor" may be passed back as `cursor` to continue the query, otherwise all
+        pages are requested in turn and concatenated.
+        """
+
+        pages = self._iter_pages(service, payload, limit=limit, cursor=cursor)
+        if limit is not None:
+            return next(pages)
+
+        r = next(pages)
+        data = r["data"]
+        for page in pages:
+            data.extend(page["data"])
+
+        r["meta"]["n_found"] = len(data)
+        r["meta"]["next_cursor"] = None
+        r["data"] = data
         return r
 
     @classmethod
@@ -90,7 +302,7 @@ class FractalClient(object):
         ----------
         load_path : str, dict, optional
             Path to find "qcportal_config.yaml", the filename, or a dictionary containing keys
-            ["address", "username", "password", "verify"]
+            ["address", "username", "password", "verify", "encoding"]
 
         """
 
@@ -131,24 +343,60 @@ class FractalClient(object):
         username = data.get("username", None)
         password = data.get("password", None)
         verify = data.get("verify", True)
+        encoding = data.get("encoding", "json")
+
+        return cls(address, username=username, password=password, verify=verify, encoding=encoding)
 
-        return cls(address, username=username, password=password, verify=verify)
+    @contextlib.contextmanager
+    def batch(self):
+        """Gathers FractalClient calls and sends their requests to the server together in a
+        single round-trip when the context exits. Each call returns a BatchFuture whose
+        `result()` is available after the context exits.
+
+        Examples
+        --------
+
+        >>> with client.batch() as batch:
+        ...     mols = batch.get_molecules([mol_id])
+        ...     results = batch.get_results(molecule_id=[mol_id], method="HF")
+        >>> mols.result()
+        """
+
+        proxy = _BatchProxy(self)
+        yield proxy
+        proxy._send()
 
     ### Generics
 
     def locator(self, data, return_full=False):
+        """Resolves locator objects on the server.
+
+        Parameters
+        ----------
+        data : dict or list of dict
+            A locator with "table", "index", "data", and optionally "projection" fields. A list of
+            locators is resolved in a single request.
+        return_full : bool, optional
+            Flags to return all metadata or only the located documents.
+
+        Returns
+        -------
+        list
+            The located documents, or a list of the located documents for each locator if a list
+            of locators was passed in.
+        """
 
         payload = {"meta": {}, "data": data}
         r = self._request("get", "locator", payload)
 
         if return_full:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     ### Molecule section
 
-    def get_molecules(self, mol_list, index="id", full_return=False):
+    def get_molecules(self, mol_list, index="id", full_return=False, limit=None, cursor=None):
         """Get molecules from the Server.
 
         Parameters
@@ -159,6 +407,12 @@ class FractalClient(object):
             The index to search on
         full_return : bool, optional
             Flags to return all metadata or only the query.
+        limit : int, optional
+            Returns a single page of at most `limit` molecules, the "next_cursor" of the full
+            return continues the query. If None, all pages are returned, see `iter_molecules` to
+            iterate over large queries.
+        cursor : str, optional
+            The "next_cursor" of a previous page to continue from.
 
         Returns
         -------
@@ -174,12 +428,41 @@ class FractalClient(object):
             raise KeyError("Search index must either be 'id' or hash, found: {}".format(index))
 
         payload = {"meta": {"index": index}, "data": mol_list}
-        r = self._request("get", "molecule", payload)
+        r = self._paged_request("molecule", payload, limit=limit, cursor=cursor)
 
         if full_return:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
+
+    def iter_molecules(self, mol_list, index="id", page_size=None):
+        """Iterates over molecules from the Server, pulling one page at a time so that large
+        queries are never held in memory at once.
+
+        Parameters
+        ----------
+        mol_list : list of str
+            Either molecule Id's or molecule hashes to query.
+        index : str, ("id", "hash")
+            The index to search on
+        page_size : int, optional
+            The number of molecules to pull per request, capped by the server
+
+        Returns
+        -------
+        generator of molecule JSON
+            The found molecules
+        """
+        if not isinstance(mol_list, (tuple, list)):
+            mol_list = [mol_list]
+
+        index = index.lower()
+        if index not in ["id", "index", "molecular_formula"]:
+            raise KeyError("Search index must either be 'id' or hash, found: {}".format(index))
+
+        payload = {"meta": {"index": index}, "data": mol_list}
+        for page in self._iter_pages("molecule", payload, limit=page_size):
+            yield from page["data"]
 
     def add_molecules(self, mol_list, full_return=False):
         """Adds molecules to the Server
@@ -213,9 +496,9 @@ class FractalClient(object):
         r = self._request("post", "molecule", payload)
 
         if full_return:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     ### Options section
 
@@ -229,7 +512,7 @@ class FractalClient(object):
         payload = {"meta": {}, "data": opt_list}
         r = self._request("get", "option", payload)
 
-        return r.json()["data"]
+        return r["data"]
 
     def add_options(self, opt_list, full_return=False):
 
@@ -239,9 +522,9 @@ class FractalClient(object):
         r = self._request("post", "option", payload)
 
         if full_return:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     ### Collections section
 
@@ -265,17 +548,17 @@ class FractalClient(object):
             query = {"collection": collection_type.lower()}
 
         payload = {"meta": {"projection": {"name": True, "collection": True}}, "data": query}
-        r = self._request("get", "collection", payload)
+        r = self._paged_request("collection", payload)
 
         if collection_type is None:
             ret = defaultdict(list)
-            for entry in r.json()["data"]:
+            for entry in r["data"]:
                 ret[entry["collection"]].append(entry["name"])
             return dict(ret)
         else:
-            return [x["name"] for x in r.json()["data"]]
+            return [x["name"] for x in r["data"]]
 
-    def get_collection(self, collection_type, collection_name, full_return=False):
+    def get_collection(self, collection_type, collection_name, full_return=False, projection=None):
         """Aquires a given collection from the server
 
         Parameters
@@ -286,6 +569,8 @@ class FractalClient(object):
             The name of the collection to be accssed
         full_return : bool, optional
             If False, returns a Collection object otherwise returns raw JSON
+        projection : dict, optional
+            The projection to apply to the collection document, projected collections are not cached
 
         Returns
         -------
@@ -293,15 +578,31 @@ class FractalClient(object):
             A Collection object if the given collection was found otherwise returns `None`.
         """
 
-        payload = {"meta": {}, "data": [(collection_type.lower(), collection_name)]}
-        r = self._request("get", "collection", payload)
+        key = (collection_type.lower(), collection_name)
+        payload = {"meta": {}, "data": [key]}
+
+        if projection is not None:
+            payload["meta"]["projection"] = projection
+            r = self._request("get", "collection", payload)
+
+        else:
+            # Only download the collection if it has changed since it was cached
+            headers = None
+            if key in self._collection_cache:
+                headers = {"If-None-Match": collection_etag(self._collection_cache[key]["data"][0])}
+
+            r = self._request("get", "collection", payload, headers=headers)
+            if r is None:
+                r = copy.deepcopy(self._collection_cache[key])
+            elif (len(r["data"]) == 1) and ("version" in r["data"][0]):
+                self._collection_cache[key] = copy.deepcopy(r)
 
         if full_return:
-            return r.json()
+            return r
         else:
             # If nothing found
-            if len(r.json()["data"]):
-                return collection_factory(r.json()["data"][0], client=self)
+            if len(r["data"]):
+                return collection_factory(r["data"][0], client=self)
             else:
                 return None
 
@@ -315,16 +616,103 @@ class FractalClient(object):
         payload = {"meta": {"overwrite": overwrite}, "data": collection}
 
         r = self._request("post", "collection", payload)
-        assert r.status_code == 200
 
         if full_return:
-            return r.json()
+            return r
+        else:
+            return r["data"]
+
+    def get_collection_entries(self,
+                               collection_id,
+                               field,
+                               fields=None,
+                               limit=None,
+                               cursor=None,
+                               full_return=False):
+        """Pulls the entries of a collection list field (e.g. Dataset reactions) in order.
+
+        Parameters
+        ----------
+        collection_id : str
+            The id of the collection
+        field : str
+            The list field to pull
+        fields : list of str, optional
+            The keys of each entry to return, if None the full entries are returned
+        limit : int, optional
+            Returns a single page of at most `limit` entries, the "next_cursor" of the full
+            return continues the query. If None, all pages are returned.
+        cursor : str, optional
+            The "next_cursor" of a previous page to continue from.
+        full_return : bool, optional
+            Flags to return all metadata or only the entries.
+
+        Returns
+        -------
+        list of dict
+            The requested entries
+        """
+
+        payload = {"meta": {}, "data": {"id": collection_id, "field": field, "fields": fields}}
+        r = self._paged_request("collection_entry", payload, limit=limit, cursor=cursor)
+
+        if full_return:
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
+
+    def update_collection(self,
+                          collection_id,
+                          version,
+                          set_fields=None,
+                          push_fields=None,
+                          set_entries=None,
+                          full_return=False):
+        """Applies a partial update to a collection on the server. The update is rejected if
+        the collection on the server is no longer at `version`.
+
+        Parameters
+        ----------
+        collection_id : str
+            The id of the collection to update
+        version : int
+            The version of the collection the changes were made against
+        set_fields : dict, optional
+            A {field : value} of top-level fields to replace
+        push_fields : dict, optional
+            A {field : values} of values to append to list fields
+        set_entries : dict, optional
+            A {field : {position : entry}} of entries to replace
+        full_return : bool, optional
+            Flags to return all metadata or only the updated collection key
+
+        Returns
+        -------
+        list
+            The (key, id) of the updated collection
+        """
+
+        payload = {
+            "meta": {
+                "id": collection_id,
+                "version": version
+            },
+            "data": {
+                "set": set_fields or {},
+                "push": push_fields or {},
+                "set_entries": set_entries or {}
+            }
+        }
+        r = self._request("put", "collection", payload)
+
+        if full_return:
+            return r
+        else:
+            return r["data"]
 
     ### Results section
 
-    def get_results(self, **kwargs):
+    def _build_results_payload(self, kwargs):
 
         query = {}
         for key in ["program", "molecule_id", "driver", "method", "basis", "options", "hash_index", "id"]:
@@ -332,29 +720,271 @@ class FractalClient(object):
                 query[key] = kwargs[key]
 
         payload = {"meta": {}, "data": query}
-        if "projection" in kwargs:
-            payload["meta"]["projection"] = kwargs["projection"]
+        for key in ["projection", "filters", "resolve_blobs"]:
+            if key in kwargs:
+                payload["meta"][key] = kwargs[key]
 
-        r = self._request("get", "result", payload)
+        return payload
+
+    def get_results(self, **kwargs):
+        """Get results from the Server.
+
+        Parameters
+        ----------
+        **kwargs
+            The query on the results index fields ("program", "molecule_id", "driver", "method",
+            "basis", "options", "hash_index", or "id"), lists match any of their values.
+            Also accepts:
+
+            - projection (dict) - The fields to return.
+            - resolve_blobs (bool) - If False, large output fields (e.g. "stdout") are returned as
+              {"blob_id": id} references which can be pulled later with `resolve_blobs`.
+            - filters (list) - Additional [field, operator, value] filters on any field which must
+              all match. The operators are "==", "!=", "<", "<=", ">", ">=", "in", "not in", and "exists".
+            - limit (int) and cursor (str) - Returns a single page of results.
+            - return_full (bool) - Flags to return all metadata or only the results.
+
+        Returns
+        -------
+        list of dict
+            The matching results
+
+        Examples
+        --------
+
+        client.get_results(method="b3lyp", filters=[["return_result", "<", -76.0]], projection={"return_result": True})
+
+        """
+
+        payload = self._build_results_payload(kwargs)
+        r = self._paged_request("result", payload, limit=kwargs.get("limit", None), cursor=kwargs.get("cursor", None))
 
         if kwargs.get("return_full", False):
-            return r.json()
-        else:
-            return r.json()["data"]
+            return r
+
+        if r["meta"].get("error_description", False):
+            raise KeyError("Results query failed: {}".format(r["meta"]["error_description"]))
 
-    def get_procedures(self, procedure_id, return_objects=True):
+        return r["data"]
+
+    def get_results_summary(self, **kwargs):
+        """Summarizes the results matching a query without pulling them.
+
+        Parameters
+        ----------
+        **kwargs
+            The query, see `get_results`
+
+        Returns
+        -------
+        dict
+            The number of matching results ("n_found") and the latest time any of them
+            were modified ("modified_on")
+        """
+
+        payload = self._build_results_payload(kwargs)
+        payload["meta"]["summary"] = True
+        r = self._request("get", "result", payload)
+
+        return r["data"]
+
+    def aggregate_results(self,
+                          group_by=("program", "method", "basis"),
+                          field="return_result",
+                          stats=("count", "sum", "min", "max", "mean"),
+                          return_full=False,
+                          **kwargs):
+        """Computes statistics of a results field for each group of results on the server,
+        only the resulting table is transferred.
+
+        Parameters
+        ----------
+        group_by : list of str, optional
+            The fields to group the results by
+        field : str, optional
+            The field to compute statistics of
+        stats : list of str, optional
+            The statistics to compute ("count", "sum", "min", "max", "mean")
+        return_full : bool, optional
+            Flags to return all metadata or only the table
+        **kwargs
+            The query, see `get_results`
+
+        Returns
+        -------
+        pd.DataFrame
+            A DataFrame indexed by the group fields with a column for each statistic
+
+        Examples
+        --------
+
+        client.aggregate_results(group_by=["method", "basis"], program="psi4")
+
+        """
+
+        payload = self._build_results_payload(kwargs)
+        payload["meta"].update({"group_by": list(group_by), "field": field, "stats": list(stats)})
+        r = self._request("get", "result_aggregate", payload)
+
+        if return_full:
+            return r
+
+        table = r["data"]
+        if "columns" not in table:
+            raise KeyError("Aggregate failed: {}".format(r["meta"]["error_description"]))
+
+        ret = pd.DataFrame(table["rows"], columns=table["columns"])
+        if len(group_by):
+            ret = ret.set_index(list(group_by))
+        return ret
+
+    def iter_results(self, **kwargs):
+        """Iterates over results from the server as they are streamed, the full
+        query is never held in memory on either the server or the client.
+
+        Parameters
+        ----------
+        **kwargs
+            The query and projection, see `get_results`
+
+        Returns
+        -------
+        generator of dict
+            The result documents
+        """
+
+        payload = self._build_results_payload(kwargs)
+        return self._stream_request("result", payload)
+
+    def get_blobs(self, blob_ids):
+        """Pulls large result fields which are stored out of line on the server.
+
+        Parameters
+        ----------
+        blob_ids : str or list of str
+            The ids of the {"blob_id": id} references found in results
+
+        Returns
+        -------
+        dict
+            A {blob_id : value} dictionary
+        """
+
+        if isinstance(blob_ids, str):
+            blob_ids = [blob_ids]
+
+        payload = {"meta": {}, "data": list(blob_ids)}
+        r = self._request("get", "blob", payload)
+
+        return r["data"]
+
+    def resolve_blobs(self, results, fields=None):
+        """Replaces the {"blob_id": id} references of results with their values in-place,
+        all references are pulled in a single request.
+
+        Parameters
+        ----------
+        results : dict or list of dict
+            The results returned by `get_results` or `iter_results`
+        fields : list of str, optional
+            The fields to resolve, all references are resolved if None
+
+        Returns
+        -------
+        dict or list of dict
+            The results
+        """
+
+        docs = [results] if isinstance(results, dict) else results
+
+        def references(doc):
+            for key, value in doc.items():
+                if ((fields is None) or (key in fields)) and isinstance(value, dict) and ("blob_id" in value):
+                    yield key, value["blob_id"]
+
+        blob_ids = {blob_id for doc in docs for key, blob_id in references(doc)}
+        if len(blob_ids) == 0:
+            return results
+
+        values = self.get_blobs(list(blob_ids))
+        for doc in docs:
+            for key, blob_id in list(references(doc)):
+                if blob_id in values:
+                    doc[key] = values[blob_id]
+
+        return results
+
+    def get_procedures(self, procedure_id, return_objects=True, limit=None, cursor=None, filters=None,
+                       projection=None):
+        """Get procedures from the Server.
+
+        Parameters
+        ----------
+        procedure_id : dict
+            The procedure query
+        return_objects : bool, optional
+            If True, returns ORM objects, otherwise returns the full response.
+        limit : int, optional
+            Returns a single page of at most `limit` procedures
+        cursor : str, optional
+            The "next_cursor" of the previous page
+        filters : list, optional
+            Additional [field, operator, value] filters on any field, see `get_results`
+        projection : dict, optional
+            The fields to return, ORM objects cannot be built from partial procedures so the full
+            response is returned
+
+        Returns
+        -------
+        list or dict
+            The procedures
+        """
 
         payload = {"meta": {}, "data": procedure_id}
-        r = self._request("get", "procedure", payload)
+        if filters is not None:
+            payload["meta"]["filters"] = filters
+        if projection is not None:
+            payload["meta"]["projection"] = projection
+            return_objects = False
+
+        r = self._paged_request("procedure", payload, limit=limit, cursor=cursor)
 
         if return_objects:
             ret = []
-            for packet in r.json()["data"]:
+            for packet in r["data"]:
                 tmp = orm.build_orm(packet, client=self)
                 ret.append(tmp)
             return ret
         else:
-            return r.json()
+            return r
+
+    def iter_procedures(self, procedure_id, return_objects=True, filters=None):
+        """Iterates over procedures from the server as they are streamed, the full
+        query is never held in memory on either the server or the client.
+
+        Parameters
+        ----------
+        procedure_id : dict
+            The procedure query
+        return_objects : bool, optional
+            If True, yields ORM objects, otherwise yields the raw JSON documents.
+        filters : list, optional
+            Additional [field, operator, value] filters on any field, see `get_results`
+
+        Returns
+        -------
+        generator
+            The procedures
+        """
+
+        payload = {"meta": {}, "data": procedure_id}
+        if filters is not None:
+            payload["meta"]["filters"] = filters
+        for packet in self._stream_request("procedure", payload):
+            if return_objects:
+                yield orm.build_orm(packet, client=self)
+            else:
+                yield packet
 
     # Must compute results?
     # def add_results(self, db, full_return=False):
@@ -368,9 +998,9 @@ class FractalClient(object):
     #     assert r.status_code == 200
 
     #     if full_return:
-    #         return r.json()
+    #         return r
     #     else:
-    #         return r.json()["data"]
+    #         return r["data"]
 
     ### Compute section
 
@@ -395,9 +1025,9 @@ class FractalClient(object):
         r = self._request("post", "task_scheduler", payload)
 
         if return_full:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     def add_procedure(self, procedure, program, program_options, molecule_id, return_full=False):
 
@@ -417,9 +1047,9 @@ class FractalClient(object):
         r = self._request("post", "task_scheduler", payload)
 
         if return_full:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     def add_service(self, service, data, options, return_full=False):
 
@@ -438,8 +1068,8 @@ class FractalClient(object):
         r = self._request("post", "service_scheduler", payload)
 
         if return_full:
-            return r.json()
+            return r
         else:
-            return r.json()["data"]
+            return r["data"]
 
     # Def add_service
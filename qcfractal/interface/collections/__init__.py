@@ -3,5 +3,6 @@ from .dataset import Dataset
 from .biofragment import BioFragment
 from .openffworkflow import OpenFFWorkflow
 from .collection_utils import collection_factory
+from .query_cache import QueryCache
 
-__all__ = ['Dataset', 'BioFragment', "OpenFFWorkflow", "collection_factory"]
+__all__ = ['Dataset', 'BioFragment', "OpenFFWorkflow", "collection_factory", "QueryCache"]
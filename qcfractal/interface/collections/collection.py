@@ -5,13 +5,16 @@ Helper
 """
 
 import abc
-import json
 import copy
+import json
 
 class Collection(abc.ABC):
 
     __base_fields = {"name", "collection", "provenance"}
 
+    # List fields which are saved entry by entry
+    _entry_fields = ()
+
     def __init__(self, name, **kwargs):
         """
         Initializer for the Collections objects. If no Portal is supplied or the Collection name
@@ -47,6 +50,12 @@ class Collection(abc.ABC):
                 **self._init_collection_data(kwargs)
             }
 
+        # Track the state last seen on the server so that only changes are saved
+        self._saved_state = None
+        self._dirty_entries = {}
+        if ("id" in self.data) and ("version" in self.data):
+            self._mark_saved()
+
     def __str__(self):
         """
         A simple string representation of the Collection.
@@ -80,7 +89,7 @@ class Collection(abc.ABC):
         return ret
 
     @classmethod
-    def from_server(cls, client, name):
+    def from_server(cls, client, name, lazy=False):
         """Creates a new class from a server
 
         Parameters
@@ -89,6 +98,9 @@ class Collection(abc.ABC):
             A Portal client to connected to a server
         name : str
             The name of the collection to pull from.
+        lazy : bool, optional
+            If True, entry lists (such as Dataset reactions) are not downloaded with the
+            collection and are instead pulled in pages as they are needed.
 
         Returns
         -------
@@ -99,12 +111,22 @@ class Collection(abc.ABC):
         if not (client.__class__.__name__ == "FractalClient"):
             raise TypeError("Expected a FractalClient as first arguement, found {}.".format(type(self.client)))
 
+        projection = None
+        if lazy and len(cls._entry_fields):
+            projection = {k: False for k in cls._entry_fields}
+
         class_name = cls.__name__.lower()
-        tmp_data = client.get_collection(class_name, name, full_return=True)
+        tmp_data = client.get_collection(class_name, name, full_return=True, projection=projection)
         if tmp_data["meta"]["n_found"] == 0:
             raise KeyError("Warning! `{}: {}` not found.".format(class_name, name))
 
-        return cls.from_json(tmp_data["data"][0], client=client)
+        # Entry lists which have not been pulled are marked as None
+        data = tmp_data["data"][0]
+        if projection is not None:
+            for k in cls._entry_fields:
+                data[k] = None
+
+        return cls.from_json(data, client=client)
 
     @classmethod
     def from_json(cls, data, client=None):
@@ -177,6 +199,8 @@ class Collection(abc.ABC):
         ret : dict
             A JSON representation of the Collection
         """
+        self._load_entries()
+
         if filename is not None:
             with open(filename, 'w') as open_file:
                 json.dump(self.data, open_file)
@@ -200,11 +224,101 @@ class Collection(abc.ABC):
         """
         pass
 
+    def _load_entries(self):
+        """
+        Pulls any entry lists which were not downloaded when the Collection was lazily opened.
+        """
+        pass
+
+    def _set_entry(self, field, position, entry):
+        """
+        Replaces an entry of a list field, the entry is saved with the next delta save.
+        """
+        self.data[field][position] = entry
+        self._dirty_entries.setdefault(field, set()).add(position)
+
+    def _entries_modified(self):
+        """
+        Checks if entries were added or replaced since the last save, cheap as no entries are compared.
+        """
+        if self._saved_state is None:
+            return True
+
+        for field in self._entry_fields:
+            entries = self.data.get(field, None)
+            if (entries is not None) and (len(entries) != self._saved_state["entries"][field]):
+                return True
+
+        return any(len(x) for x in self._dirty_entries.values())
+
+    def _mark_saved(self):
+        """
+        Records the current data as the state held by the server. Entries are only counted, entries
+        changed afterwards are recorded through `_set_entry`.
+        """
+        self._saved_state = {
+            "fields": {k: json.dumps(v, sort_keys=True)
+                       for k, v in self.data.items() if k not in self._entry_fields},
+            "entries": {k: (None if self.data.get(k, None) is None else len(self.data[k]))
+                        for k in self._entry_fields},
+        }
+        self._dirty_entries = {}
+
+    def _build_delta(self):
+        """
+        Builds the changes since the last save, returns None if they cannot be expressed as a delta.
+        """
+        saved = self._saved_state
+
+        set_fields = {}
+        for k, v in self.data.items():
+            if (k in self._entry_fields) or (k in ["id", "version"]):
+                continue
+
+            if saved["fields"].get(k, None) != json.dumps(v, sort_keys=True):
+                set_fields[k] = v
+
+        # Removed fields cannot be expressed as a delta
+        if len(saved["fields"].keys() - self.data.keys()):
+            return None
+
+        push_fields = {}
+        set_entries = {}
+        for field in self._entry_fields:
+            entries = self.data[field]
+
+            # Entries which were never pulled cannot have changed
+            if entries is None:
+                continue
+
+            n_saved = saved["entries"][field]
+            if n_saved is None:
+                return None
+
+            # Removed entries cannot be expressed as a delta
+            if len(entries) < n_saved:
+                return None
+
+            if len(entries) > n_saved:
+                push_fields[field] = entries[n_saved:]
+
+            # Replaced entries are set by position
+            changed = {str(x): entries[x] for x in sorted(self._dirty_entries.get(field, ())) if x < n_saved}
+            if changed:
+                set_entries[field] = changed
+
+        return {"set_fields": set_fields, "push_fields": push_fields, "set_entries": set_entries}
+
     # Setters
     def save(self, client=None, overwrite=False):
         """Uploads the overall structure of the Collection (indices, options, new molecules, etc)
         to the server.
 
+        If the Collection was pulled from or previously saved to the server, only the changes since
+        then are uploaded. The save fails if the server copy has since been modified by someone else.
+        Entries (such as Dataset reactions) are only uploaded if they were added or replaced through
+        the Collection, entries edited in place are not detected.
+
         Parameters
         ----------
         client : None, optional
@@ -228,5 +342,31 @@ class Collection(abc.ABC):
 
         self._pre_save_prep(client)
 
+        delta = None
+        if overwrite and (self._saved_state is not None):
+            delta = self._build_delta()
+
+        if delta is not None:
+            ret = client.update_collection(self.data["id"], self.data["version"], full_return=True, **delta)
+            if ret["meta"]["success"] is False:
+                raise ValueError("Collection:save: {} was modified on the server, please pull a new copy. {}".format(
+                    class_name, ret["meta"]["error_description"]))
+
+            self.data["version"] = ret["meta"]["version"]
+            self._mark_saved()
+            return ret["data"]
+
         # Add the database
-        return client.add_collection(self.data, overwrite=overwrite)
+        self._load_entries()
+        ret = client.add_collection(self.data, overwrite=overwrite)
+
+        # A fresh insert starts at the first version, otherwise the server version is unknown
+        if (not overwrite) and len(ret):
+            self.data["id"] = ret[0][1]
+            self.data["version"] = 1
+            self._mark_saved()
+        else:
+            self.data.pop("version", None)
+            self._saved_state = None
+
+        return ret
@@ -24,6 +24,21 @@ def nCr(n, r):
     """
     return math.factorial(n) / math.factorial(r) / math.factorial(n - r)
 
+def collection_etag(data):
+    """Builds the HTTP entity tag of a collection document from its id and version.
+
+    Parameters
+    ----------
+    data : dict
+        The collection document, must contain "id" and "version" fields.
+
+    Returns
+    -------
+    str
+        The quoted entity tag
+    """
+    return '"{}-{}"'.format(data["id"], data["version"])
+
 def register_collection(collection):
     """Registers a collection for the factory
 
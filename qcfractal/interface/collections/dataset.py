@@ -1,6 +1,7 @@
 """
 QCPortal Database ODM
 """
+import concurrent.futures
 import itertools as it
 
 import numpy as np
@@ -13,6 +14,43 @@ from .. import molecule
 from .. import statistics
 from .collection import Collection
 from .collection_utils import nCr, register_collection
+from .query_cache import QueryCache
+
+
+def _build_ie_stoichiometry(job):
+    """
+    Builds the interaction energy stoichiometry of a single complex in terms of molecule hashes.
+    Runs in worker processes, so only hashes and JSON are returned.
+
+    Parameters
+    ----------
+    job : tuple
+        The complex and the kwargs to pass into `Dataset.build_ie_fragments`
+
+    Returns
+    -------
+    stoichiometry : dict
+        The {stoichiometry : [(molecule hash, coefficient), ...]} of the complex
+    jsons : dict
+        The {molecule hash : JSON} of each unique fragment
+    """
+    mol, kwargs = job
+    fragments = Dataset.build_ie_fragments(mol, **kwargs)
+
+    hashes = {}
+    jsons = {}
+    stoichiometry = {}
+    for stoich, entries in fragments.items():
+        stoichiometry[stoich] = []
+        for frag, coef in entries:
+            if id(frag) not in hashes:
+                frag_json = frag.to_json()
+                hashes[id(frag)] = molecule.hash_json(frag_json)
+                jsons[hashes[id(frag)]] = frag_json
+
+            stoichiometry[stoich].append((hashes[id(frag)], coef))
+
+    return stoichiometry, jsons
 
 
 class Dataset(Collection):
@@ -27,11 +65,18 @@ class Dataset(Collection):
         JSON representation of the database backbone
     df : pd.DataFrame
         The underlying dataframe for the Dataset object
-    rxn_index : pd.Index
+    rxn_index : pd.DataFrame
         The unrolled reaction index for all reactions in the Dataset
     """
 
     __required_fields = {"reactions", "ds_type"}
+    _entry_fields = ("reactions", )
+
+    # Number of reactions pulled per request for lazily opened Datasets
+    _page_size = 1000
+
+    # Number of molecules submitted per compute request
+    _compute_chunk_size = 1000
 
     def __init__(self, name, client=None, ds_type="rxn", **kwargs):
         """
@@ -55,22 +100,24 @@ class Dataset(Collection):
         if self.data["ds_type"] not in ["rxn", "ie"]:
             raise TypeError('Dataset: ds_type must either be "rxn" or "ie".')
 
-        # Internal data
-        self.rxn_index = pd.DataFrame()
-        self.df = pd.DataFrame()
+        # Unrolled index and coefficient matrix of each stoichiometry, built as they are queried
+        self._rxn_index_cache = {}
+        self._stoich_matrix_cache = {}
 
-        # Initialize internal dataframes
-        self.df = pd.DataFrame(index=self.get_index())
+        # Reaction names of a lazily opened Dataset
+        self._lazy_index = None
 
-        # Unroll the index
-        tmp_index = []
-        for rxn in self.data["reactions"]:
-            name = rxn["name"]
-            for stoich_name in list(rxn["stoichiometry"]):
-                for mol_hash, coef in rxn["stoichiometry"][stoich_name].items():
-                    tmp_index.append([name, stoich_name, mol_hash, coef])
+        # Maps {name : position} of the reactions, rebuilt if the reactions are replaced
+        self._name_index = None
+
+        # Reactions were handed out by get_rxn since the index was built and may have been renamed
+        self._rxns_exposed = False
+
+        # Optional on-disk cache of queries
+        self._query_cache = None
 
-        self.rxn_index = pd.DataFrame(tmp_index, columns=["name", "stoichiometry", "molecule_id", "coefficient"])
+        # Initialize internal dataframes
+        self.df = pd.DataFrame(index=self.get_index())
 
         # If we making a new database we may need new hashes and json objects
         self._new_molecule_jsons = {}
@@ -84,56 +131,269 @@ class Dataset(Collection):
         mol_ret = client.add_molecules(self._new_molecule_jsons)
 
         # Update internal molecule UUID's to servers UUID's
-        self.data["reactions"] = dict_utils.replace_dict_keys(self.data["reactions"], mol_ret)
+        if self.data["reactions"] is not None:
+            self.data["reactions"] = dict_utils.replace_dict_keys(self.data["reactions"], mol_ret)
         self._new_molecule_jsons = {}
+        self._rxn_index_cache = {}
+        self._stoich_matrix_cache = {}
 
-    def _unroll_query(self, keys, stoich, field="result_result"):
-        """Unrolls a complex query into a "flat" query for the server object
+    def set_query_cache(self, cache):
+        """Sets an on-disk cache that queries are checked against before pulling results from the server.
+        Cached queries are reused across sessions until the Dataset or the matching results change.
 
         Parameters
         ----------
-        keys : dict
-            Server query fields
+        cache : str or QueryCache or None
+            The directory of the cache or a QueryCache, None disables caching
+        """
+        if isinstance(cache, str):
+            cache = QueryCache(cache)
+        elif (cache is not None) and not isinstance(cache, QueryCache):
+            raise TypeError("Dataset: Query cache must be a path or a QueryCache, found {}.".format(type(cache)))
+
+        self._query_cache = cache
+
+    def _matches_server(self):
+        """Checks if the reactions held locally are known to match those on the server, reactions
+        added or replaced since the last save or load mark the Dataset as modified.
+        """
+        if self._new_molecule_jsons:
+            return False
+
+        return not self._entries_modified()
+
+    def _iter_reaction_pages(self, fields=None):
+        """Pulls the reactions of the Dataset from the server one page at a time.
+
+        Parameters
+        ----------
+        fields : list of str, optional
+            The keys of each reaction to pull, if None the full reactions are pulled
+
+        Returns
+        -------
+        generator of list of dict
+            The pages of reactions
+        """
+        if self.client is None:
+            raise AttributeError("Dataset: FractalClient was not set.")
+
+        cursor = None
+        while True:
+            ret = self.client.get_collection_entries(
+                self.data["id"], "reactions", fields=fields, limit=self._page_size, cursor=cursor, full_return=True)
+            yield ret["data"]
+
+            cursor = ret["meta"]["next_cursor"]
+            if cursor is None:
+                break
+
+    def _load_entries(self):
+        if self.data["reactions"] is not None:
+            return
+
+        reactions = []
+        for page in self._iter_reaction_pages():
+            reactions.extend(page)
+
+        self.data["reactions"] = reactions
+        self._lazy_index = None
+        if self._saved_state is not None:
+            self._saved_state["entries"]["reactions"] = len(reactions)
+
+    @staticmethod
+    def _unroll_stoichiometry(reactions, stoich):
+        """Unrolls a single stoichiometry of a list of reactions into a flat index.
+
+        Parameters
+        ----------
+        reactions : list of dict
+            The reactions to unroll
         stoich : str
-            The stoichiometry to access for the query (default/cp/cp3/etc)
-        field : str, optional
-            The results field to query on
+            The stoichiometry to unroll (default/cp/cp3/etc)
 
         Returns
         -------
         ret : pd.DataFrame
-            A DataFrame representation of the unrolled query
+            A DataFrame with "name", "molecule_id", and "coefficient" columns
         """
-        tmp_idx = self.rxn_index[self.rxn_index["stoichiometry"] == stoich].copy()
-        tmp_idx = tmp_idx.reset_index(drop=True)
+        names = []
+        molecules = []
+        coefficients = []
+        for rxn in reactions:
+            entry = rxn.get("stoichiometry", {}).get(stoich, None)
+            if entry is None:
+                continue
+
+            names.extend([rxn["name"]] * len(entry))
+            molecules.extend(entry.keys())
+            coefficients.extend(entry.values())
+
+        return pd.DataFrame({
+            "name": np.array(names, dtype=object),
+            "molecule_id": np.array(molecules, dtype=object),
+            "coefficient": np.array(coefficients, dtype=np.float64)
+        })
+
+    def _get_rxn_index(self, stoich):
+        """Returns the unrolled index of a single stoichiometry, the index is built on first use.
+        Lazily opened Datasets only pull the names and the requested stoichiometry of each reaction.
 
-        # There could be duplicates so take the unique and save the map
-        umols, uidx = np.unique(tmp_idx["molecule_id"], return_index=True)
+        Parameters
+        ----------
+        stoich : str
+            The stoichiometry to access (default/cp/cp3/etc)
 
-        # Evaluate the overall dataframe
-        query_keys = {k: v for k, v in keys.items()}
-        query_keys["molecule_id"] = list(umols)
-        query_keys["projection"] = {field: True, "molecule_id": True}
-        values = pd.DataFrame(self.client.get_results(**query_keys))
+        Returns
+        -------
+        ret : pd.DataFrame
+            A DataFrame with "name", "molecule_id", and "coefficient" columns
+        """
+
+        if stoich not in self._rxn_index_cache:
+            if self.data["reactions"] is None:
+                fields = ["name", "stoichiometry." + stoich]
+                frames = [self._unroll_stoichiometry(page, stoich) for page in self._iter_reaction_pages(fields)]
+                index = pd.concat(frames, ignore_index=True)
+            else:
+                index = self._unroll_stoichiometry(self.data["reactions"], stoich)
+
+            self._rxn_index_cache[stoich] = index
+
+        return self._rxn_index_cache[stoich]
+
+    @property
+    def rxn_index(self):
+        """The unrolled reaction index for all reactions in the Dataset
+
+        Returns
+        -------
+        ret : pd.DataFrame
+            A DataFrame with "name", "stoichiometry", "molecule_id", and "coefficient" columns
+        """
+        self._load_entries()
+
+        stoichs = []
+        for rxn in self.data["reactions"]:
+            stoichs.extend(x for x in rxn["stoichiometry"] if x not in stoichs)
+
+        frames = [self._get_rxn_index(stoich).assign(stoichiometry=stoich) for stoich in stoichs]
+        if len(frames) == 0:
+            return pd.DataFrame(columns=["name", "stoichiometry", "molecule_id", "coefficient"])
+
+        return pd.concat(frames, ignore_index=True)[["name", "stoichiometry", "molecule_id", "coefficient"]]
+
+    def _get_stoich_matrix(self, stoich):
+        """Returns the reactions by molecules coefficient matrix of a single stoichiometry in
+        coordinate (COO) form, the matrix is built on first use.
+
+        Parameters
+        ----------
+        stoich : str
+            The stoichiometry to access (default/cp/cp3/etc)
+
+        Returns
+        -------
+        ret : dict
+            The reaction names ("names"), the unique molecule ids ("molecules"), and the row,
+            column, and value of each nonzero entry ("rows", "cols", "coefficients")
+        """
+
+        if stoich not in self._stoich_matrix_cache:
+            index = self._get_rxn_index(stoich)
+
+            rows, names = pd.factorize(index["name"])
+            cols, molecules = pd.factorize(index["molecule_id"])
+            self._stoich_matrix_cache[stoich] = {
+                "names": np.asarray(names, dtype=object),
+                "molecules": np.asarray(molecules, dtype=object),
+                "rows": rows,
+                "cols": cols,
+                "coefficients": index["coefficient"].values.astype(np.float64)
+            }
+
+        return self._stoich_matrix_cache[stoich]
+
+    @staticmethod
+    def _contract_stoichiometry(matrix, values):
+        """Contracts a stoichiometry matrix with per-molecule values to form per-reaction values.
+
+        If *any* value of a reaction is NaN the reaction value is NaN.
+
+        Parameters
+        ----------
+        matrix : dict
+            A stoichiometry matrix from `_get_stoich_matrix`
+        values : np.ndarray
+            The values of each molecule in the matrix, either of shape (nmolecules, ) or
+            (nmolecules, ncolumns)
+
+        Returns
+        -------
+        ret : np.ndarray
+            The values of each reaction in the matrix, of shape (nreactions, ) or (nreactions, ncolumns)
+        """
+        values = np.asarray(values, dtype=np.float64)
+        nrxn = len(matrix["names"])
+
+        columns = values.reshape(len(matrix["molecules"]), -1)
+        weights = matrix["coefficients"][:, None] * columns[matrix["cols"]]
+
+        # NaN propagates through the sum of each row
+        ret = np.empty((nrxn, columns.shape[1]))
+        for col in range(columns.shape[1]):
+            ret[:, col] = np.bincount(matrix["rows"], weights=weights[:, col], minlength=nrxn)
+
+        if values.ndim == 1:
+            ret = ret[:, 0]
+        return ret
+
+    def _unroll_query(self, keys, models, stoichs, field="return_result"):
+        """Unrolls a complex query into a single "flat" query for the server object and contracts
+        the results of every model chemistry with each requested stoichiometry
+
+        Parameters
+        ----------
+        keys : dict
+            Server query fields other than the method and basis
+        models : list of tuple
+            The (method, basis) pairs to query on
+        stoichs : list of str
+            The stoichiometries to access for the query (default/cp/cp3/etc)
+        field : str, optional
+            The results field to query on
+
+        Returns
+        -------
+        ret : dict of pd.DataFrame
+            A DataFrame for each stoichiometry indexed by reaction name with a column per model chemistry
+        """
+        matrices = {stoich: self._get_stoich_matrix(stoich) for stoich in stoichs}
+        molecules = pd.Index(pd.unique(np.concatenate([x["molecules"] for x in matrices.values()])))
+        lower_models = pd.MultiIndex.from_tuples([(m.lower(), b.lower()) for m, b in models])
 
-        # Join on molecule hash
-        tmp_idx = tmp_idx.merge(values, how="left", on="molecule_id")
+        query_keys = {k: v for k, v in keys.items()}
+        query_keys["method"] = list(lower_models.unique(level=0))
+        query_keys["basis"] = list(lower_models.unique(level=1))
+        query_keys["molecule_id"] = list(molecules)
+        query_keys["projection"] = {field: True, "molecule_id": True, "method": True, "basis": True}
+        results = pd.DataFrame(
+            self.client.get_results(**query_keys), columns=["molecule_id", "method", "basis", field])
 
-        # Apply stoich values
-        for col in values.columns:
-            if col == "molecule_id": continue
-            tmp_idx[col] *= tmp_idx["coefficient"]
-        tmp_idx = tmp_idx.drop(['stoichiometry', 'molecule_id', 'coefficient'], axis=1)
+        # Pivot into a molecules by model chemistry matrix, method/basis pairs outside of the request are dropped
+        rows = molecules.get_indexer(results["molecule_id"])
+        cols = lower_models.get_indexer(pd.MultiIndex.from_arrays([results["method"], results["basis"]]))
+        mask = (rows >= 0) & (cols >= 0)
 
-        # If *any* value is null in the stoich sum, the whole thing should be Null. Pandas is being too clever
-        null_mask = tmp_idx.copy()
-        null_mask[field] = null_mask[field].isnull()
-        null_mask = null_mask.groupby(["name"]).sum() != False
+        values = np.full((len(molecules), len(models)), np.nan)
+        values[rows[mask], cols[mask]] = pd.to_numeric(results[field], errors="coerce").values[mask]
 
-        tmp_idx = tmp_idx.groupby(["name"]).sum()
-        tmp_idx[null_mask] = np.nan
+        ret = {}
+        for stoich, matrix in matrices.items():
+            rxn_values = self._contract_stoichiometry(matrix, values[molecules.get_indexer(matrix["molecules"])])
+            ret[stoich] = pd.DataFrame(rxn_values, index=pd.Index(matrix["names"], name="name"))
 
-        return tmp_idx
+        return ret
 
     def query(self,
               method,
@@ -198,15 +458,9 @@ class Dataset(Collection):
         if not reaction_results and (self.client is None):
             raise AttributeError("DataBase: FractalClient was not set.")
 
-        query_keys = {
-            "method": method.lower(),
-            "basis": basis.lower(),
-            "driver": driver.lower(),
-            "options": options.lower(),
-            "program": program.lower(),
-        }
         # # If reaction results
         if reaction_results:
+            self._load_entries()
             tmp_idx = pd.Series(index=self.df.index)
             for rxn in self.data["reactions"]:
                 try:
@@ -221,27 +475,128 @@ class Dataset(Collection):
             self.df[prefix + method + postfix] = tmp_idx
             return True
 
-        # if self.data["ds_type"].lower() == "ie":
-        #     _ie_helper(..)
+        return self.batch_query([(method, basis)],
+                                driver=driver,
+                                options=options,
+                                program=program,
+                                stoich=stoich,
+                                prefix=prefix,
+                                postfix=postfix,
+                                scale=scale,
+                                field=field,
+                                ignore_ds_type=ignore_ds_type)
+
+    def batch_query(self,
+                    models,
+                    driver="energy",
+                    options="default",
+                    program="psi4",
+                    stoich="default",
+                    prefix="",
+                    postfix="",
+                    scale="kcal",
+                    field="return_result",
+                    ignore_ds_type=False):
+        """
+        Queries the local Portal for several model chemistries at once. All results are pulled
+        in a single server query and every new column of the DataFrame is filled together.
+
+        Parameters
+        ----------
+        models : list of tuple
+            The (method, basis) pairs to query on, [("B3LYP", "6-31G"), ("MP2", "cc-pVDZ")]
+        driver : str, optional
+            Search within energy, gradient, etc computations
+        options : str, optional
+            The option token desired
+        program : str, optional
+            The program to query on
+        stoich : str
+            The given stoichiometry to compute.
+        prefix : str
+            A prefix given to the resulting column names.
+        postfix : str
+            A postfix given to the resulting column names.
+        scale : str, double
+            All units are based in Hartree, the default scaling is to kcal/mol.
+        field : str, optional
+            The result field to query on
+        ignore_ds_type : bool
+            Override of "ie" for "rxn" db types.
+
+        Returns
+        -------
+        success : bool
+            Returns True if the requested query was successful or not.
+
+        Examples
+        --------
+
+        ds.batch_query([("B3LYP", "aug-cc-pVDZ"), ("MP2", "aug-cc-pVDZ")], stoich="cp", prefix="cp-")
+
+        """
+
+        if self.client is None:
+            raise AttributeError("DataBase: FractalClient was not set.")
+
+        models = list(dict.fromkeys((method, basis) for method, basis in models))
+        if len(models) == 0:
+            return True
+
+        query_keys = {
+            "driver": driver.lower(),
+            "options": options.lower(),
+            "program": program.lower(),
+        }
 
         if (not ignore_ds_type) and (self.data["ds_type"].lower() == "ie"):
             monomer_stoich = ''.join([x for x in stoich if not x.isdigit()]) + '1'
-            tmp_idx_complex = self._unroll_query(query_keys, stoich, field=field)
-            tmp_idx_monomers = self._unroll_query(query_keys, monomer_stoich, field=field)
+            stoichs = [stoich, monomer_stoich]
+        else:
+            stoichs = [stoich]
+
+        # Check the on-disk cache, only usable if the local reactions are those on the server
+        tmp_idx = None
+        cache_key = None
+        if (self._query_cache is not None) and self._matches_server():
+            lower_models = [[method.lower(), basis.lower()] for method, basis in models]
+            cache_key = {
+                "server": self.client.address,
+                "collection": self.data["id"],
+                "models": lower_models,
+                "keys": query_keys,
+                "stoichiometry": stoichs,
+                "field": field
+            }
+            cache_stamp = {
+                "version": self.data["version"],
+                "results": self.client.get_results_summary(
+                    method=list(dict.fromkeys(x[0] for x in lower_models)),
+                    basis=list(dict.fromkeys(x[1] for x in lower_models)),
+                    **query_keys)
+            }
+            tmp_idx = self._query_cache.get(cache_key, cache_stamp)
+
+        if tmp_idx is None:
+            tmp_idx = self._unroll_query(query_keys, models, stoichs, field=field)
 
             # Combine
-            tmp_idx = tmp_idx_complex - tmp_idx_monomers
+            if len(stoichs) > 1:
+                tmp_idx = tmp_idx[stoichs[0]] - tmp_idx[stoichs[1]]
+            else:
+                tmp_idx = tmp_idx[stoichs[0]]
 
-        else:
-            tmp_idx = self._unroll_query(query_keys, stoich, field=field)
-        tmp_idx.columns = [prefix + method + '/' + basis + postfix for x in tmp_idx.columns]
+            if cache_key is not None:
+                tmp_idx.columns = [str(x) for x in range(len(models))]
+                self._query_cache.set(cache_key, cache_stamp, tmp_idx)
+
+        tmp_idx.columns = [prefix + method + '/' + basis + postfix for method, basis in models]
 
         # scale
-        tmp_idx = tmp_idx.apply(lambda x: pd.to_numeric(x, errors='ignore'))
-        tmp_idx[tmp_idx.select_dtypes(include=['number']).columns] *= constants.get_scale(scale)
+        tmp_idx *= constants.get_scale(scale)
 
         # Apply to df
-        self.df[tmp_idx.columns] = tmp_idx
+        self.df[list(tmp_idx.columns)] = tmp_idx.reindex(self.df.index)
 
         return True
 
@@ -276,7 +631,9 @@ class Dataset(Collection):
         Returns
         -------
         ret : dict
-            A dictionary of the keys for all requested computations
+            A summary of the request, the task ids of newly submitted computations ("submitted"),
+            the molecule ids which already have results ("completed"), the ids of computations
+            already in the queue ("queue"), and any errors reported by the server ("errors").
         """
         if self.client is None:
             raise AttributeError("DataBase: Compute: Client was not set.")
@@ -284,36 +641,35 @@ class Dataset(Collection):
         # Figure out molecules that we need
         if (not ignore_ds_type) and (self.data["ds_type"].lower() == "ie"):
             monomer_stoich = ''.join([x for x in stoich if not x.isdigit()]) + '1'
-            tmp_monomer = self.rxn_index[self.rxn_index["stoichiometry"] == monomer_stoich].copy()
-            tmp_complex = self.rxn_index[self.rxn_index["stoichiometry"] == stoich].copy()
-            tmp_idx = pd.concat((tmp_monomer, tmp_complex), axis=0)
+            stoichs = [monomer_stoich, stoich]
         else:
-            tmp_idx = self.rxn_index[self.rxn_index["stoichiometry"] == stoich].copy()
+            stoichs = [stoich]
 
-        tmp_idx = tmp_idx.reset_index(drop=True)
-
-        # There could be duplicates so take the unique and save the map
-        umols, uidx = np.unique(tmp_idx["molecule_id"], return_index=True)
+        umols = pd.unique(np.concatenate([self._get_stoich_matrix(x)["molecules"] for x in stoichs]))
 
+        # Only molecules without a result are submitted
         complete_values = self.client.get_results(
-            molecule_id=list(umols), driver=driver, options=options, program=program, method=method, basis=basis)
-
-        if len(complete_values):
-            raise KeyError("Completed expressions not yet implemented")
-        # mask = pd.isnull(values)
-        # compute_list = []
-        # for idx, row in pd.isnull(values).iterrows():
-
-        #     for method in values.columns[row]:
-        #         tmp = {}
-        #         tmp["molecule_id"] = idx
-        #         tmp["modelchem"] = method
-        #         for k, v in other_fields.items():
-        #             tmp[k] = v
-        #         compute_list.append(tmp)
-        compute_list = list(umols)
-
-        ret = self.client.add_compute(program, method.lower(), basis.lower(), driver, options, compute_list)
+            molecule_id=list(umols),
+            driver=driver,
+            options=options,
+            program=program,
+            method=method,
+            basis=basis,
+            projection={"molecule_id": True})
+        completed = set(x["molecule_id"] for x in complete_values)
+
+        compute_list = [x for x in umols if x not in completed]
+
+        ret = {"submitted": [], "completed": [x for x in umols if x in completed], "queue": [], "errors": []}
+        for start in range(0, len(compute_list), self._compute_chunk_size):
+            chunk = compute_list[start:start + self._compute_chunk_size]
+            r = self.client.add_compute(
+                program, method.lower(), basis.lower(), driver, options, chunk, return_full=True)
+
+            ret["submitted"].extend(r["data"]["submitted"])
+            ret["completed"].extend(r["data"]["completed"])
+            ret["queue"].extend(r["data"]["queue"])
+            ret["errors"].extend(r["meta"]["errors"])
 
         return ret
 
@@ -326,8 +682,53 @@ class Dataset(Collection):
         ret : list of str
             The names of all reactions in the database
         """
+        if self.data["reactions"] is None:
+            if self._lazy_index is None:
+                self._lazy_index = [x["name"] for page in self._iter_reaction_pages(["name"]) for x in page]
+            return list(self._lazy_index)
+
         return [x["name"] for x in self.data["reactions"]]
 
+    def _get_name_index(self):
+        """Returns the {name : position} index of the reactions, duplicated names map to None.
+        The index is rebuilt if the reactions were replaced or modified outside of `add_rxn`,
+        lookups should go through `_rxn_position` which also catches reactions edited in place.
+        """
+        self._load_entries()
+
+        reactions = self.data["reactions"]
+        stale = (self._name_index is None) or (self._name_index[0] is not reactions)
+        if stale or (self._name_index[1] != len(reactions)):
+            index = {}
+            for num, x in enumerate(reactions):
+                index[x["name"]] = None if x["name"] in index else num
+
+            self._name_index = (reactions, len(reactions), index)
+
+        return self._name_index[2]
+
+    def _rxn_position(self, name, rescan=False):
+        """Returns the position of a reaction, None if multiple reactions share the name or -1 if
+        there is no such reaction.
+
+        Reactions may be renamed or replaced in place, a lookup which finds a reaction of another
+        name rescans the reactions. So does a lookup which misses if `rescan` is set or reactions
+        were handed out by `get_rxn` since the last scan.
+        """
+        position = self._get_name_index().get(name, -1)
+        if position is None:
+            return position
+
+        if (position >= 0) and (self.data["reactions"][position]["name"] == name):
+            return position
+
+        if (position >= 0) or rescan or self._rxns_exposed:
+            self._name_index = None
+            self._rxns_exposed = False
+            position = self._get_name_index().get(name, -1)
+
+        return position
+
     def get_rxn(self, name):
         """
         Returns the JSON object of a specific reaction.
@@ -344,18 +745,17 @@ class Dataset(Collection):
 
         """
 
-        found = []
-        for num, x in enumerate(self.data["reactions"]):
-            if x["name"] == name:
-                found.append(num)
+        position = self._rxn_position(name, rescan=True)
 
-        if len(found) == 0:
+        if position == -1:
             raise KeyError("Dataset:get_rxn: Reaction name '{}' not found.".format(name))
 
-        if len(found) > 1:
+        if position is None:
             raise KeyError("Dataset:get_rxn: Multiple reactions of name '{}' found. Dataset failure.".format(name))
 
-        return self.data["reactions"][found[0]]
+        # The reaction may be edited by the caller
+        self._rxns_exposed = True
+        return self.data["reactions"][position]
 
     # Statistical quantities
     def statistics(self, stype, value, bench="Benchmark"):
@@ -377,6 +777,69 @@ class Dataset(Collection):
         """
         return statistics.wrap_statistics(stype, self.df, value, bench)
 
+    def statistics_table(self,
+                         stypes,
+                         value=None,
+                         bench="Benchmark",
+                         groupby=None,
+                         bootstrap=0,
+                         ci=0.95,
+                         seed=None,
+                         processes=None):
+        """Computes several statistics for several methods at once, optionally for each group of
+        reactions sharing an attribute and with bootstrap confidence intervals.
+
+        Parameters
+        ----------
+        stypes : str or list of str
+            The statistics to compute ("ME", "MUE", "MURE", "RMSE", "MAXUE")
+        value : str or list of str, optional
+            The methods to compare, if None all columns other than the benchmark are compared
+        bench : str, optional
+            The benchmark method for the comparison
+        groupby : str or list of str, optional
+            The reaction attributes to group the statistics by
+        bootstrap : int, optional
+            The number of bootstrap resamples used for confidence intervals, if zero no intervals
+            are computed
+        ci : float, optional
+            The width of the bootstrap confidence intervals
+        seed : int, optional
+            The seed of the bootstrap resamples
+        processes : int, optional
+            The number of worker processes to evaluate bootstrap resamples with
+
+        Returns
+        -------
+        ret : pd.DataFrame
+            A DataFrame with a column for each method, see `statistics.statistics_table`
+
+        Examples
+        --------
+
+        ds.statistics_table(["MUE", "RMSE"], groupby="R", bootstrap=1000)
+
+        """
+        if value is None:
+            value = [x for x in self.df.columns if x != bench]
+
+        groups = None
+        if groupby is not None:
+            if isinstance(groupby, str):
+                groupby = [groupby]
+
+            if self.data["reactions"] is None:
+                reactions = [x for page in self._iter_reaction_pages(["name", "attributes"]) for x in page]
+            else:
+                reactions = self.data["reactions"]
+
+            groups = pd.DataFrame([[rxn.get("attributes", {}).get(x, None) for x in groupby] for rxn in reactions],
+                                  index=[rxn["name"] for rxn in reactions],
+                                  columns=groupby)
+
+        return statistics.statistics_table(
+            self.df, stypes, value, bench, groups=groups, bootstrap=bootstrap, ci=ci, seed=seed, processes=processes)
+
     # Visualization
     def ternary(self, cvals=None):
         """Plots a ternary diagram of the DataBase if available
@@ -422,7 +885,15 @@ class Dataset(Collection):
 
         """
 
-        ret = {}
+        return self._parse_stoichiometry(stoichiometry, {})
+
+    def _parse_stoichiometry(self, stoichiometry, molecule_cache):
+        """Parses a stoichiometry list, see `parse_stoichiometry`. The `molecule_cache` maps
+        {molecule string : molecule hash} and may be shared between calls so that repeated
+        molecule strings are only parsed once. Molecule classes are hashed on every use and
+        registered by hash, so each distinct molecule is only serialized into the pending
+        molecules once.
+        """
 
         mol_hashes = []
         mol_values = []
@@ -445,18 +916,13 @@ class Dataset(Collection):
                 molecule_hash = mol
 
             elif isinstance(mol, str):
-                qcf_mol = molecule.Molecule(mol)
-
-                molecule_hash = qcf_mol.get_hash()
+                if mol not in molecule_cache:
+                    molecule_cache[mol] = self._add_pending_molecule(molecule.Molecule(mol))
 
-                if molecule_hash not in list(self._new_molecule_jsons):
-                    self._new_molecule_jsons[molecule_hash] = qcf_mol.to_json()
+                molecule_hash = molecule_cache[mol]
 
             elif isinstance(mol, molecule.Molecule):
-                molecule_hash = mol.get_hash()
-
-                if molecule_hash not in list(self._new_molecule_jsons):
-                    self._new_molecule_jsons[molecule_hash] = mol.to_json()
+                molecule_hash = self._add_pending_molecule(mol)
 
             else:
                 raise TypeError(
@@ -469,42 +935,29 @@ class Dataset(Collection):
         # Sum together the coefficients of duplicates
         ret = {}
         for mol, coef in zip(mol_hashes, mol_values):
-            if mol in list(ret):
+            if mol in ret:
                 ret[mol] += coef
             else:
                 ret[mol] = coef
 
         return ret
 
-    def add_rxn(self, name, stoichiometry, reaction_results=None, attributes=None, other_fields=None):
+    def _add_pending_molecule(self, mol):
+        """Registers a Molecule to be added to the server on save and returns its hash.
         """
-        Adds a reaction to a database object.
-
-        Parameters
-        ----------
-        name : str
-            Name of the reaction.
-        stoichiometry : list or dict
-            Either a list or dictionary of lists
-        reaction_results :  dict or None, Optional, Default: None
-            A dictionary of the computed total interaction energy results
-        attributes :  dict or None, Optional, Default: None
-            A dictionary of attributes to assign to the reaction
-        other_fields : dict or None, Optional, Default: None
-            A dictionary of additional user defined fields to add to the reaction entry
+        mol_json = mol.to_json()
+        molecule_hash = molecule.hash_json(mol_json)
 
-        Notes
-        -----
-
-        Examples
-        --------
-
-        Returns
-        -------
-        ret : dict
-            A complete JSON specification of the reaction
+        if molecule_hash not in self._new_molecule_jsons:
+            self._new_molecule_jsons[molecule_hash] = mol_json
 
+        return molecule_hash
 
+    def _build_rxn(self, name, stoichiometry, reaction_results=None, attributes=None, other_fields=None,
+                   molecule_cache=None):
+        """
+        Builds the JSON specification of a reaction without adding it, see `add_rxn`. A
+        `molecule_cache` may be shared between reactions, see `_parse_stoichiometry`.
         """
         if reaction_results is None:
             reaction_results = {}
@@ -512,27 +965,23 @@ class Dataset(Collection):
             attributes = {}
         if other_fields is None:
             other_fields = {}
+        if molecule_cache is None:
+            molecule_cache = {}
         rxn = {"name": name}
 
-        # Set name
-        if name in self.get_index():
-            raise KeyError(
-                "Dataset: Name '{}' already exists. "
-                "Please either delete this entry or call the update function.".format(name))
-
         # Set stoich
         if isinstance(stoichiometry, dict):
             rxn["stoichiometry"] = {}
 
-            if "default" not in list(stoichiometry):
+            if "default" not in stoichiometry:
                 raise KeyError("Dataset:add_rxn: Stoichiometry dict must have a 'default' key.")
 
             for k, v in stoichiometry.items():
-                rxn["stoichiometry"][k] = self.parse_stoichiometry(v)
+                rxn["stoichiometry"][k] = self._parse_stoichiometry(v, molecule_cache)
 
         elif isinstance(stoichiometry, (tuple, list)):
             rxn["stoichiometry"] = {}
-            rxn["stoichiometry"]["default"] = self.parse_stoichiometry(stoichiometry)
+            rxn["stoichiometry"]["default"] = self._parse_stoichiometry(stoichiometry, molecule_cache)
         else:
             raise TypeError("Dataset:add_rxn: Type of stoichiometry input was not recognized:",
                             type(stoichiometry))
@@ -549,7 +998,7 @@ class Dataset(Collection):
         for k, v in other_fields.items():
             rxn[k] = v
 
-        if "default" in list(reaction_results):
+        if "default" in reaction_results:
             rxn["reaction_results"] = reaction_results
         elif isinstance(reaction_results, dict):
             rxn["reaction_results"] = {}
@@ -557,10 +1006,182 @@ class Dataset(Collection):
         else:
             raise TypeError("Passed in reaction_results not understood.")
 
-        self.data["reactions"].append(rxn)
+        return rxn
+
+    def _append_rxns(self, rxns):
+        """Appends built reactions to the Dataset and keeps the indices current.
+        """
+        index = self._get_name_index()
+        reactions = self.data["reactions"]
+
+        for rxn in rxns:
+            index[rxn["name"]] = len(reactions)
+            reactions.append(rxn)
+
+        self._name_index = (reactions, len(reactions), index)
+        self._rxn_index_cache = {}
+        self._stoich_matrix_cache = {}
+
+    def add_rxn(self, name, stoichiometry, reaction_results=None, attributes=None, other_fields=None):
+        """
+        Adds a reaction to a database object.
+
+        Parameters
+        ----------
+        name : str
+            Name of the reaction.
+        stoichiometry : list or dict
+            Either a list or dictionary of lists
+        reaction_results :  dict or None, Optional, Default: None
+            A dictionary of the computed total interaction energy results
+        attributes :  dict or None, Optional, Default: None
+            A dictionary of attributes to assign to the reaction
+        other_fields : dict or None, Optional, Default: None
+            A dictionary of additional user defined fields to add to the reaction entry
+
+        Notes
+        -----
+
+        Examples
+        --------
+
+        Returns
+        -------
+        ret : dict
+            A complete JSON specification of the reaction
+
+
+        """
+
+        # Set name
+        if self._rxn_position(name) != -1:
+            raise KeyError(
+                "Dataset: Name '{}' already exists. "
+                "Please either delete this entry or call set_rxn.".format(name))
+
+        rxn = self._build_rxn(
+            name, stoichiometry, reaction_results=reaction_results, attributes=attributes, other_fields=other_fields)
+        self._append_rxns([rxn])
+
+        return rxn
+
+    def set_rxn(self, name, stoichiometry, reaction_results=None, attributes=None, other_fields=None):
+        """
+        Replaces an existing reaction of the database object. Reactions should be edited through
+        this function, reactions edited in place are not uploaded when the Dataset is saved.
+
+        Parameters
+        ----------
+        name : str
+            Name of the reaction to replace.
+        stoichiometry : list or dict
+            Either a list or dictionary of lists
+        reaction_results :  dict or None, Optional, Default: None
+            A dictionary of the computed total interaction energy results
+        attributes :  dict or None, Optional, Default: None
+            A dictionary of attributes to assign to the reaction
+        other_fields : dict or None, Optional, Default: None
+            A dictionary of additional user defined fields to add to the reaction entry
+
+        Returns
+        -------
+        ret : dict
+            A complete JSON specification of the reaction
+        """
+
+        position = self._rxn_position(name, rescan=True)
+        if position == -1:
+            raise KeyError("Dataset:set_rxn: Reaction name '{}' not found.".format(name))
+
+        if position is None:
+            raise KeyError("Dataset:set_rxn: Multiple reactions of name '{}' found. Dataset failure.".format(name))
+
+        rxn = self._build_rxn(
+            name, stoichiometry, reaction_results=reaction_results, attributes=attributes, other_fields=other_fields)
+        self._set_entry("reactions", position, rxn)
+
+        # Values computed for the old reaction no longer apply
+        self._rxn_index_cache = {}
+        self._stoich_matrix_cache = {}
+        if name in self.df.index:
+            self.df.loc[name, :] = np.nan
 
         return rxn
 
+    def add_rxns(self, reactions):
+        """
+        Adds many reactions to a database object at once. Molecules shared between reactions are
+        only parsed and hashed once. If any reaction is invalid no reactions are added.
+
+        Parameters
+        ----------
+        reactions : list of dict or pd.DataFrame
+            The reactions to add, each with a "name" and "stoichiometry" and optionally
+            "reaction_results", "attributes", and "other_fields", see `add_rxn`. A DataFrame
+            holds one reaction per row with these as columns, if there is no "name" column the
+            index is used as the name.
+
+        Returns
+        -------
+        ret : list of dict
+            The complete JSON specifications of the reactions
+
+        Examples
+        --------
+
+        ds.add_rxns([{"name": "rxn1", "stoichiometry": [(mol1, 1.0), (mol2, -1.0)]},
+                     {"name": "rxn2", "stoichiometry": [(mol1, 1.0), (mol3, -1.0)]}])
+
+        """
+
+        if isinstance(reactions, pd.DataFrame):
+            frame = reactions
+            if "name" not in frame.columns:
+                frame = frame.rename_axis("name").reset_index()
+
+            records = []
+            for row in frame.to_dict("records"):
+                records.append({k: v for k, v in row.items() if not (np.isscalar(v) and pd.isnull(v))})
+            reactions = records
+
+        keys = {"name", "stoichiometry", "reaction_results", "attributes", "other_fields"}
+
+        names = set()
+        molecule_cache = {}
+        pending = set(self._new_molecule_jsons)
+
+        rxns = []
+        try:
+            for entry in reactions:
+                remain = set(entry) - keys
+                if remain:
+                    raise KeyError("Dataset:add_rxns: Reaction found unknown keys {}.".format(list(remain)))
+
+                name = entry["name"]
+                if (self._rxn_position(name) != -1) or (name in names):
+                    raise KeyError(
+                        "Dataset: Name '{}' already exists. "
+                        "Please either delete this entry or call set_rxn.".format(name))
+                names.add(name)
+
+                rxns.append(
+                    self._build_rxn(
+                        name,
+                        entry["stoichiometry"],
+                        reaction_results=entry.get("reaction_results", None),
+                        attributes=entry.get("attributes", None),
+                        other_fields=entry.get("other_fields", None),
+                        molecule_cache=molecule_cache))
+        except Exception:
+            # Nothing from a failed batch is kept
+            for key in set(self._new_molecule_jsons) - pending:
+                del self._new_molecule_jsons[key]
+            raise
+
+        self._append_rxns(rxns)
+
+        return rxns
+
     def add_ie_rxn(self, name, mol, **kwargs):
         """Add a interaction energy reaction entry to the database. Automatically
         builds CP and no-CP reactions for the fragmented molecule.
@@ -587,6 +1208,56 @@ class Dataset(Collection):
         return self.add_rxn(
             name, stoichiometry, reaction_results=reaction_results, attributes=attributes, other_fields=other_fields)
 
+    def add_ie_rxns(self, reactions, processes=None, **kwargs):
+        """Adds many interaction energy reactions to the database at once, see `add_ie_rxn`.
+        The fragments of each complex are built and hashed in batches, optionally in parallel.
+
+        Parameters
+        ----------
+        reactions : list of dict
+            The reactions to add, each with a "name" and a multi-fragment "molecule" and optionally
+            "reaction_results", "attributes", and "other_fields"
+        processes : int, optional
+            The number of worker processes to build fragments with, if None the fragments are
+            built in the current process
+        **kwargs
+            Additional kwargs to pass into `build_ie_fragments` for every reaction.
+
+        Returns
+        -------
+        ret : list of dict
+            The JSON representations of the new reactions.
+        """
+
+        reactions = list(reactions)
+        for entry in reactions:
+            if ("name" not in entry) or ("molecule" not in entry):
+                raise KeyError("Dataset:add_ie_rxns: Each reaction requires a 'name' and a 'molecule'.")
+
+        jobs = [(entry["molecule"], dict(kwargs, name=entry["name"])) for entry in reactions]
+        if processes is None:
+            built = [_build_ie_stoichiometry(job) for job in jobs]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+                chunksize = max(1, len(jobs) // (4 * processes))
+                built = list(executor.map(_build_ie_stoichiometry, jobs, chunksize=chunksize))
+
+        bulk = []
+        molecule_jsons = {}
+        for entry, (stoichiometry, jsons) in zip(reactions, built):
+            molecule_jsons.update(jsons)
+
+            rxn = {k: entry[k] for k in ["reaction_results", "attributes", "other_fields"] if k in entry}
+            rxn["name"] = entry["name"]
+            rxn["stoichiometry"] = stoichiometry
+            bulk.append(rxn)
+
+        ret = self.add_rxns(bulk)
+        for k, v in molecule_jsons.items():
+            self._new_molecule_jsons.setdefault(k, v)
+
+        return ret
+
     @staticmethod
     def build_ie_fragments(mol, **kwargs):
         """
@@ -639,6 +1310,15 @@ class Dataset(Collection):
         # Build some info
         fragment_range = list(range(max_frag))
 
+        # Each fragment appears in every n-body level above its own, build it once
+        fragments = {}
+
+        def get_fragment(real, ghost):
+            key = (real, tuple(ghost))
+            if key not in fragments:
+                fragments[key] = mol.get_fragment(real, ghost, orient=True)
+            return fragments[key]
+
         # Loop over the bodis
         for nbody in range(1, max_nbody):
             nocp_tmp = []
@@ -649,10 +1329,10 @@ class Dataset(Collection):
                 coef = take_nk * sign
                 for frag in it.combinations(fragment_range, k):
                     if do_default:
-                        nocp_tmp.append((mol.get_fragment(frag, orient=True), coef))
+                        nocp_tmp.append((get_fragment(frag, []), coef))
                     if do_cp:
                         ghost = list(set(fragment_range) - set(frag))
-                        cp_tmp.append((mol.get_fragment(frag, ghost, orient=True), coef))
+                        cp_tmp.append((get_fragment(frag, ghost), coef))
 
             if do_default:
                 ret["default" + str(nbody)] = nocp_tmp
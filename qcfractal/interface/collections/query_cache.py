@@ -0,0 +1,131 @@
+"""
+A persistent on-disk cache of Collection queries
+"""
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    import fastparquet
+except ImportError:
+    fastparquet = None
+
+
+def _normalize(obj):
+    """Round trips an object through JSON so that it compares equal to a stored copy.
+    """
+    return json.loads(json.dumps(obj, sort_keys=True, default=str))
+
+
+class QueryCache:
+    """
+    Stores the results of Collection queries on disk so that they can be reused across sessions.
+
+    Each entry is looked up by a key (server, collection, model chemistry, stoichiometry, etc)
+    and holds a stamp describing the server state it was built from. An entry is only returned
+    if its stamp matches the current one. Entries are written as Parquet files if pyarrow or
+    fastparquet is available, and as pickles otherwise.
+    """
+
+    def __init__(self, path):
+        """
+        Parameters
+        ----------
+        path : str
+            The directory to hold the cache, created if it does not exist
+        """
+        self.path = os.path.abspath(os.path.expanduser(path))
+        os.makedirs(self.path, exist_ok=True)
+
+        if (pyarrow is not None) or (fastparquet is not None):
+            self.format = "parquet"
+        else:
+            self.format = "pickle"
+
+    def __repr__(self):
+        return "QueryCache(path='{}', format='{}')".format(self.path, self.format)
+
+    def _filename(self, key):
+        digest = hashlib.sha1(json.dumps(_normalize(key), sort_keys=True).encode("UTF-8")).hexdigest()
+        return os.path.join(self.path, digest)
+
+    def get(self, key, stamp):
+        """Returns a cached DataFrame.
+
+        Parameters
+        ----------
+        key : dict
+            The description of the query
+        stamp : dict
+            The current state of the data behind the query
+
+        Returns
+        -------
+        pd.DataFrame or None
+            The cached DataFrame, None if it is missing or its stamp does not match
+        """
+        filename = self._filename(key)
+
+        try:
+            with open(filename + ".json", "r") as handle:
+                meta = json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+        if meta["stamp"] != _normalize(stamp):
+            return None
+
+        try:
+            if meta["format"] == "parquet":
+                return pd.read_parquet(filename + ".parquet")
+            else:
+                return pd.read_pickle(filename + ".pkl")
+        except (OSError, ValueError, ImportError):
+            return None
+
+    def set(self, key, stamp, frame):
+        """Writes a DataFrame to the cache, replacing any previous entry.
+
+        Parameters
+        ----------
+        key : dict
+            The description of the query
+        stamp : dict
+            The state of the data behind the query
+        frame : pd.DataFrame
+            The DataFrame to cache, column names must be strings
+        """
+        filename = self._filename(key)
+
+        # The stamp is only present while matching data is on disk
+        try:
+            os.remove(filename + ".json")
+        except FileNotFoundError:
+            pass
+
+        if self.format == "parquet":
+            data_filename = filename + ".parquet"
+            frame.to_parquet(data_filename + ".tmp")
+        else:
+            data_filename = filename + ".pkl"
+            frame.to_pickle(data_filename + ".tmp", compression=None)
+        os.replace(data_filename + ".tmp", data_filename)
+
+        with open(filename + ".json.tmp", "w") as handle:
+            json.dump({"key": _normalize(key), "stamp": _normalize(stamp), "format": self.format}, handle)
+        os.replace(filename + ".json.tmp", filename + ".json")
+
+    def clear(self):
+        """Removes all entries from the cache.
+        """
+        for filename in os.listdir(self.path):
+            if filename.endswith((".json", ".parquet", ".pkl", ".tmp")):
+                os.remove(os.path.join(self.path, filename))
@@ -20,6 +20,34 @@ MASS_NOISE = 6
 CHARGE_NOISE = 4
 
 
+def hash_json(json_data):
+    """
+    Returns the hash of the JSON form of a Molecule, this avoids building the JSON
+    twice when both the JSON and the hash are needed.
+
+    Parameters
+    ----------
+    json_data : dict
+        The JSON form of a Molecule from `Molecule.to_json`
+
+    Returns
+    -------
+    str
+        The hash of the Molecule
+    """
+
+    m = hashlib.sha1()
+    concat = ""
+
+    for field in schema.get_hash_fields("molecule"):
+        if field not in json_data:
+            continue
+        concat += json.dumps(json_data[field])
+
+    m.update(concat.encode("utf-8"))
+    return m.hexdigest()
+
+
 class Molecule:
     """
     This is a Mongo QCDB molecule class.
@@ -717,17 +745,7 @@ class Molecule:
         Returns the hash of the molecule.
         """
 
-        m = hashlib.sha1()
-        concat = ""
-
-        tmp_json = self.to_json()
-        for field in schema.get_hash_fields("molecule"):
-            if field not in tmp_json:
-                continue
-            concat += json.dumps(tmp_json[field])
-
-        m.update(concat.encode("utf-8"))
-        return m.hexdigest()
+        return hash_json(self.to_json())
 
     def get_molecular_formula(self):
         """
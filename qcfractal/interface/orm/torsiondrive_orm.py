@@ -157,6 +157,36 @@ class TorsionDriveORM:
 
         return self._cache["history"]
 
+    def get_trajectories(self, projection=None):
+        """Pulls the gradient trajectories of every optimization in the history in a single request.
+
+        Parameters
+        ----------
+        projection : None, optional
+            A dictionary of the project to apply to each document
+
+        Returns
+        -------
+        dict
+            The trajectories of each optimization in the history, a list of results documents per
+            optimization
+        """
+
+        keys = []
+        locators = []
+        for key, procedures in self.get_history().items():
+            for procedure in procedures:
+                locator = copy.deepcopy(procedure._trajectory)
+                locator["projection"] = projection
+                locators.append(locator)
+                keys.append(key)
+
+        ret = {key: [] for key in self._optimization_history}
+        for key, trajectory in zip(keys, self._client.locator(locators)):
+            ret[key].append(trajectory)
+
+        return ret
+
     def final_energies(self, key=None):
         """
         Provides the final optimized energies at each grid point.
@@ -0,0 +1,375 @@
+"""
+Serialization helpers for the wire format between the FractalClient and the FractalServer.
+"""
+
+import datetime
+import json
+import math
+
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = [
+    "get_mime_type", "get_stream_mime_type", "get_encoding", "serialize", "deserialize", "serialize_stream",
+    "deserialize_stream", "register_json_backend", "set_json_backend", "get_json_backend"
+]
+
+# Maps {encoding : MIME type}
+_mime_types = {
+    "json": "application/json",
+    "msgpack": "application/msgpack",
+}
+
+# Maps {MIME type : encoding}, includes common aliases
+_mime_lookup = {v: k for k, v in _mime_types.items()}
+_mime_lookup["application/x-msgpack"] = "msgpack"
+
+# Maps {encoding : MIME type} of a stream of documents, JSON documents are newline-delimited
+# while msgpack documents are self-delimiting and simply concatenated
+_stream_mime_types = {
+    "json": "application/x-ndjson",
+    "msgpack": "application/msgpack",
+}
+_mime_lookup["application/x-ndjson"] = "json"
+
+# msgpack extension code for typed NumPy buffers
+_NUMPY_EXT_CODE = 78
+
+
+def _check_encoding(encoding):
+    encoding = encoding.lower()
+    if encoding not in _mime_types:
+        raise KeyError("Encoding '{}' not understood, available encodings: {}.".format(
+            encoding, list(_mime_types.keys())))
+
+    if (encoding == "msgpack") and (msgpack is None):
+        raise ImportError("The msgpack encoding requires msgpack, please install this python module.")
+
+    return encoding
+
+
+def get_mime_type(encoding):
+    """Returns the MIME type for a given encoding
+
+    Parameters
+    ----------
+    encoding : str
+        The encoding name ("json", "msgpack")
+
+    Returns
+    -------
+    str
+        The MIME type of the encoding
+    """
+    return _mime_types[_check_encoding(encoding)]
+
+
+def get_stream_mime_type(encoding):
+    """Returns the MIME type of a stream of documents for a given encoding
+
+    Parameters
+    ----------
+    encoding : str
+        The encoding name ("json", "msgpack")
+
+    Returns
+    -------
+    str
+        The MIME type of the document stream
+    """
+    return _stream_mime_types[_check_encoding(encoding)]
+
+
+def get_encoding(header, default="json"):
+    """Parses a Content-Type or Accept header into an available encoding.
+
+    Parameters
+    ----------
+    header : str or None
+        The header to parse, multiple MIME types may be comma separated.
+    default : str, optional
+        The encoding to fall back to if no known MIME types are found.
+
+    Returns
+    -------
+    str
+        The first available encoding found in the header.
+    """
+    if not header:
+        return default
+
+    for mime in header.split(","):
+        mime = mime.split(";")[0].strip().lower()
+        if mime not in _mime_lookup:
+            continue
+
+        encoding = _mime_lookup[mime]
+        if (encoding == "msgpack") and (msgpack is None):
+            continue
+
+        return encoding
+
+    return default
+
+
+def _msgpack_encode_ext(obj):
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return obj.tolist()
+
+        obj = np.ascontiguousarray(obj)
+        header = msgpack.packb([obj.dtype.str, obj.shape])
+        return msgpack.ExtType(_NUMPY_EXT_CODE, header + obj.tobytes())
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+
+    raise TypeError("Object of type {} is not msgpack serializable".format(type(obj).__name__))
+
+
+def _msgpack_decode_ext(code, data):
+    if code == _NUMPY_EXT_CODE:
+        unpacker = msgpack.Unpacker(use_list=False)
+        unpacker.feed(data)
+        dtype, shape = unpacker.unpack()
+        offset = unpacker.tell()
+
+        # Views into the original buffer, no copy
+        return np.frombuffer(data, dtype=np.dtype(dtype), offset=offset).reshape(shape)
+
+    return msgpack.ExtType(code, data)
+
+
+def _json_encode_ext(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, np.generic):
+        return obj.item()
+    elif isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def _stdlib_json_dumps(data):
+    return json.dumps(data, default=_json_encode_ext).encode("UTF-8")
+
+
+def _stdlib_json_loads(blob):
+    if isinstance(blob, bytes):
+        blob = blob.decode("UTF-8")
+    return json.loads(blob)
+
+
+def _has_nonfinite(data):
+    """
+    Checks if an object holds NaN or infinite floats.
+    """
+    if isinstance(data, float):
+        return not math.isfinite(data)
+    elif isinstance(data, dict):
+        return any(_has_nonfinite(v) for v in data.values())
+    elif isinstance(data, (list, tuple)):
+        return any(_has_nonfinite(v) for v in data)
+    elif isinstance(data, np.ndarray) and (data.dtype.kind in "fc"):
+        return not np.isfinite(data).all()
+    elif isinstance(data, np.floating):
+        return not np.isfinite(data)
+
+    return False
+
+
+def _orjson_dumps(data):
+    # NumPy arrays and datetimes are written natively without an intermediate list conversion
+    ret = orjson.dumps(data, default=_json_encode_ext, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+
+    # orjson writes non-finite floats as null, fall back so that they are written as NaN/Infinity like the
+    # stdlib backend. Without a null in the output there cannot have been any.
+    if (b"null" in ret) and _has_nonfinite(data):
+        return _stdlib_json_dumps(data)
+
+    return ret
+
+
+def _orjson_loads(blob):
+    try:
+        return orjson.loads(blob)
+    except orjson.JSONDecodeError:
+        # orjson rejects the NaN/Infinity written by the stdlib backend
+        return _stdlib_json_loads(blob)
+
+
+# Maps {name : (dumps, loads)} for all known JSON backends
+_json_backends = {"stdlib": (_stdlib_json_dumps, _stdlib_json_loads)}
+if orjson is not None:
+    _json_backends["orjson"] = (_orjson_dumps, _orjson_loads)
+
+_json_backend = {"name": None, "dumps": None, "loads": None}
+
+
+def register_json_backend(name, dumps, loads):
+    """Registers a new JSON backend which can then be selected with `set_json_backend`.
+
+    Parameters
+    ----------
+    name : str
+        The name of the backend
+    dumps : callable
+        Takes a Python object and returns the encoded JSON as bytes. Must handle NumPy arrays
+        and datetime objects.
+    loads : callable
+        Takes JSON as bytes or str and returns a Python object.
+    """
+    _json_backends[name.lower()] = (dumps, loads)
+
+
+def set_json_backend(name=None):
+    """Sets the JSON backend used by both the FractalClient and the FractalServer.
+
+    Parameters
+    ----------
+    name : str, optional
+        The backend to use ("orjson", "stdlib", or a registered name). If None, the
+        fastest available backend is chosen.
+    """
+    if name is None:
+        name = "orjson" if "orjson" in _json_backends else "stdlib"
+
+    name = name.lower()
+    if name not in _json_backends:
+        raise KeyError("JSON backend '{}' not understood, available backends: {}.".format(
+            name, list(_json_backends.keys())))
+
+    _json_backend["name"] = name
+    _json_backend["dumps"], _json_backend["loads"] = _json_backends[name]
+
+
+def get_json_backend():
+    """Returns the name of the current JSON backend.
+
+    Returns
+    -------
+    str
+        The current JSON backend
+    """
+    return _json_backend["name"]
+
+
+set_json_backend()
+
+
+def serialize(data, encoding):
+    """Encodes a Python object into bytes for transfer.
+
+    Parameters
+    ----------
+    data : dict
+        The object to serialize
+    encoding : str
+        The encoding to use ("json", "msgpack")
+
+    Returns
+    -------
+    bytes
+        The encoded object
+    """
+    encoding = _check_encoding(encoding)
+
+    if encoding == "json":
+        return _json_backend["dumps"](data)
+    else:
+        return msgpack.packb(data, default=_msgpack_encode_ext, use_bin_type=True)
+
+
+def deserialize(blob, encoding):
+    """Decodes bytes from a transfer into a Python object.
+
+    NumPy arrays sent with the msgpack encoding are returned as read-only arrays
+    that directly view the incoming buffer.
+
+    Parameters
+    ----------
+    blob : bytes
+        The encoded object
+    encoding : str
+        The encoding used ("json", "msgpack")
+
+    Returns
+    -------
+    dict
+        The decoded object
+    """
+    encoding = _check_encoding(encoding)
+
+    if encoding == "json":
+        return _json_backend["loads"](blob)
+    else:
+        return msgpack.unpackb(blob, ext_hook=_msgpack_decode_ext, raw=False, strict_map_key=False)
+
+
+def serialize_stream(documents, encoding):
+    """Encodes a sequence of documents into bytes which may be appended to a document stream.
+
+    Parameters
+    ----------
+    documents : iterable of dict
+        The documents to serialize
+    encoding : str
+        The encoding to use ("json", "msgpack")
+
+    Returns
+    -------
+    bytes
+        The encoded documents
+    """
+    encoding = _check_encoding(encoding)
+
+    if encoding == "json":
+        return b"".join(serialize(doc, encoding) + b"\n" for doc in documents)
+    else:
+        return b"".join(serialize(doc, encoding) for doc in documents)
+
+
+def deserialize_stream(chunks, encoding):
+    """Decodes a document stream, documents are yielded as soon as they are complete.
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        The stream as it arrives, chunks do not need to align with document boundaries
+    encoding : str
+        The encoding used ("json", "msgpack")
+
+    Yields
+    ------
+    dict
+        The decoded documents
+    """
+    encoding = _check_encoding(encoding)
+
+    if encoding == "json":
+        buffer = b""
+        for chunk in chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line:
+                    yield deserialize(line, encoding)
+
+        if buffer.strip():
+            yield deserialize(buffer, encoding)
+    else:
+        unpacker = msgpack.Unpacker(ext_hook=_msgpack_decode_ext, raw=False, strict_map_key=False)
+        for chunk in chunks:
+            unpacker.feed(chunk)
+            yield from unpacker
@@ -1,5 +1,8 @@
 """A module for statistical quantities.
 """
+import concurrent.futures
+import warnings
+
 import numpy as np
 import pandas as pd
 
@@ -11,21 +14,32 @@ import pandas as pd
 # def unsigned_error(value, bench):
 #     return np.abs(value - bench)
 
+# All statistics skip missing (NaN) values and reduce over `axis`, so many columns and
+# bootstrap resamples can be evaluated at once.
+
 
-def mean_signed_error(value, bench):
-    return np.mean(value - bench)
+def mean_signed_error(value, bench, axis=0):
+    return np.nanmean(value - bench, axis=axis)
 
 
-def mean_unsigned_error(value, bench):
-    return np.mean(np.abs(value - bench))
+def mean_unsigned_error(value, bench, axis=0):
+    return np.nanmean(np.abs(value - bench), axis=axis)
 
 
 # def unsigned_relative_error(value, bench):
 #     return np.abs((value - bench) / bench) * 100
 
 
-def mean_unsigned_relative_error(value, bench):
-    return np.mean(np.abs((value - bench) / bench)) * 100
+def mean_unsigned_relative_error(value, bench, axis=0):
+    return np.nanmean(np.abs((value - bench) / bench), axis=axis) * 100
+
+
+def root_mean_square_error(value, bench, axis=0):
+    return np.sqrt(np.nanmean((value - bench)**2, axis=axis))
+
+
+def max_unsigned_error(value, bench, axis=0):
+    return np.nanmax(np.abs(value - bench), axis=axis)
 
 
 # def weighted_unsigned_relative_error(value, bench, weight):
@@ -42,13 +56,178 @@ _stats_dict['ME'] = mean_signed_error
 _stats_dict['MUE'] = mean_unsigned_error
 # _stats_dict['URE'] = unsigned_relative_error
 _stats_dict['MURE'] = mean_unsigned_relative_error
+_stats_dict['RMSE'] = root_mean_square_error
+_stats_dict['MAXUE'] = max_unsigned_error
 # _stats_dict['WURE'] = weighted_unsigned_relative_error
 # _stats_dict['WMURE'] = weighted_mean_unsigned_relative_error
 
-_return_series = ['ME', 'MUE', 'MURE', 'WMURE']
+_return_series = ['ME', 'MUE', 'MURE', 'RMSE', 'MAXUE', 'WMURE']
 
 # _needs_weight = ["WURE", "WMURE"]
 
+# Number of elements evaluated per block of bootstrap resamples
+_bootstrap_block_size = 2**22
+
+
+def _evaluate(stypes, values, bench):
+    """
+    Evaluates statistics over the second to last axis of `values`.
+    """
+    with warnings.catch_warnings():
+        # Columns with no values are NaN
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.stack([_stats_dict[stype](values, bench, axis=-2) for stype in stypes])
+
+
+def _bootstrap_block(job):
+    """
+    Evaluates statistics over a block of bootstrap resamples, runs in worker processes.
+    """
+    stypes, values, bench, nresamples, seed = job
+
+    rng = np.random.default_rng(seed)
+    idx = rng.integers(0, values.shape[0], size=(nresamples, values.shape[0]))
+
+    # (nstats, nresamples, ncolumns)
+    return _evaluate(stypes, values[idx], bench[idx])
+
+
+def _bootstrap(stypes, values, bench, nresamples, seed, executor):
+    """
+    Returns the statistics of `nresamples` bootstrap resamples, (nstats, nresamples, ncolumns).
+    """
+
+    block = max(1, _bootstrap_block_size // max(1, values.size))
+    sizes = [min(block, nresamples - x) for x in range(0, nresamples, block)]
+    seeds = seed.spawn(len(sizes))
+
+    jobs = [(stypes, values, bench, size, block_seed) for size, block_seed in zip(sizes, seeds)]
+    if executor is None:
+        blocks = [_bootstrap_block(job) for job in jobs]
+    else:
+        blocks = list(executor.map(_bootstrap_block, jobs))
+
+    return np.concatenate(blocks, axis=1)
+
+
+def statistics_table(df, stypes, value, bench, groups=None, bootstrap=0, ci=0.95, seed=None, processes=None):
+    """
+    Computes several statistics for several columns of a DataFrame at once, optionally for
+    subsets of the rows and with bootstrap confidence intervals.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame holding the values
+    stypes : str or list of str
+        The statistics to compute ("ME", "MUE", "MURE", "RMSE", "MAXUE")
+    value : str or list of str
+        The columns to compare against the benchmark
+    bench : str or np.ndarray or pd.Series
+        The benchmark column of the DataFrame or the benchmark values
+    groups : pd.Series or pd.DataFrame, optional
+        The group(s) of each row, aligned with the DataFrame index. Statistics are computed for
+        each group separately, rows without a group are skipped.
+    bootstrap : int, optional
+        The number of bootstrap resamples used for confidence intervals, if zero no intervals
+        are computed
+    ci : float, optional
+        The width of the bootstrap confidence intervals
+    seed : int, optional
+        The seed of the bootstrap resamples
+    processes : int, optional
+        The number of worker processes to evaluate bootstrap resamples with, if None the resamples
+        are evaluated in the current process
+
+    Returns
+    -------
+    ret : pd.DataFrame
+        A DataFrame with a column for each value. The index holds the groups (if any), the
+        "statistic", and if bootstrapped an "estimate" level of "value", "lower", and "upper".
+    """
+
+    if isinstance(stypes, str):
+        stypes = [stypes]
+    if isinstance(value, str):
+        value = [value]
+
+    stypes = list(stypes)
+    value = list(value)
+    for stype in stypes:
+        if stype not in _stats_dict:
+            raise KeyError("Statistic '{}' not understood, available statistics: {}.".format(
+                stype, list(_stats_dict)))
+
+    # Get benchmark
+    if isinstance(bench, str):
+        rbench = df[bench].values
+    elif isinstance(bench, pd.Series):
+        rbench = bench.reindex(df.index).values
+    elif isinstance(bench, np.ndarray):
+        if (len(bench.shape) != 1) or (bench.shape[0] != df.shape[0]):
+            raise ValueError('Only 1D numpy arrays of the DataFrame length can be passed to statistical quantities.')
+        rbench = bench
+    else:
+        raise TypeError('Benchmark must a column of the dataframe or a 1D numpy array.')
+
+    values = df[value].values.astype(np.float64)
+    rbench = rbench.astype(np.float64)[:, None]
+
+    # Row positions of each group
+    if groups is None:
+        group_rows = {None: np.arange(df.shape[0])}
+        group_names = []
+    else:
+        if isinstance(groups, pd.Series) and (groups.name is None):
+            groups = groups.rename("group")
+        groups = pd.DataFrame(groups).reindex(df.index)
+        group_names = list(groups.columns)
+        group_rows = groups.reset_index(drop=True).groupby(list(groups.columns), sort=True).indices
+
+    executor = None
+    if bootstrap and (processes is not None):
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes)
+
+    seed = np.random.SeedSequence(seed)
+    alpha = (1.0 - ci) / 2.0 * 100
+
+    keys = []
+    rows = []
+    try:
+        for group, idx in group_rows.items():
+            if (group is not None) and not isinstance(group, tuple):
+                group = (group, )
+            elif group is None:
+                group = ()
+
+            stats = _evaluate(stypes, values[idx], rbench[idx])
+
+            if bootstrap:
+                samples = _bootstrap(stypes, values[idx], rbench[idx], bootstrap, seed.spawn(1)[0], executor)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", category=RuntimeWarning)
+                    lower, upper = np.nanpercentile(samples, [alpha, 100 - alpha], axis=1)
+
+                for num, stype in enumerate(stypes):
+                    for estimate, data in [("value", stats), ("lower", lower), ("upper", upper)]:
+                        keys.append(group + (stype, estimate))
+                        rows.append(data[num])
+            else:
+                for num, stype in enumerate(stypes):
+                    keys.append(group + (stype, ))
+                    rows.append(stats[num])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    names = group_names + ["statistic"] + (["estimate"] if bootstrap else [])
+    if len(names) == 1:
+        index = pd.Index([x[0] for x in keys], name=names[0])
+    else:
+        index = pd.MultiIndex.from_tuples(keys, names=names)
+
+    return pd.DataFrame(np.array(rows).reshape(len(keys), len(value)), index=index, columns=value)
+
 
 def wrap_statistics(description, df, value, bench):
 
@@ -71,14 +250,15 @@ def wrap_statistics(description, df, value, bench):
         return _stats_dict[description](rvalue, rbench)
 
     elif isinstance(value, pd.DataFrame):
+        if description in _return_series:
+            return statistics_table(value, description, list(value.columns), rbench).loc[description]
         return value.apply(lambda x: _stats_dict[description](x, rbench))
 
     elif isinstance(value, (list, tuple)):
         if description in _return_series:
-            ret = pd.Series(index=value)
-        else:
-            ret = pd.DataFrame(columns=value)
+            return statistics_table(df, description, list(value), rbench).loc[description]
 
+        ret = pd.DataFrame(columns=value)
         method = _stats_dict[description]
         for col in value:
             ret[col] = method(df[col], rbench)
@@ -4,6 +4,8 @@ Tests the QCPortal database object
 
 from . import portal
 from . import test_helper as th
+import numpy as np
+import pandas as pd
 import pytest
 
 
@@ -219,3 +221,150 @@ def test_nbody_rxn(nbody_ds):
     mh = list(ne_stoich["stoichiometry"]["default"])[0]
     # print(ne_stoich)
     # _compare_rxn_stoichs(nbody_ds.ne_stoich, ne_stoich)
+
+
+def test_stoich_matrix(water_ds):
+
+    matrix = water_ds._get_stoich_matrix("default")
+    assert len(matrix["names"]) == 5
+    assert len(matrix["rows"]) == len(matrix["cols"]) == len(matrix["coefficients"])
+
+    # Every molecule is worth one, so each reaction is the sum of its coefficients
+    values = np.ones(len(matrix["molecules"]))
+    ret = dict(zip(matrix["names"], water_ds._contract_stoichiometry(matrix, values)))
+    assert ret["Water Dimer, nocp"] == pytest.approx(-1.0)
+    assert ret["Water Dimer, nocp - hash"] == pytest.approx(-1.0)
+
+    # A single missing molecule value nulls out every reaction containing it
+    values[matrix["cols"][matrix["rows"] == 0]] = np.nan
+    ret = water_ds._contract_stoichiometry(matrix, np.column_stack([values, 2 * values]))
+    assert ret.shape == (5, 2)
+    assert np.isnan(ret[0]).all()
+
+
+def test_rxn_add_many(water_ds):
+
+    dimer = portal.data.get_molecule("water_dimer_minima.psimol")
+    frag_0 = dimer.get_fragment(0, orient=True)
+    frag_1 = dimer.get_fragment(1, orient=True)
+
+    rxns = water_ds.add_rxns([{
+        "name": "Bulk 0",
+        "stoichiometry": [(dimer, 1.0), (frag_0, -1.0), (frag_1, -1.0)],
+        "attributes": {"R": "Minima"}
+    }, {
+        "name": "Bulk 1",
+        "stoichiometry": {"default": [(dimer, 1.0), (frag_0, -2.0)]}
+    }])
+    assert len(rxns) == 2
+    assert water_ds.get_rxn("Bulk 1")["stoichiometry"]["default"][frag_0.get_hash()] == -2.0
+    _compare_stoichs(water_ds.get_rxn("Bulk 0")["stoichiometry"]["default"],
+                     water_ds.get_rxn("Water Dimer, nocp")["stoichiometry"]["default"])
+
+    # DataFrames use the index as the name
+    frame = pd.DataFrame({"stoichiometry": [[(frag_0, 1.0)], [(frag_1, 1.0)]]}, index=["Bulk 2", "Bulk 3"])
+    water_ds.add_rxns(frame)
+    assert water_ds.get_index()[-2:] == ["Bulk 2", "Bulk 3"]
+    assert water_ds.get_rxn("Bulk 3")["attributes"] == {}
+
+    # A failed batch adds nothing
+    n_rxns = len(water_ds.get_index())
+    n_pending = len(water_ds._new_molecule_jsons)
+    with pytest.raises(KeyError):
+        water_ds.add_rxns([{
+            "name": "Bulk 4",
+            "stoichiometry": [(portal.data.get_molecule("water_dimer_stretch.psimol"), 1.0)]
+        }, {
+            "name": "Bulk 0",
+            "stoichiometry": [(dimer, 1.0)]
+        }])
+
+    assert len(water_ds.get_index()) == n_rxns
+    assert len(water_ds._new_molecule_jsons) == n_pending
+    with pytest.raises(KeyError):
+        water_ds.get_rxn("Bulk 4")
+
+    # Distinct Molecules are told apart by their hash, shared strings resolve to the same hash
+    stretch = portal.data.get_molecule("water_dimer_stretch.psimol")
+    rxns = water_ds.add_rxns([{
+        "name": "Bulk 5",
+        "stoichiometry": [(stretch.to_string(), 1.0), (portal.data.get_molecule("water_dimer_minima.psimol"), -1.0)]
+    }, {
+        "name": "Bulk 6",
+        "stoichiometry": [(stretch.to_string(), 1.0), (stretch, -1.0)]
+    }])
+    assert rxns[0]["stoichiometry"]["default"][dimer.get_hash()] == -1.0
+    assert list(rxns[0]["stoichiometry"]["default"])[0] == list(rxns[1]["stoichiometry"]["default"])[0]
+    assert stretch.get_hash() in rxns[1]["stoichiometry"]["default"]
+
+
+def test_rxn_edited_in_place():
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    ds = portal.collections.Dataset("In Place")
+    ds.add_rxns([{"name": "a", "stoichiometry": [(water, 1.0)]}, {"name": "b", "stoichiometry": [(water, 2.0)]}])
+
+    # Renamed reactions are found by their new name only
+    ds.get_rxn("a")["name"] = "c"
+    assert ds.get_rxn("c")["stoichiometry"] == ds.data["reactions"][0]["stoichiometry"]
+    with pytest.raises(KeyError):
+        ds.get_rxn("a")
+
+    # The old name may be reused, the new one may not
+    ds.add_rxn("a", [(water, 3.0)])
+    with pytest.raises(KeyError):
+        ds.add_rxn("c", [(water, 3.0)])
+
+    # Reactions replaced at the same position
+    ds.data["reactions"][1] = dict(ds.data["reactions"][1], name="d")
+    assert ds.get_rxn("d") is ds.data["reactions"][1]
+    with pytest.raises(KeyError):
+        ds.get_rxn("b")
+
+
+@pytest.mark.parametrize("processes", [None, 2])
+def test_nbody_rxn_add_many(nbody_ds, processes):
+
+    dimer = portal.data.get_molecule("water_dimer_minima.psimol")
+    ds = portal.collections.Dataset("N-Body Bulk")
+    ds.add_ie_rxns([{
+        "name": "Water Dimer",
+        "molecule": dimer.to_string()
+    }, {
+        "name": "Ne Tetramer",
+        "molecule": portal.data.get_molecule("neon_tetramer.psimol"),
+        "attributes": {"R": 4}
+    }],
+                   processes=processes)
+
+    for name in ["Water Dimer", "Ne Tetramer"]:
+        _compare_rxn_stoichs(nbody_ds.get_rxn(name), ds.get_rxn(name))
+
+    assert ds.get_rxn("Ne Tetramer")["attributes"] == {"R": 4}
+    assert set(ds._new_molecule_jsons) == set(nbody_ds._new_molecule_jsons)
+
+
+def test_statistics_table(water_ds):
+
+    names = water_ds.get_index()
+    water_ds.df = pd.DataFrame(index=names)
+    water_ds.df["Benchmark"] = np.zeros(len(names))
+    water_ds.df["M1"] = np.arange(len(names), dtype=float)
+    water_ds.df["M2"] = -np.ones(len(names))
+
+    ret = water_ds.statistics_table(["ME", "MUE", "MAXUE"])
+    assert list(ret.columns) == ["M1", "M2"]
+    assert ret.loc["MUE", "M1"] == pytest.approx(water_ds.statistics("MUE", "M1"))
+    assert ret.loc["ME", "M2"] == pytest.approx(-1.0)
+    assert ret.loc["MAXUE", "M1"] == pytest.approx(len(names) - 1)
+
+    # Grouped by reaction attributes
+    groups = water_ds.statistics_table("MUE", "M1", groupby="R")
+    minima = [num for num, name in enumerate(names) if water_ds.get_rxn(name)["attributes"].get("R") == "Minima"]
+    assert groups.loc[("Minima", "MUE"), "M1"] == pytest.approx(np.mean(minima))
+
+    # Bootstrap intervals bracket the estimate and are reproducible
+    boot = water_ds.statistics_table("MUE", ["M1", "M2"], bootstrap=200, seed=4)
+    assert boot.loc[("MUE", "lower"), "M1"] <= boot.loc[("MUE", "value"), "M1"] <= boot.loc[("MUE", "upper"), "M1"]
+    assert boot.loc[("MUE", "lower"), "M2"] == pytest.approx(1.0)
+    assert boot.equals(water_ds.statistics_table("MUE", ["M1", "M2"], bootstrap=200, seed=4))
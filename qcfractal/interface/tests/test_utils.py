@@ -2,6 +2,8 @@
 Tests for the interface utility functions.
 """
 
+import pytest
+
 from . import portal
 
 
@@ -18,3 +20,100 @@ def test_replace_dict_keys():
 
     ret = portal.dict_utils.replace_dict_keys({5: {5: 10}}, {5: 10})
     assert ret == {10: {10: 10}}
+
+
+def test_serialization_json_numpy():
+    import numpy as np
+
+    blob = portal.serialization.serialize({"geometry": np.arange(6.0).reshape(2, 3)}, "json")
+    ret = portal.serialization.deserialize(blob, "json")
+    assert ret == {"geometry": [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]}
+
+
+def test_serialization_msgpack_numpy():
+    import numpy as np
+    pytest.importorskip("msgpack")
+
+    data = {"geometry": np.arange(6.0).reshape(2, 3), "symbols": ["He", "He"], "charge": np.float64(0.0)}
+    blob = portal.serialization.serialize(data, "msgpack")
+    ret = portal.serialization.deserialize(blob, "msgpack")
+
+    assert isinstance(ret["geometry"], np.ndarray)
+    assert ret["geometry"].dtype == np.float64
+    assert np.allclose(ret["geometry"], data["geometry"])
+    assert ret["symbols"] == data["symbols"]
+    assert ret["charge"] == 0.0
+
+
+@pytest.mark.parametrize("encoding", ["json", "msgpack"])
+def test_serialization_stream(encoding):
+    if encoding == "msgpack":
+        pytest.importorskip("msgpack")
+
+    docs = [{"id": str(x), "return_result": float(x)} for x in range(10)]
+    blob = portal.serialization.serialize_stream(docs[:4], encoding)
+    blob += portal.serialization.serialize_stream(docs[4:], encoding)
+
+    # Chunks split documents at arbitrary points
+    chunks = [blob[x:x + 7] for x in range(0, len(blob), 7)]
+    assert list(portal.serialization.deserialize_stream(chunks, encoding)) == docs
+
+
+def test_serialization_get_encoding():
+
+    assert portal.serialization.get_encoding(None) == "json"
+    assert portal.serialization.get_encoding("*/*") == "json"
+    assert portal.serialization.get_encoding("application/json; charset=UTF-8") == "json"
+
+
+@pytest.mark.parametrize("backend", ["stdlib", "orjson"])
+def test_serialization_json_backends(backend):
+    import datetime
+    import numpy as np
+
+    if backend not in portal.serialization._json_backends:
+        pytest.skip("JSON backend {} not available.".format(backend))
+
+    current = portal.serialization.get_json_backend()
+    portal.serialization.set_json_backend(backend)
+    try:
+        data = {
+            "geometry": np.arange(6.0).reshape(2, 3),
+            "created_on": datetime.datetime(2018, 11, 1, 12, 30),
+            "value": np.float64(1.5),
+        }
+        ret = portal.serialization.deserialize(portal.serialization.serialize(data, "json"), "json")
+    finally:
+        portal.serialization.set_json_backend(current)
+
+    assert ret["geometry"] == [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]]
+    assert ret["created_on"].startswith("2018-11-01T12:30:00")
+    assert ret["value"] == 1.5
+
+
+@pytest.mark.parametrize("dump_backend", ["stdlib", "orjson"])
+@pytest.mark.parametrize("load_backend", ["stdlib", "orjson"])
+def test_serialization_json_nonfinite(dump_backend, load_backend):
+    import math
+    import numpy as np
+
+    for backend in [dump_backend, load_backend]:
+        if backend not in portal.serialization._json_backends:
+            pytest.skip("JSON backend {} not available.".format(backend))
+
+    current = portal.serialization.get_json_backend()
+    data = {"value": float("nan"), "values": [1.0, float("inf")], "array": np.array([np.nan, 2.0]), "tag": None}
+    try:
+        portal.serialization.set_json_backend(dump_backend)
+        blob = portal.serialization.serialize(data, "json")
+
+        portal.serialization.set_json_backend(load_backend)
+        ret = portal.serialization.deserialize(blob, "json")
+    finally:
+        portal.serialization.set_json_backend(current)
+
+    # Non-finite floats survive any combination of backends
+    assert math.isnan(ret["value"])
+    assert ret["values"] == [1.0, float("inf")]
+    assert math.isnan(ret["array"][0]) and ret["array"][1] == 2.0
+    assert ret["tag"] is None
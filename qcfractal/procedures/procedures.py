@@ -50,7 +50,8 @@ def procedure_single_input_parser(storage, data):
 
     # Remove duplicates
     query = {k: data["meta"][k] for k in ["driver", "method", "basis", "options", "program"]}
-    query["molecule_id"] = [x["molecule"]["id"] for x in runs.values()]
+    # The run keys hold the molecule id
+    query["molecule_id"] = [k[1] for k in runs.keys()]
 
     search = storage.get_results(query, projection={"molecule_id": True})
     completed = set(x["molecule_id"] for x in search["data"])
@@ -58,10 +59,10 @@ def procedure_single_input_parser(storage, data):
     # Construct full tasks
     full_tasks = []
     for k, v in runs.items():
-        if v["molecule"]["id"] in completed:
+        if k[1] in completed:
             continue
 
-        query["molecule_id"] = v["molecule"]["id"]
+        query["molecule_id"] = k[1]
         keys, hash_index = procedures_util.single_run_hash(query)
         v["hash_index"] = hash_index
 
@@ -166,20 +167,32 @@ def procedure_optimization_input_parser(storage, data, duplicate_id="hash_index"
     # Unpack individual QC jobs
     runs, errors = procedures_util.unpack_single_run_meta(storage, data["meta"]["qc_meta"], data["data"])
 
+    # Stored options are referenced rather than embedded in every task, inline keywords are embedded
+    keywords_spec = None
     if "options" in data["meta"]:
-        keywords = storage.get_options([(data["meta"]["program"], data["meta"]["options"])])["data"][0]
+        option_key = (data["meta"]["program"], data["meta"]["options"])
+        found = storage.get_options([option_key])["data"]
+        if len(found) == 0:
+            raise KeyError("Options '{}' of program '{}' not found.".format(option_key[1], option_key[0]))
+
+        keywords = found[0]
         del keywords["program"]
         del keywords["name"]
+        keywords_spec = procedures_util.task_reference(
+            "options", option_key, update={"program": data["meta"]["qc_meta"]["program"]})
     elif "keywords" in data["meta"]:
         keywords = data["meta"]["keywords"]
     else:
         keywords = {}
 
     keywords["program"] = data["meta"]["qc_meta"]["program"]
+    if keywords_spec is None:
+        keywords_spec = keywords
+
     template = json.dumps({
         "schema_name": "qc_schema_optimization_input",
         "schema_version": 1,
-        "keywords": keywords,
+        "keywords": keywords_spec,
         "qcfractal_tags": data["meta"]
     })
 
@@ -197,7 +210,7 @@ def procedure_optimization_input_parser(storage, data, duplicate_id="hash_index"
         keys = {
             "type": "optimization",
             "program": data["meta"]["program"],
-            "keywords": packet["keywords"],
+            "keywords": keywords,
             "single_key": k,
         }
 
@@ -7,6 +7,127 @@ import hashlib
 import json
 
 from .. import interface
+from ..storage_sockets import storage_utils
+
+
+def _fetch_molecules(storage, keys):
+    found = storage.get_molecules(list(keys), index="id")["data"]
+    return {mol["id"]: mol for mol in found}
+
+
+def _fetch_options(storage, keys):
+    found = storage.get_options([tuple(k) for k in keys])["data"]
+    return {(opt.pop("program"), opt.pop("name")): opt for opt in found}
+
+
+# Maps {table : fetch(storage, keys) -> {key : document}} for documents which tasks may reference
+_reference_fetchers = {"molecules": _fetch_molecules, "options": _fetch_options}
+
+
+def task_reference(table, key, update=None):
+    """Builds a placeholder for a database document within a task spec so that the document is not
+    stored with every task. Placeholders are replaced by `materialize_tasks`.
+
+    Parameters
+    ----------
+    table : str
+        The table of the document, "molecules" (the key is the molecule id) or "options"
+        (the key is the (program, name) pair)
+    key : str or tuple
+        The key of the document
+    update : dict, optional
+        Fields set on the document when it is materialized, for documents which are used as a
+        template
+
+    Returns
+    -------
+    dict
+        The placeholder
+    """
+
+    if table not in _reference_fetchers:
+        raise KeyError("Task references to table '{}' are not supported.".format(table))
+
+    if isinstance(key, tuple):
+        key = list(key)
+
+    ret = {"__reference__": {"table": table, "key": key}}
+    if update:
+        ret["__reference__"]["update"] = update
+
+    return ret
+
+
+def _find_references(obj, found):
+    """
+    Appends the (container, position, table, key, update) of each placeholder within an object.
+    """
+
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, list):
+        items = enumerate(obj)
+    else:
+        return
+
+    for k, v in items:
+        if isinstance(v, dict) and ("__reference__" in v):
+            ref = v["__reference__"]
+            key = tuple(ref["key"]) if isinstance(ref["key"], list) else ref["key"]
+            found.append((obj, k, ref["table"], key, ref.get("update", None)))
+        else:
+            _find_references(v, found)
+
+
+def materialize_tasks(storage, tasks):
+    """Replaces the placeholders of task specs with the referenced documents in-place, all
+    documents of a table are pulled in a single query.
+
+    Parameters
+    ----------
+    storage : DBSocket
+        A live connection to the current database.
+    tasks : list of dict
+        The tasks to materialize
+
+    Returns
+    -------
+    tuple(list, list)
+        The tasks which are ready to run and a (task id, error message) list of the tasks
+        whose documents could not be found.
+    """
+
+    references = []
+    for task in tasks:
+        found = []
+        _find_references(task["spec"], found)
+        references.append(found)
+
+    # Maps {table : set(keys)}
+    keys = {}
+    for found in references:
+        for container, position, table, key, update in found:
+            keys.setdefault(table, set()).add(key)
+
+    documents = {table: _reference_fetchers[table](storage, table_keys) for table, table_keys in keys.items()}
+
+    ready = []
+    errors = []
+    for task, found in zip(tasks, references):
+        missing = [(table, key) for container, position, table, key, update in found if key not in documents[table]]
+        if missing:
+            errors.append((task["id"], "Referenced documents not found: {}".format(missing)))
+            continue
+
+        # Each task is given its own JSON copy of the documents
+        for container, position, table, key, update in found:
+            container[position] = storage_utils.arrays_to_lists(documents[table][key])
+            if update:
+                container[position].update(update)
+
+        ready.append(task)
+
+    return ready, errors
 
 
 def unpack_single_run_meta(storage, meta, molecules):
@@ -50,10 +171,10 @@ def unpack_single_run_meta(storage, meta, molecules):
     indexed_molecules = {k: v for k, v in enumerate(molecules)}
     raw_molecules_query = storage.mixed_molecule_get(indexed_molecules)
 
-    # Pull out the needed options
-    option_set = storage.get_options([(meta["program"], meta["options"])])["data"][0]
-    del option_set["name"]
-    del option_set["program"]
+    # Options and molecules are referenced rather than embedded in every task
+    option_key = (meta["program"], meta["options"])
+    if len(storage.get_options([option_key])["data"]) == 0:
+        raise KeyError("Options '{}' of program '{}' not found.".format(meta["options"], meta["program"]))
 
     # Create the "universal header"
     task_meta = json.dumps({
@@ -61,7 +182,7 @@ def unpack_single_run_meta(storage, meta, molecules):
         "schema_version": 1,
         "program": meta["program"],
         "driver": meta["driver"],
-        "keywords": option_set,
+        "keywords": task_reference("options", option_key),
         "model": {
             "method": meta["method"],
             "basis": meta["basis"]
@@ -78,7 +199,7 @@ def unpack_single_run_meta(storage, meta, molecules):
     for idx, mol in raw_molecules_query["data"].items():
 
         data = json.loads(task_meta)
-        data["molecule"] = mol
+        data["molecule"] = task_reference("molecules", mol["id"])
 
         indexer["molecule_id"] = mol["id"]
         tasks[interface.schema.format_result_indices(indexer)] = data
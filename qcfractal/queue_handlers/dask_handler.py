@@ -56,6 +56,13 @@ class DaskAdapter:
             ret.append(tag)
         return ret
 
+    def reattach_tasks(self, tasks):
+        """
+        Futures are released along with the client which submitted them, only tasks which are still
+        held by this adapter can be tracked.
+        """
+        return [x["id"] for x in tasks if x["id"] in self.queue]
+
     def aquire_complete(self):
         ret = {}
         del_keys = []
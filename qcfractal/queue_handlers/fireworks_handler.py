@@ -30,7 +30,8 @@ class FireworksAdapter:
                     args=task["spec"]["args"],
                     kwargs=task["spec"]["kwargs"],
                     stored_data_varname="fw_results"),
-                spec={"_launch_dir": "/tmp/"})
+                spec={"_launch_dir": "/tmp/",
+                      "qcfractal_task_id": tag})
             launches = self.lpad.add_wf(fw)
 
             self.queue[list(launches.values())[0]] = (tag, task["parser"], task["hooks"])
@@ -38,6 +39,35 @@ class FireworksAdapter:
 
         return ret
 
+    def reattach_tasks(self, tasks):
+        """
+        Tracks tasks whose Fireworks are still in the LaunchPad, for example after a restart.
+        """
+
+        tasks = {x["id"]: x for x in tasks}
+        tracked = {v[0] for v in self.queue.values()}
+
+        cursor = self.lpad.fireworks.find({
+            "spec.qcfractal_task_id": {
+                "$in": list(tasks)
+            }
+        }, {
+            "_id": False,
+            "fw_id": True,
+            "spec.qcfractal_task_id": True
+        })
+
+        ret = []
+        for fw in cursor:
+            tag = fw["spec"]["qcfractal_task_id"]
+            if tag not in tracked:
+                self.queue[fw["fw_id"]] = (tag, tasks[tag]["parser"], tasks[tag]["hooks"])
+                tracked.add(tag)
+                self.logger.info("Adapter: Task reattached {}".format(tag))
+            ret.append(tag)
+
+        return ret
+
     def aquire_complete(self):
         ret = {}
 
@@ -2,9 +2,10 @@
 Queue backend abstraction manager.
 """
 
+import collections
+import copy
 import logging
 import traceback
-import collections
 
 from ..web_handlers import APIHandler
 from .. import procedures
@@ -152,8 +153,10 @@ class QueueNanny:
         if open_slots == 0:
             return
 
-        # Add new jobs to queue
+        # Add new jobs to queue, the documents they reference are pulled in just before submission
         new_jobs = self.storage_socket.queue_get_next(n=open_slots)
+        new_jobs, missing = procedures.procedures_util.materialize_tasks(self.storage_socket, new_jobs)
+        self.storage_socket.queue_mark_error(missing)
         self.queue_adapter.submit_tasks(new_jobs)
 
     def update_services(self):
@@ -162,12 +165,14 @@ class QueueNanny:
 
         new_procedures = []
         complete_ids = []
+        updates = []
         for data in self.storage_socket.get_services({"id": list(self.services)})["data"]:
+            # Services modify their data in place, keep the state as read so only changes are written
+            original = copy.deepcopy(data)
             obj = services.build(data["service"], self.storage_socket, self, data)
 
             finished = obj.iterate()
-            self.storage_socket.update_services([(data["id"], obj.get_json())])
-            # print(obj.get_json())
+            updates.append((data["id"], obj.get_json(), original))
 
             if finished is not False:
                 # Decrement service lookup
@@ -179,9 +184,39 @@ class QueueNanny:
                 new_procedures.append(finished)
                 complete_ids.append(data["id"])
 
+        self.storage_socket.update_services(updates)
         self.storage_socket.add_procedures(new_procedures)
         self.storage_socket.del_services(complete_ids)
 
+    def recover(self):
+        """Rebuilds the state of the Nanny from storage, for example after a server restart.
+
+        All services in storage are resumed. Tasks marked RUNNING are handed back to the queue
+        adapter if it can still track them, all others are returned to WAITING so that they are
+        submitted again.
+
+        Returns
+        -------
+        ret : dict
+            The number of "services" resumed and tasks "reattached" and "requeued"
+        """
+
+        service_ids = {x["id"] for x in self.storage_socket.iter_services({}, projection={"_id": True})}
+        new_services = service_ids - self.services
+        self.services |= service_ids
+
+        running = list(
+            self.storage_socket.iter_queue({"status": "RUNNING"}, projection={"parser": True, "hooks": True}))
+        reattached = set(self.queue_adapter.reattach_tasks(running))
+
+        requeue = [x["id"] for x in running if x["id"] not in reattached]
+        n_requeued = self.storage_socket.queue_reset_status(requeue)
+
+        self.logger.info("QUEUE: Recovered {} services, reattached {} tasks, requeued {} tasks.".format(
+            len(new_services), len(reattached), n_requeued))
+
+        return {"services": len(new_services), "reattached": len(reattached), "requeued": n_requeued}
+
     def await_results(self):
         """A synchronous method for testing or small launches
         that awaits job completion before adding all queued results
@@ -2,6 +2,7 @@
 The FractalServer class
 """
 
+import datetime
 import logging
 import ssl
 
@@ -83,15 +84,23 @@ class FractalServer(object):
             storage_password=None,
             storage_type="mongo",
             storage_project_name="molssistorage",
+            query_limit=1000,
 
             # Queue options
             queue_socket=None,
+            queue_retention_days=7,
+            queue_archive_ttl_days=None,
 
             # Log options
             logfile_name=None):
 
         # Save local options
         self.port = port
+
+        # Finished tasks are moved to the task archive after the retention window, archived tasks
+        # are removed after the TTL (if any)
+        self.queue_retention_days = queue_retention_days
+        self.queue_archive_ttl_days = queue_archive_ttl_days
         if ssl_options is False:
             self._address = "http://localhost:" + str(self.port) + "/"
         else:
@@ -172,7 +181,8 @@ class FractalServer(object):
             username=storage_username,
             password=storage_password,
             storage_type=storage_type,
-            bypass_security=storage_bypass_security)
+            bypass_security=storage_bypass_security,
+            max_limit=query_limit)
 
         # Pull the current loop if we need it
         if io_loop is None:
@@ -190,9 +200,13 @@ class FractalServer(object):
             (r"/molecule", web_handlers.MoleculeHandler, self.objects),
             (r"/option", web_handlers.OptionHandler, self.objects),
             (r"/collection", web_handlers.CollectionHandler, self.objects),
+            (r"/collection_entry", web_handlers.CollectionEntryHandler, self.objects),
             (r"/result", web_handlers.ResultHandler, self.objects),
+            (r"/result_aggregate", web_handlers.ResultAggregateHandler, self.objects),
             (r"/procedure", web_handlers.ProcedureHandler, self.objects),
             (r"/locator", web_handlers.LocatorHandler, self.objects),
+            (r"/blob", web_handlers.BlobHandler, self.objects),
+            (r"/batch", web_handlers.BatchHandler, self.objects),
         ]
 
         # Queue handlers
@@ -236,6 +250,9 @@ class FractalServer(object):
 
         # If we have a queue socket start up the nanny
         if "queue_socket" in self.objects:
+            # Pick up services and tasks left over from a previous run
+            self.objects["queue_nanny"].recover()
+
             # Add canonical queue callback
             nanny = tornado.ioloop.PeriodicCallback(self.objects["queue_nanny"].update, 2000)
             nanny.start()
@@ -246,6 +263,12 @@ class FractalServer(object):
             nanny_services.start()
             self.periodic["queue_nanny_services"] = nanny_services
 
+        # Compact the task queue every hour
+        if self.queue_retention_days is not None:
+            archive = tornado.ioloop.PeriodicCallback(self.archive_queue, 3600 * 1000)
+            archive.start()
+            self.periodic["queue_archive"] = archive
+
         # Soft quit with a keyboard interupt
         try:
             self.loop.start()
@@ -262,6 +285,17 @@ class FractalServer(object):
 
         self.logger.info("FractalServer stopping gracefully. Stopped IOLoop.\n")
 
+    def archive_queue(self):
+        """
+        Moves finished tasks past the retention window into the task archive.
+        """
+
+        ttl = None
+        if self.queue_archive_ttl_days is not None:
+            ttl = datetime.timedelta(days=self.queue_archive_ttl_days)
+
+        return self.storage.queue_archive(datetime.timedelta(days=self.queue_retention_days), ttl=ttl)
+
     def get_address(self, function=""):
         return self._address + function
 
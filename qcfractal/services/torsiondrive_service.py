@@ -110,17 +110,16 @@ class TorsionDriveService:
         # print("rem job", self.data["remaining_jobs"])
         if self.data["remaining_jobs"] is not False:
 
-            # Create the query payload, fetching the completed required jobs and output location
-            payload = self.storage_socket.get_queue({"id": self.data["required_jobs"], "status": "COMPLETE"},
-                                                    projection={"result_location": True, "status": True})
+            # Fetch the completed required jobs and output location, old jobs may have been archived
+            job_query = self.storage_socket.queue_get_complete(
+                self.data["required_jobs"], projection={"result_location": True, "status": True})
             # If all jobs are not complete, return a False
-            if len(payload["data"]) != len(self.data["required_jobs"]):
+            if len(job_query) != len(self.data["required_jobs"]):
                 return False
 
-            job_query = payload["data"]
             # Create a lookup table for job ID mapping to result from that job in the procedure table
-            inv_job_lookup = {v["id"]: self.storage_socket.locator(v["result_location"])["data"][0]
-                              for v in job_query}
+            locations = self.storage_socket.locator([v["result_location"] for v in job_query])["data"]
+            inv_job_lookup = {v["id"]: loc[0] for v, loc in zip(job_query, locations)}
 
             # Populate job results
             job_results = {}
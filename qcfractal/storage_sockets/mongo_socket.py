@@ -12,21 +12,118 @@ except ImportError:
 import collections
 import copy
 import datetime
+import json
 import logging
+import queue
+import re
+import threading
 import bcrypt
 
 import pandas as pd
 from bson.objectid import ObjectId
 import bson.errors
+import bson.json_util
+import pymongo.monitoring
 
 from . import storage_utils
 # Pull in the hashing algorithms from the client
 from .. import interface
 
 
+# Field paths which may be grouped on or aggregated, "a" or "a.b.c"
+_field_path = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z0-9_]+)*$")
+
+# Maps {statistic : Mongo group accumulator}
+_aggregate_accumulators = {"count": "$sum", "sum": "$sum", "min": "$min", "max": "$max", "mean": "$avg"}
+
+
+# Maps {filter operator : Mongo operator}
+_filter_operators = {
+    "==": "$eq",
+    "!=": "$ne",
+    "<": "$lt",
+    "<=": "$lte",
+    ">": "$gt",
+    ">=": "$gte",
+    "in": "$in",
+    "not in": "$nin",
+    "exists": "$exists"
+}
+
+_filter_scalars = (str, int, float, bool, type(None))
+
+
+def _parse_filters(filters, lower=()):
+    """
+    Translates a list of [field, operator, value] filters into a Mongo query, all filters must match.
+
+    Only plain field paths, the operators in `_filter_operators`, and scalar (or lists of scalar)
+    values are accepted so that filters cannot inject other Mongo operators. String values of the
+    `lower` fields are lowercased to match how they are stored.
+
+    Raises a KeyError if a filter is malformed.
+    """
+
+    if not isinstance(filters, (list, tuple)):
+        raise KeyError("Filters must be a list of [field, operator, value] filters.")
+
+    ret = {}
+    for filt in filters:
+        if not isinstance(filt, (list, tuple)) or (len(filt) != 3):
+            raise KeyError("Filter {} is not a [field, operator, value] filter.".format(filt))
+
+        field, op, value = filt
+        if not isinstance(field, str) or (_field_path.match(field) is None) or (field.split(".")[0] in ["_id", "id"]):
+            raise KeyError("Filter field '{}' is not a valid field name.".format(field))
+
+        if op not in _filter_operators:
+            raise KeyError("Filter operator '{}' not understood, available operators: {}.".format(
+                op, list(_filter_operators)))
+
+        if op in ["in", "not in"]:
+            if not isinstance(value, (list, tuple)) or not all(isinstance(x, _filter_scalars) for x in value):
+                raise KeyError("Filter operator '{}' requires a list of values.".format(op))
+            value = list(value)
+        elif op == "exists":
+            if not isinstance(value, bool):
+                raise KeyError("Filter operator 'exists' requires a boolean value.")
+        elif not isinstance(value, _filter_scalars):
+            raise KeyError("Filter operator '{}' requires a single value.".format(op))
+
+        if field in lower:
+            if isinstance(value, str):
+                value = value.lower()
+            elif isinstance(value, list):
+                value = [x.lower() if isinstance(x, str) else x for x in value]
+
+        mongo_op = _filter_operators[op]
+        if mongo_op in ret.setdefault(field, {}):
+            raise KeyError("Filter operator '{}' was given twice for field '{}'.".format(op, field))
+
+        ret[field][mongo_op] = value
+
+    return ret
+
+
+def _and_queries(*queries):
+    """
+    Combines Mongo queries so that all must match, empty queries are skipped.
+    """
+
+    queries = [q for q in queries if q]
+    if len(queries) == 0:
+        return {}
+    elif len(queries) == 1:
+        return queries[0]
+    else:
+        return {"$and": queries}
+
+
 def _translate_id_index(index):
     if index in ["id", "ids"]:
         return "_id"
+    elif index == "hash_index":
+        return index
     else:
         raise KeyError("Id Index alias '{}' not understood".format(index))
 
@@ -56,6 +153,239 @@ def _str_to_indices_with_errors(ids):
     return good, bad
 
 
+def _translate_cursor_ids(cursor):
+    for d in cursor:
+        d["id"] = str(d.pop("_id"))
+        yield d
+
+
+def _mongo_key(key):
+    """
+    Checks if a key can be used within a dotted Mongo update path.
+    """
+    return isinstance(key, str) and ("." not in key) and not key.startswith("$")
+
+
+def _update_paths(old, new, prefix=""):
+    """
+    Returns the ({path: value}, {path: ""}) $set and $unset operations which turn `old` into `new`.
+
+    Nested dictionaries are descended into so that only the changed entries are written, all
+    other values (lists, scalars) are written whole when they differ.
+    """
+
+    sets = {}
+    unsets = {}
+    for k, v in new.items():
+        path = prefix + k
+        if k not in old:
+            sets[path] = v
+
+        elif isinstance(v, dict) and isinstance(old[k], dict) and all(map(_mongo_key, v)) and all(
+                map(_mongo_key, old[k])):
+            nested_sets, nested_unsets = _update_paths(old[k], v, prefix=path + ".")
+            sets.update(nested_sets)
+            unsets.update(nested_unsets)
+
+        elif (type(v) is not type(old[k])) or (v != old[k]):
+            sets[path] = v
+
+    for k in old:
+        if k not in new:
+            unsets[prefix + k] = ""
+
+    return sets, unsets
+
+
+def _winning_stages(plan):
+    """
+    Returns the (stage, index name) pairs of the winning plans within an explain() output.
+    """
+
+    stages = []
+
+    def walk(obj, winning):
+        if isinstance(obj, dict):
+            if winning and ("stage" in obj):
+                stages.append((obj["stage"], obj.get("indexName", None)))
+            for k, v in obj.items():
+                if k != "rejectedPlans":
+                    walk(v, winning or (k == "winningPlan"))
+        elif isinstance(obj, list):
+            for v in obj:
+                walk(v, winning)
+
+    walk(plan, False)
+    return stages
+
+
+class _QueryProfiler(pymongo.monitoring.CommandListener):
+    """
+    Times every command sent to the database. Commands slower than `slow_ms` are logged,
+    if an `explain` is given together with their query plan, plans which scan a whole
+    collection are flagged as missing an index.
+
+    Listeners must not block or issue commands, slow commands are explained one at a time on a
+    background thread. Slow commands which arrive while the explain queue is full are logged
+    without their plan.
+    """
+
+    # Commands which are timed, the value is the command field holding the table name
+    _timed_commands = {
+        "find": "find",
+        "getMore": "collection",
+        "aggregate": "aggregate",
+        "count": "count",
+        "distinct": "distinct",
+        "insert": "insert",
+        "update": "update",
+        "delete": "delete",
+        "findAndModify": "findAndModify"
+    }
+
+    # Commands which can be explained
+    _explained_commands = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+
+    # Command fields which are not part of the query itself
+    _session_fields = {
+        "lsid", "txnNumber", "autocommit", "startTransaction", "writeConcern", "readConcern", "$db", "$clusterTime",
+        "$readPreference"
+    }
+
+    def __init__(self, slow_ms, logger, explain=None, history=100):
+        """
+        Parameters
+        ----------
+        slow_ms : float or None
+            Commands taking at least this many milliseconds are logged, if None nothing is logged
+        logger : logging.Logger
+            The logger to report slow commands to
+        explain : callable, optional
+            Called as `explain(database, command)` and returns the explain() output of a command,
+            if None slow commands are logged without their plan
+        history : int, optional
+            The number of slow commands to keep, also the number of commands waiting to be explained
+        """
+        self.slow_ms = slow_ms
+        self.logger = logger
+        self.explain = explain
+
+        self.stats = collections.defaultdict(lambda: {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "collscans": 0})
+        self.slow_queries = collections.deque(maxlen=history)
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+        self._explain_queue = None
+        if explain is not None:
+            self._explain_queue = queue.Queue(maxsize=history)
+            threading.Thread(target=self._explain_worker, name="QueryProfiler", daemon=True).start()
+
+    def started(self, event):
+        # Do not time our own explain commands
+        if getattr(self._local, "explaining", False):
+            return
+
+        field = self._timed_commands.get(event.command_name, None)
+        if field is None:
+            return
+
+        command = {k: v for k, v in event.command.items() if k not in self._session_fields}
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command.get(field, None), command)
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        table, command = pending
+        self._record(event, table, command)
+
+    def failed(self, event):
+        with self._lock:
+            self._pending.pop((event.connection_id, event.request_id), None)
+
+    def _record(self, event, table, command):
+        duration = event.duration_micros / 1000.0
+
+        with self._lock:
+            stats = self.stats[(table, event.command_name)]
+            stats["count"] += 1
+            stats["total_ms"] += duration
+            stats["max_ms"] = max(stats["max_ms"], duration)
+
+        if (self.slow_ms is None) or (duration < self.slow_ms):
+            return
+
+        query = {k: v for k, v in command.items() if k not in {event.command_name, "documents"}}
+        slow = {
+            "table": table,
+            "command": event.command_name,
+            "duration_ms": duration,
+            "plan": None,
+            "collscan": False,
+            "query": query
+        }
+        with self._lock:
+            self.slow_queries.append(slow)
+
+        if (self._explain_queue is not None) and (event.command_name in self._explained_commands):
+            try:
+                self._explain_queue.put_nowait((event.database_name, command, slow))
+                return
+            except queue.Full:
+                pass
+
+        self._report(slow)
+
+    def _explain_worker(self):
+        """
+        Explains queued slow commands, runs on its own thread.
+        """
+
+        # Do not time our own explain commands
+        self._local.explaining = True
+
+        while True:
+            database, command, slow = self._explain_queue.get()
+            try:
+                try:
+                    slow["plan"] = _winning_stages(self.explain(database, command))
+                except pymongo.errors.PyMongoError as e:
+                    self.logger.warning("MongoSocket: Could not explain {} on '{}': {}".format(
+                        slow["command"], slow["table"], str(e)))
+
+                slow["collscan"] = (slow["plan"] is not None) and any(stage == "COLLSCAN"
+                                                                      for stage, index in slow["plan"])
+                if slow["collscan"]:
+                    with self._lock:
+                        self.stats[(slow["table"], slow["command"])]["collscans"] += 1
+
+                self._report(slow)
+            finally:
+                self._explain_queue.task_done()
+
+    def wait(self):
+        """
+        Blocks until all queued slow commands have been explained.
+        """
+        if self._explain_queue is not None:
+            self._explain_queue.join()
+
+    def _report(self, slow):
+        msg = "MongoSocket: Slow {} on '{}' took {:.1f} ms".format(slow["command"], slow["table"],
+                                                                  slow["duration_ms"])
+        if slow["plan"] is not None:
+            msg += ", plan {}".format(" <- ".join(stage if index is None else "{}({})".format(stage, index)
+                                                  for stage, index in slow["plan"]))
+        if slow["collscan"]:
+            msg += ", collection scan (missing index?)"
+        self.logger.warning(msg + ": {}".format(bson.json_util.dumps(slow["query"])))
+
+
 class MongoSocket:
     """
     This is a Mongo QCDB socket class.
@@ -70,10 +400,22 @@ class MongoSocket:
                  bypass_security=False,
                  authMechanism="SCRAM-SHA-1",
                  authSource=None,
+                 max_limit=1000,
+                 slow_query_ms=100,
+                 explain_slow_queries=False,
+                 blob_threshold=4096,
                  logger=None):
         """
         Constructs a new socket where url and port points towards a Mongod instance.
 
+        Every database command is timed, commands taking at least `slow_query_ms` milliseconds are
+        logged (None disables the log). If `explain_slow_queries` is set their query plans are
+        looked up on a background thread and logged as well, this issues an additional command for
+        each slow command.
+
+        Large output fields of results (see `_blob_fields`) whose JSON form is at least `blob_threshold`
+        bytes are compressed into the "blobs" table and replaced by a {"blob_id": id} reference
+        (None keeps every field inline).
         """
 
         # Logging data
@@ -85,6 +427,9 @@ class MongoSocket:
         # Secuity
         self._bypass_security = bypass_security
 
+        # The maximum number of documents returned in a single page
+        self._max_limit = max_limit
+
         # Static data
         self._table_indices = {
             "collections": interface.schema.get_table_indices("collection"),
@@ -94,7 +439,10 @@ class MongoSocket:
             "procedures": interface.schema.get_table_indices("procedure"),
             "service_queue": interface.schema.get_table_indices("service_queue"),
             "task_queue": interface.schema.get_table_indices("task_queue"),
-            "users": ("username", )
+            "task_archive": ("hash_index", ),
+            "collection_entries": ("collection_id", "field", "position"),
+            "users": ("username", ),
+            "blobs": ()
         }
         self._valid_tables = set(self._table_indices.keys())
         self._table_unique_indices = {
@@ -105,20 +453,60 @@ class MongoSocket:
             "procedures": False,
             "service_queue": False,
             "task_queue": False,
+            "task_archive": False,
+            "collection_entries": True,
             "users": True,
+            "blobs": False,
         }
 
         self._lower_results_index = ["method", "basis", "options", "program"]
 
+        # Collection list fields stored in the "collection_entries" table with one document per entry
+        self._collection_entry_fields = ("reactions", )
+
+        # The number of trailing error characters kept for archived tasks
+        self._archive_error_length = 2000
+
+        # Numeric array fields stored as typed binary buffers, {table : fields}
+        self._array_fields = {"molecules": ("geometry", ), "results": ("return_result", )}
+
+        # Fields moved out of line into the "blobs" table when large, {table : fields}
+        self._blob_fields = {"results": ("stdout", "stderr")}
+        self._blob_threshold = blob_threshold
+
+        # Additional indices required by the queries below, {table : [index, ...]}
+        self._table_extra_indices = {
+            "procedures": [[("hash_index", pymongo.ASCENDING)]],
+            "results": [[("modified_on", pymongo.DESCENDING)]],
+            "task_queue": [
+                [("status", pymongo.ASCENDING), ("tag", pymongo.ASCENDING), ("created_on", pymongo.DESCENDING)],
+                [("status", pymongo.ASCENDING), ("modified_on", pymongo.ASCENDING)],
+            ],
+            "task_archive": [[("hash_index", pymongo.ASCENDING)], [("archived_on", pymongo.ASCENDING)]],
+        }
+
         self._url = url
         self._port = port
 
+        # Times every command, slow commands may be explained on the same client
+        explain = None
+        if explain_slow_queries:
+            explain = lambda database, command: self.client[database].command({"explain": command,
+                                                                               "verbosity": "queryPlanner"})
+        self._profiler = _QueryProfiler(slow_query_ms, self.logger, explain=explain)
+
         # Are we authenticating?
         if username:
             self.client = pymongo.MongoClient(
-                url, port, username=username, password=password, authMechanism=authMechanism, authSource=authSource)
+                url,
+                port,
+                username=username,
+                password=password,
+                authMechanism=authMechanism,
+                authSource=authSource,
+                event_listeners=[self._profiler])
         else:
-            self.client = pymongo.MongoClient(url, port)
+            self.client = pymongo.MongoClient(url, port, event_listeners=[self._profiler])
 
         try:
             version_array = self.client.server_info()['versionArray']
@@ -168,21 +556,101 @@ class MongoSocket:
         # Build the indices
         for table, indices in self._table_indices.items():
             idx = [(x, pymongo.ASCENDING) for x in indices if x != "hash_index"]
+            if len(idx) == 0:
+                continue
             self._tables[table].create_index(idx, unique=self._table_unique_indices[table])
 
         # Special queue index, hash_index should be unique
         for table in ["task_queue", "service_queue"]:
             self._tables[table].create_index([("hash_index", pymongo.ASCENDING)], unique=True)
 
+        for table, indices in self._table_extra_indices.items():
+            for idx in indices:
+                self._tables[table].create_index(idx)
+
         # Return the success array
         return table_creation
 
+    def get_query_profile(self):
+        """
+        Returns the timings of the database commands run by this socket.
+
+        Returns
+        -------
+        dict
+            "commands" holds the number, total and maximum time (ms), and number of collection scans
+            of each (table, command) pair, slowest first. "slow_queries" holds the most recent slow
+            commands with their query plans.
+        """
+
+        with self._profiler._lock:
+            commands = [dict(table=table, command=command, **stats)
+                        for (table, command), stats in self._profiler.stats.items()]
+            slow_queries = list(self._profiler.slow_queries)
+
+        commands.sort(key=lambda x: x["total_ms"], reverse=True)
+        return {"commands": commands, "slow_queries": slow_queries}
+
     def get_project_name(self):
         return self._project_name
 
     def mixed_molecule_get(self, data):
         return storage_utils.mixed_molecule_get(self, data)
 
+    def get_limit(self, limit=None):
+        """
+        Returns the page size for a query, a requested limit is capped by the server maximum.
+        """
+        if limit is None:
+            return self._max_limit
+
+        return max(1, min(int(limit), self._max_limit))
+
+    def _find_page(self, table, query, projection=None, limit=None, cursor=None):
+        """
+        Helper function that runs a find, if a limit or cursor is given documents are returned
+        in `_id` order starting after the cursor. Returns the documents and the cursor of the
+        next page (None if there are no further pages).
+        """
+
+        if (limit is None) and (cursor is None):
+            return list(self._tables[table].find(query, projection=projection)), None
+
+        if cursor is not None:
+            try:
+                after = {"_id": {"$gt": ObjectId(cursor)}}
+            except (bson.errors.InvalidId, TypeError):
+                raise KeyError("Cursor '{}' not understood".format(cursor))
+
+            if query:
+                query = {"$and": [query, after]}
+            else:
+                query = after
+
+        # The page boundary is tracked by _id so it must be returned
+        strip_id = False
+        if isinstance(projection, dict) and (projection.get("_id", True) is False):
+            projection = copy.copy(projection)
+            del projection["_id"]
+            projection = projection or None
+            strip_id = True
+
+        found = self._tables[table].find(query, projection=projection).sort("_id", pymongo.ASCENDING)
+        if limit is not None:
+            found = found.limit(limit)
+
+        data = list(found)
+
+        next_cursor = None
+        if (limit is not None) and (len(data) == limit):
+            next_cursor = str(data[-1]["_id"])
+
+        if strip_id:
+            for d in data:
+                del d["_id"]
+
+        return data, next_cursor
+
     def _add_generic(self, data, table, return_map=True):
         """
         Helper function that facilitates adding a record.
@@ -253,18 +721,42 @@ class MongoSocket:
 
         return (self._tables[table].delete_many({index: {"$in": hashes}})).deleted_count
 
-    def _get_generic(self, query, table, projection=None, allow_generic=False):
+    def _get_generic(self, query, table, projection=None, allow_generic=False, limit=None, cursor=None, filters=None):
 
         # TODO parse duplicates
         meta = storage_utils.get_metadata()
 
         data = []
 
+        filter_query = {}
+        if filters:
+            try:
+                filter_query = _parse_filters(filters)
+            except KeyError as e:
+                meta["errors"].append({"filters": filters, "error": e.args[0]})
+                meta["error_description"] = e.args[0]
+                return {"meta": meta, "data": data}
+
         # Assume we want to lookup via unique key tuple
         if isinstance(query, (tuple, list)):
             keys = self._table_indices[table]
             len_key = len(keys)
 
+            # Key lists are paged by their position in the list
+            try:
+                start = 0 if cursor is None else int(cursor)
+            except (TypeError, ValueError):
+                meta["errors"].append({"cursor": cursor, "error": "Cursor '{}' not understood".format(cursor)})
+                meta["error_description"] = "Cursor '{}' not understood".format(cursor)
+                return {"meta": meta, "data": data}
+
+            if limit is not None:
+                if start + limit < len(query):
+                    meta["next_cursor"] = str(start + limit)
+                query = query[start:start + limit]
+            else:
+                query = query[start:]
+
             for q in query:
                 if (len(q) == len_key) and isinstance(q, (list, tuple)):
                     q = {k: v for k, v in zip(keys, q)}
@@ -272,7 +764,7 @@ class MongoSocket:
                     meta["errors"].append({"query": q, "error": "Malformed query"})
                     continue
 
-                d = self._tables[table].find_one(q, projection=projection)
+                d = self._tables[table].find_one(_and_queries(q, filter_query), projection=projection)
                 if d is None:
                     meta["missing"].append(q)
                 else:
@@ -293,7 +785,11 @@ class MongoSocket:
                 if isinstance(v, (list, tuple)):
                     query[k] = {"$in": v}
 
-            data = list(self._tables[table].find(query, projection=projection))
+            try:
+                data, meta["next_cursor"] = self._find_page(
+                    table, _and_queries(query, filter_query), projection=projection, limit=limit, cursor=cursor)
+            except KeyError as e:
+                meta["errors"].append({"query": query, "error": e.args[0]})
         else:
             meta["errors"] = "Malformed query"
 
@@ -308,12 +804,42 @@ class MongoSocket:
         ret = {"meta": meta, "data": data}
         return ret
 
+    def _iter_generic(self, query, table, projection=None, filters=None):
+        """
+        Helper function that lazily iterates over all documents matching a query.
+        """
+
+        if not isinstance(query, dict):
+            raise TypeError("Streaming queries must be a dictionary, found {}.".format(type(query).__name__))
+
+        query = copy.deepcopy(query)
+        if "id" in query:
+            ids, bad_ids = _str_to_indices_with_errors(query["id"])
+            if bad_ids:
+                raise KeyError("Bad Ids {}".format(bad_ids))
+
+            query["_id"] = ids
+            del query["id"]
+
+        for k, v in query.items():
+            if isinstance(v, (list, tuple)):
+                query[k] = {"$in": v}
+
+        if filters:
+            query = _and_queries(query, _parse_filters(filters))
+
+        cursor = self._tables[table].find(query, projection=projection)
+        return _translate_cursor_ids(cursor)
+
     def locator(self, locator):
-        """Simple query by locator object
+        """Query by locator object, a list of locators may be passed in to resolve them in bulk.
+
+        Locators are grouped by table, index, and projection so that each group is
+        resolved with a single query.
 
         Parameters
         ----------
-        locator : dict
+        locator : dict or list of dict
             A dictionary with the following fields:
                 - table: The table to query on
                 - index: The index to query on
@@ -323,10 +849,75 @@ class MongoSocket:
         Returns
         -------
         dict
-            The requested location
+            The requested location. If a list of locators was passed in, "data" is a list
+            holding the documents of each locator in input order.
         """
-        projection = locator.get("projection", None)
-        return self._get_generic({locator["index"]: locator["data"]}, locator["table"], projection=projection)
+
+        if isinstance(locator, dict):
+            ret = self._locate_many([locator])
+            ret["data"] = ret["data"][0]
+            return ret
+
+        return self._locate_many(locator)
+
+    def _locate_many(self, locators):
+        """
+        Helper function that resolves a list of locators with one query per (table, index, projection) group.
+        """
+
+        meta = storage_utils.get_metadata()
+        data = [[] for _ in locators]
+
+        # Maps {(table, index, projection) : [(position, values)]}
+        groups = collections.defaultdict(list)
+        for num, loc in enumerate(locators):
+            values = loc["data"]
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+
+            index = loc["index"]
+            if index in ["_id", "ids"]:
+                index = "id"
+
+            key = (loc["table"], index, json.dumps(loc.get("projection", None), sort_keys=True))
+            groups[key].append((num, values))
+
+        for (table, index, projection), entries in groups.items():
+            if table not in self._valid_tables:
+                meta["errors"].append({"table": table, "error": "Table not understood"})
+                continue
+
+            # The index must be returned to map documents back to locators
+            projection = json.loads(projection)
+            strip_index = False
+            if (index != "id") and isinstance(projection, dict) and any(projection.values()) and not projection.get(
+                    index, False):
+                projection[index] = True
+                strip_index = True
+
+            query_values = list({v for _, values in entries for v in values})
+            found = self._get_generic({index: query_values}, table, projection=projection)
+            meta["errors"].extend(found["meta"]["errors"])
+            self._decode_arrays(table, found["data"])
+
+            # Maps {index value : [documents]}
+            lookup = collections.defaultdict(list)
+            for d in found["data"]:
+                value = d.pop(index) if strip_index else d[index]
+                lookup[value].append(d)
+
+            for num, values in entries:
+                for v in values:
+                    if v in lookup:
+                        data[num].extend(lookup[v])
+                    else:
+                        meta["missing"].append((num, v))
+
+        meta["n_found"] = sum(len(x) for x in data)
+        if len(meta["errors"]) == 0:
+            meta["success"] = True
+
+        return {"meta": meta, "data": data}
 
 ### Mongo molecule functions
 
@@ -400,6 +991,7 @@ class MongoSocket:
             new_inserts.append(data)
             new_keys.append(new_key)
 
+        self._encode_arrays("molecules", new_inserts)
         ret = self._add_generic(new_inserts, "molecules", return_map=True)
         ret["meta"]["duplicates"].extend(list(key_mapper.keys()))
         ret["meta"]["validation_errors"] = []
@@ -420,7 +1012,7 @@ class MongoSocket:
 
         return ret
 
-    def get_molecules(self, molecule_ids, index="id"):
+    def get_molecules(self, molecule_ids, index="id", limit=None, cursor=None):
 
         ret = {"meta": storage_utils.get_metadata(), "data": []}
 
@@ -441,12 +1033,12 @@ class MongoSocket:
         proj = {"molecule_hash": False, "molecular_formula": False}
 
         # Make the query
-        data = self._tables["molecules"].find({index: {"$in": molecule_ids}}, projection=proj)
-
-        if data is None:
-            data = []
-        else:
-            data = list(data)
+        try:
+            data, ret["meta"]["next_cursor"] = self._find_page(
+                "molecules", {index: {"$in": molecule_ids}}, projection=proj, limit=limit, cursor=cursor)
+        except KeyError as e:
+            ret["meta"]["error_description"] = e.args[0]
+            return ret
 
         ret["meta"]["success"] = True
         ret["meta"]["n_found"] = len(data)
@@ -458,7 +1050,7 @@ class MongoSocket:
             r["id"] = str(r["_id"])
             del r["_id"]
 
-        ret["data"] = data
+        ret["data"] = self._decode_arrays("molecules", data)
 
         return ret
 
@@ -558,10 +1150,100 @@ class MongoSocket:
 
 ### Mongo database functions
 
+    def _split_collection_entries(self, data):
+        """
+        Removes the entry fields of a collection in place, leaving empty lists in their place.
+        Returns the removed {field : entries}.
+        """
+
+        entries = {}
+        for field in self._collection_entry_fields:
+            if isinstance(data.get(field, None), (list, tuple)):
+                entries[field] = data[field]
+                data[field] = []
+
+        return entries
+
+    def _add_collection_entries(self, collection_id, entries, start=None):
+        """
+        Inserts {field : entries} for a collection, entries are positioned after any existing entries.
+        """
+
+        table = self._tables["collection_entries"]
+        collection_id = ObjectId(collection_id)
+
+        docs = []
+        for field, values in entries.items():
+            if start is None:
+                offset = table.count_documents({"collection_id": collection_id, "field": field})
+            else:
+                offset = start
+
+            for num, entry in enumerate(values):
+                docs.append({"collection_id": collection_id, "field": field, "position": offset + num, "entry": entry})
+
+        if docs:
+            table.insert_many(docs)
+
+    def _migrate_collection_entries(self, doc):
+        """
+        Moves entries still held inline by a collection document (written before entries had their
+        own table) into the "collection_entries" table.
+        """
+
+        entries = {k: doc[k] for k in self._collection_entry_fields if isinstance(doc.get(k, None), list) and doc[k]}
+        if len(entries) == 0:
+            return
+
+        table = self._tables["collection_entries"]
+        for field in entries:
+            table.delete_many({"collection_id": doc["_id"], "field": field})
+        self._add_collection_entries(doc["_id"], entries, start=0)
+
+        self._tables["collections"].update_one({"_id": doc["_id"]}, {"$set": {k: [] for k in entries}})
+        self.logger.info("MongoSocket: Moved the {} entries of collection '{}' to the entry table.".format(
+            list(entries), str(doc["_id"])))
+
+    def _attach_collection_entries(self, data, projection=None):
+        """
+        Reassembles the entry fields of a list of collections in place.
+        """
+
+        fields = []
+        for field in self._collection_entry_fields:
+            if projection is None:
+                fields.append(field)
+            elif any(projection.values()) and projection.get(field, False):
+                fields.append(field)
+            elif (not any(projection.values())) and projection.get(field, True):
+                fields.append(field)
+
+        lookup = {d["id"]: d for d in data if any(isinstance(d.get(f, None), list) for f in fields)}
+        if (len(fields) == 0) or (len(lookup) == 0):
+            return
+
+        found = self._tables["collection_entries"].find(
+            {
+                "collection_id": {
+                    "$in": [ObjectId(x) for x in lookup]
+                },
+                "field": {
+                    "$in": fields
+                }
+            },
+            projection={"_id": False}).sort([("collection_id", pymongo.ASCENDING), ("position", pymongo.ASCENDING)])
+
+        for doc in found:
+            lookup[str(doc["collection_id"])][doc["field"]].append(doc["entry"])
+
     def add_collection(self, data, overwrite=False):
         """
         Adds a database to the database.
 
+        Every collection carries an integer "version" which starts at 1 and is incremented
+        each time the collection is overwritten. Entry lists (such as Dataset reactions) are
+        stored in a separate table with one document per entry.
+
         Parameters
         ----------
         data : dict
@@ -573,7 +1255,14 @@ class MongoSocket:
             Whether the operation was successful.
         """
 
+        entries = self._split_collection_entries(data)
+
         if overwrite:
+            current = self._tables["collections"].find_one({"_id": ObjectId(data["id"])}, projection={"version": True})
+            data["version"] = 1
+            if current is not None:
+                data["version"] += current.get("version", 0)
+
             ret = {
                 "meta": {
                     "errors": [],
@@ -589,71 +1278,482 @@ class MongoSocket:
                 ret["meta"]["success"] = True
                 ret["meta"]["n_inserted"] = 1
 
+                self._tables["collection_entries"].delete_many({"collection_id": ObjectId(data["id"])})
+                self._add_collection_entries(data["id"], entries, start=0)
+
         else:
+            data["version"] = 1
             ret = self._add_generic([data], "collections")
+            if ret["data"]:
+                self._add_collection_entries(ret["data"][0][1], entries, start=0)
+
+        data.update(entries)
         ret["meta"]["validation_errors"] = []  # TODO
         return ret
 
-    def get_collections(self, keys, projection=None):
-
-        return self._get_generic(keys, "collections", projection=projection)
-
-    def del_collection(self, collection, name):
+    def update_collection(self, collection_id, version, set_fields=None, push_fields=None, set_entries=None):
         """
-        Removes a database from the database from its hash.
+        Applies a partial update to a collection. The update only succeeds if the
+        collection is still at the given version, the version is then incremented.
 
         Parameters
         ----------
-        hash_val : str or list of strs
-            The hash of a database.
+        collection_id : str
+            The id of the collection to update
+        version : int
+            The version of the collection the changes were made against
+        set_fields : dict, optional
+            A {field : value} of top-level fields to replace
+        push_fields : dict, optional
+            A {field : values} of values to append to list fields
+        set_entries : dict, optional
+            A {field : {position : entry}} of entries to replace
 
         Returns
         -------
-        bool
-            Whether the operation was successful.
+        dict
+            The update metadata, "version" holds the new version of the collection.
         """
 
-        return (self._tables["collections"].delete_one({"collection": collection, "name": name})).deleted_count
+        ret = {
+            "meta": {
+                "errors": [],
+                "n_inserted": 0,
+                "success": False,
+                "duplicates": [],
+                "error_description": False,
+                "version": version,
+            },
+            "data": []
+        }
 
-### Mongo database functions
+        set_fields = copy.copy(set_fields or {})
+        set_entry_fields = self._split_collection_entries(set_fields)
+        for field in set_entry_fields:
+            del set_fields[field]
 
-    def add_results(self, data):
+        push_fields = push_fields or {}
+        set_entries = set_entries or {}
+
+        update = {"$inc": {"version": 1}}
+        if set_fields:
+            update["$set"] = set_fields
+
+        push = {k: {"$each": v} for k, v in push_fields.items() if k not in self._collection_entry_fields}
+        if push:
+            update["$push"] = push
+
+        collection_id = ObjectId(collection_id)
+        doc = self._tables["collections"].find_one_and_update(
+            {
+                "_id": collection_id,
+                "version": version
+            },
+            update,
+            projection={"collection": True,
+                        "name": True,
+                        "version": True,
+                        **{k: True
+                           for k in self._collection_entry_fields}},
+            return_document=pymongo.ReturnDocument.AFTER)
+
+        if doc is None:
+            ret["meta"]["error_description"] = "Collection '{}' not found at version {}.".format(
+                str(collection_id), version)
+            return ret
+
+        # Positional writes below need every entry in the entry table
+        self._migrate_collection_entries(doc)
+
+        # Entry lists live in their own table
+        table = self._tables["collection_entries"]
+        for field in set_entry_fields:
+            table.delete_many({"collection_id": collection_id, "field": field})
+        self._add_collection_entries(collection_id, set_entry_fields, start=0)
+
+        self._add_collection_entries(
+            collection_id, {k: v for k, v in push_fields.items() if k in self._collection_entry_fields})
+
+        replace = []
+        for field, entries in set_entries.items():
+            for position, entry in entries.items():
+                position = int(position)
+                replace.append(
+                    pymongo.ReplaceOne({
+                        "collection_id": collection_id,
+                        "field": field,
+                        "position": position
+                    }, {
+                        "collection_id": collection_id,
+                        "field": field,
+                        "position": position,
+                        "entry": entry
+                    }))
+        if replace:
+            table.bulk_write(replace, ordered=False)
+
+        ret["meta"]["success"] = True
+        ret["meta"]["n_inserted"] = 1
+        ret["meta"]["version"] = doc["version"]
+        ret["data"] = [((doc["collection"], doc["name"]), str(collection_id))]
+
+        return ret
+
+    def get_collections(self, keys, projection=None, limit=None, cursor=None):
+
+        ret = self._get_generic(keys, "collections", projection=projection, limit=limit, cursor=cursor)
+        self._attach_collection_entries(ret["data"], projection=projection)
+
+        return ret
+
+    def get_collection_entries(self, collection_id, field, fields=None, limit=None, cursor=None):
         """
-        Adds a page to the database.
+        Pages through the entries of a collection list field in order.
 
         Parameters
         ----------
-        data : dict
-            Structured instance of the page.
+        collection_id : str
+            The id of the collection
+        field : str
+            The list field to page through (e.g. "reactions")
+        fields : list of str, optional
+            The (dotted) keys of each entry to return, if None the full entries are returned
+        limit : int, optional
+            The maximum number of entries to return
+        cursor : str, optional
+            The "next_cursor" of a previous page to continue from
 
         Returns
         -------
-        bool
-            Whether the operation was successful.
+        dict
+            The entries in order and metadata, "next_cursor" continues the query.
         """
 
-        for d in data:
-            for i in self._lower_results_index:
-                d[i] = d[i].lower()
+        meta = storage_utils.get_metadata()
 
-        ret = self._add_generic(data, "results", return_map=True)
-        ret["meta"]["validation_errors"] = []  # TODO
+        try:
+            query = {"collection_id": ObjectId(collection_id), "field": field}
+            if cursor is not None:
+                query["position"] = {"$gt": int(cursor)}
+        except (bson.errors.InvalidId, TypeError, ValueError) as e:
+            meta["error_description"] = str(e)
+            return {"meta": meta, "data": []}
+
+        if (cursor is None) and (field in self._collection_entry_fields):
+            doc = self._tables["collections"].find_one({"_id": query["collection_id"]}, projection={field: True})
+            if doc is not None:
+                self._migrate_collection_entries(doc)
+
+        projection = {"_id": False, "position": True}
+        if fields is None:
+            projection["entry"] = True
+        else:
+            for key in fields:
+                projection["entry." + key] = True
 
-        return ret
+        found = self._tables["collection_entries"].find(query, projection=projection)
+        found = found.sort("position", pymongo.ASCENDING)
+        if limit is not None:
+            found = found.limit(limit)
+        found = list(found)
 
-    # Do a lookup on the results collection using a <molecule, method> key.
-    def get_results(self, query, projection=None):
+        if (limit is not None) and (len(found) == limit):
+            meta["next_cursor"] = str(found[-1]["position"])
 
-        parsed_query = {}
-        ret = {"meta": storage_utils.get_metadata(), "data": []}
+        meta["n_found"] = len(found)
+        meta["success"] = True
 
-        # We are querying via id
-        if ("_id" in query) or ("id" in query):
-            if len(query) > 1:
-                ret["error_description"] = "ID index was provided, cannot use other indices"
-                return ret
+        return {"meta": meta, "data": [x.get("entry", {}) for x in found]}
 
-            if "id" in query:
+    def del_collection(self, collection, name):
+        """
+        Removes a database from the database from its hash.
+
+        Parameters
+        ----------
+        hash_val : str or list of strs
+            The hash of a database.
+
+        Returns
+        -------
+        bool
+            Whether the operation was successful.
+        """
+
+        doc = self._tables["collections"].find_one_and_delete(
+            {"collection": collection, "name": name}, projection={"_id": True})
+        if doc is None:
+            return 0
+
+        self._tables["collection_entries"].delete_many({"collection_id": doc["_id"]})
+        return 1
+
+### Mongo array functions
+
+    def _encode_arrays(self, table, data):
+        """
+        Encodes the numeric array fields of documents as typed binary buffers in-place. Returns a
+        list of (document position, field, original value) for each encoded field.
+        """
+
+        encoded = []
+        for field in self._array_fields.get(table, ()):
+            for num, d in enumerate(data):
+                if field not in d:
+                    continue
+
+                value = storage_utils.encode_array(d[field])
+                if value is not d[field]:
+                    encoded.append((num, field, d[field]))
+                    d[field] = value
+
+        return encoded
+
+    def _decode_arrays(self, table, data):
+        """
+        Decodes the binary array fields of documents into read-only NumPy arrays in-place.
+        """
+
+        fields = self._array_fields.get(table, ())
+        if len(fields) == 0:
+            return data
+
+        for d in data:
+            for field in fields:
+                if field in d:
+                    d[field] = storage_utils.decode_array(d[field])
+
+        return data
+
+    def _iter_decode_arrays(self, table, cursor):
+        """
+        Lazily decodes the binary array fields of a document stream.
+        """
+
+        for d in cursor:
+            yield self._decode_arrays(table, [d])[0]
+
+### Mongo blob functions
+
+    def _add_blobs(self, values):
+        """
+        Compresses values into the blobs table, returns the id of each blob.
+        """
+
+        docs = []
+        for value in values:
+            compression, size, data = storage_utils.compress_blob(value)
+            docs.append({"compression": compression, "size": size, "data": data})
+
+        self._tables["blobs"].insert_many(docs, ordered=False)
+        return [str(d["_id"]) for d in docs]
+
+    def _del_blobs(self, blob_ids):
+        """
+        Removes blobs by id.
+        """
+
+        if len(blob_ids) == 0:
+            return 0
+
+        return self._tables["blobs"].delete_many({"_id": {"$in": [ObjectId(x) for x in blob_ids]}}).deleted_count
+
+    def _offload_blobs(self, table, data):
+        """
+        Moves the large blob fields of documents into the blobs table in-place. Returns a list of
+        (document position, field, value, blob id) for each field that was moved.
+        """
+
+        fields = self._blob_fields.get(table, ())
+        if (self._blob_threshold is None) or (len(fields) == 0):
+            return []
+
+        found = []
+        for num, d in enumerate(data):
+            for field in fields:
+                if d.get(field, None) is None:
+                    continue
+
+                if len(json.dumps(d[field])) >= self._blob_threshold:
+                    found.append((num, field, d[field]))
+
+        if len(found) == 0:
+            return []
+
+        blob_ids = self._add_blobs([value for num, field, value in found])
+
+        offloaded = []
+        for (num, field, value), blob_id in zip(found, blob_ids):
+            data[num][field] = {"blob_id": blob_id}
+            offloaded.append((num, field, value, blob_id))
+
+        return offloaded
+
+    def _blob_references(self, table, query):
+        """
+        Returns the ids of all blobs referenced by the documents matching a query.
+        """
+
+        fields = self._blob_fields.get(table, ())
+        if len(fields) == 0:
+            return []
+
+        blob_ids = []
+        for doc in self._tables[table].find(query, projection={f: True for f in fields}):
+            for field in fields:
+                value = doc.get(field, None)
+                if isinstance(value, dict) and ("blob_id" in value):
+                    blob_ids.append(value["blob_id"])
+
+        return blob_ids
+
+    def _projected_blob_fields(self, table, projection):
+        """
+        Returns the blob fields of a table which are returned under a projection.
+        """
+
+        fields = self._blob_fields.get(table, ())
+        if not isinstance(projection, dict) or (len(projection) == 0):
+            return list(fields)
+
+        # Inclusion projections only return the listed fields, exclusion projections all others
+        if any(v for k, v in projection.items() if k != "_id"):
+            return [field for field in fields if projection.get(field, False)]
+        else:
+            return [field for field in fields if projection.get(field, True)]
+
+    def _resolve_blobs(self, docs, fields):
+        """
+        Replaces the blob references of the given fields with their values in-place.
+        """
+
+        refs = set()
+        for d in docs:
+            for field in fields:
+                value = d.get(field, None)
+                if isinstance(value, dict) and ("blob_id" in value):
+                    refs.add(value["blob_id"])
+
+        if len(refs) == 0:
+            return docs
+
+        values = self.get_blobs(list(refs))["data"]
+        for d in docs:
+            for field in fields:
+                value = d.get(field, None)
+                if isinstance(value, dict) and (value.get("blob_id", None) in values):
+                    d[field] = values[value["blob_id"]]
+
+        return docs
+
+    def _iter_resolve_blobs(self, cursor, fields, chunk=100):
+        """
+        Lazily resolves blob references of a document stream in chunks.
+        """
+
+        docs = []
+        for doc in cursor:
+            docs.append(doc)
+            if len(docs) == chunk:
+                yield from self._resolve_blobs(docs, fields)
+                docs = []
+
+        yield from self._resolve_blobs(docs, fields)
+
+    def get_blobs(self, blob_ids):
+        """
+        Pulls the values of blobs, large fields which are stored compressed and out of line.
+
+        Parameters
+        ----------
+        blob_ids : str or list of str
+            The ids of the blobs, found in the {"blob_id": id} references of the documents
+
+        Returns
+        -------
+        dict
+            The data is a {blob_id : value} dictionary, unknown ids are listed in the "missing" metadata
+        """
+
+        meta = storage_utils.get_metadata()
+
+        if isinstance(blob_ids, str):
+            blob_ids = [blob_ids]
+
+        good, bad = _str_to_indices_with_errors(list(blob_ids))
+
+        data = {}
+        for doc in self._tables["blobs"].find({"_id": {"$in": good}}):
+            data[str(doc["_id"])] = storage_utils.decompress_blob(doc["compression"], doc["data"])
+
+        meta["missing"] = bad + [str(x) for x in good if str(x) not in data]
+        meta["n_found"] = len(data)
+        meta["success"] = True
+
+        return {"meta": meta, "data": data}
+
+### Mongo database functions
+
+    def add_results(self, data):
+        """
+        Adds a page to the database.
+
+        Parameters
+        ----------
+        data : dict
+            Structured instance of the page.
+
+        Returns
+        -------
+        bool
+            Whether the operation was successful.
+        """
+
+        # Mongo stores times to the millisecond
+        now = datetime.datetime.utcnow()
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+        for d in data:
+            for i in self._lower_results_index:
+                d[i] = d[i].lower()
+            d["modified_on"] = now
+
+        encoded = self._encode_arrays("results", data)
+        offloaded = self._offload_blobs("results", data)
+
+        ret = self._add_generic(data, "results", return_map=True)
+        ret["meta"]["validation_errors"] = []  # TODO
+
+        # The input keeps its arrays
+        for num, field, value in encoded:
+            data[num][field] = value
+
+        # Results which were not inserted keep their values, their blobs are removed
+        inserted = set(x[1] for x in ret["data"])
+        unused = []
+        for num, field, value, blob_id in offloaded:
+            if data[num]["id"] not in inserted:
+                data[num][field] = value
+                unused.append(blob_id)
+        self._del_blobs(unused)
+
+        return ret
+
+    def _parse_results_query(self, query, projection, filters=None):
+        """
+        Translates a results query, filters, and projection into Mongo form.
+
+        Raises a KeyError if the query is malformed.
+        """
+
+        parsed_query = {}
+
+        # We are querying via id
+        if ("_id" in query) or ("id" in query):
+            if len(query) > 1:
+                raise KeyError("ID index was provided, cannot use other indices")
+
+            if "id" in query:
                 query["_id"] = query["id"]
 
             if not isinstance(query, (list, tuple)):
@@ -667,8 +1767,7 @@ class MongoSocket:
             # Check if there are unknown keys
             remain = set(query) - set(self._table_indices["results"])
             if remain:
-                ret["error_description"] = "Results query found unknown keys {}".format(list(remain))
-                return ret
+                raise KeyError("Results query found unknown keys {}".format(list(remain)))
 
             for key, value in query.items():
                 if isinstance(value, (list, tuple)):
@@ -678,6 +1777,9 @@ class MongoSocket:
                 else:
                     parsed_query[key] = value.lower()
 
+        if filters:
+            parsed_query = _and_queries(parsed_query, _parse_filters(filters, lower=self._lower_results_index))
+
         # Manipulate the projection
         if projection is None:
             proj = {}
@@ -686,11 +1788,51 @@ class MongoSocket:
 
         proj["_id"] = False
 
-        data = self._tables["results"].find(parsed_query, projection=proj)
-        if data is None:
-            data = []
-        else:
-            data = list(data)
+        return parsed_query, proj
+
+    # Do a lookup on the results collection using a <molecule, method> key.
+    def get_results(self, query, projection=None, limit=None, cursor=None, filters=None, resolve_blobs=True):
+        """
+        Pulls results matching a query.
+
+        Parameters
+        ----------
+        query : dict
+            Equality (or list for any of) matches on the results index fields, or an "id" query
+        projection : dict, optional
+            The fields to return
+        limit : int, optional
+            The maximum number of results to return
+        cursor : str, optional
+            The "next_cursor" of the previous page
+        filters : list, optional
+            Additional [field, operator, value] filters on any field which must all match. The
+            operators are "==", "!=", "<", "<=", ">", ">=", "in", "not in", and "exists".
+            For example [["return_result", "<", -1.0], ["properties.scf_iterations", "exists", True]]
+        resolve_blobs : bool, optional
+            If False, large output fields (e.g. "stdout") which are stored out of line are returned
+            as {"blob_id": id} references to be pulled later with `get_blobs`
+
+        Returns
+        -------
+        dict
+            The matching results
+        """
+
+        ret = {"meta": storage_utils.get_metadata(), "data": []}
+
+        try:
+            parsed_query, proj = self._parse_results_query(query, projection, filters=filters)
+            data, ret["meta"]["next_cursor"] = self._find_page(
+                "results", parsed_query, projection=proj, limit=limit, cursor=cursor)
+        except KeyError as e:
+            ret["meta"]["errors"].append({"query": query, "filters": filters, "error": e.args[0]})
+            ret["meta"]["error_description"] = e.args[0]
+            return ret
+
+        if resolve_blobs:
+            self._resolve_blobs(data, self._projected_blob_fields("results", projection))
+        self._decode_arrays("results", data)
 
         ret["meta"]["n_found"] = len(data)
         ret["meta"]["success"] = True
@@ -699,6 +1841,139 @@ class MongoSocket:
 
         return ret
 
+    def get_results_summary(self, query):
+        """
+        Summarizes the results matching a query without pulling them.
+
+        Parameters
+        ----------
+        query : dict
+            A results query, see `get_results`
+
+        Returns
+        -------
+        dict
+            The number of matching results ("n_found") and the latest time any of them
+            were modified ("modified_on", None if unknown).
+        """
+
+        ret = {"meta": storage_utils.get_metadata(), "data": {}}
+
+        try:
+            parsed_query, _ = self._parse_results_query(query, None)
+        except KeyError as e:
+            ret["meta"]["error_description"] = e.args[0]
+            return ret
+
+        table = self._tables["results"]
+        latest = list(
+            table.find(parsed_query, projection={
+                "modified_on": True,
+                "_id": False
+            }).sort("modified_on", pymongo.DESCENDING).limit(1))
+
+        ret["data"]["n_found"] = table.count_documents(parsed_query)
+        ret["data"]["modified_on"] = latest[0].get("modified_on", None) if len(latest) else None
+        ret["meta"]["success"] = True
+
+        return ret
+
+    def aggregate_results(self,
+                          query,
+                          group_by=("program", "method", "basis"),
+                          field="return_result",
+                          stats=("count", "sum", "min", "max", "mean"),
+                          filters=None):
+        """
+        Computes statistics of a results field for each group of results inside the database.
+
+        Parameters
+        ----------
+        query : dict
+            A results query, see `get_results`
+        group_by : list of str, optional
+            The fields to group the results by
+        field : str, optional
+            The field to compute statistics of
+        stats : list of str, optional
+            The statistics to compute ("count", "sum", "min", "max", "mean")
+        filters : list, optional
+            Additional [field, operator, value] filters, see `get_results`
+
+        Returns
+        -------
+        dict
+            A table of the results with the group fields followed by the statistics as
+            "columns" and a list of "rows", sorted by group.
+        """
+
+        ret = {"meta": storage_utils.get_metadata(), "data": {}}
+
+        try:
+            group_by = list(group_by)
+            stats = list(stats)
+            for name in group_by + [field]:
+                if not isinstance(name, str) or (_field_path.match(name) is None):
+                    raise KeyError("Aggregate field '{}' is not a valid field name.".format(name))
+
+            remain = set(stats) - set(_aggregate_accumulators)
+            if remain:
+                raise KeyError("Aggregate statistics {} not understood, available statistics: {}.".format(
+                    list(remain), list(_aggregate_accumulators)))
+
+            parsed_query, _ = self._parse_results_query(query, None, filters=filters)
+        except KeyError as e:
+            ret["meta"]["error_description"] = e.args[0]
+            return ret
+
+        group = {"_id": {"g{}".format(num): "$" + name for num, name in enumerate(group_by)}}
+        for stat in stats:
+            group[stat] = {_aggregate_accumulators[stat]: 1 if stat == "count" else "$" + field}
+
+        pipeline = [{"$match": parsed_query}, {"$group": group}, {"$sort": {"_id": 1}}]
+
+        rows = []
+        for doc in self._tables["results"].aggregate(pipeline):
+            rows.append([doc["_id"].get("g{}".format(num), None) for num in range(len(group_by))] +
+                        [doc[stat] for stat in stats])
+
+        ret["data"] = {"columns": group_by + stats, "rows": rows}
+        ret["meta"]["n_found"] = len(rows)
+        ret["meta"]["success"] = True
+
+        return ret
+
+    def iter_results(self, query, projection=None, filters=None, resolve_blobs=True):
+        """
+        Lazily iterates over all results matching a query so that large queries are not held in memory.
+
+        Parameters
+        ----------
+        query : dict
+            A results query, see `get_results`
+        projection : dict, optional
+            The projection to apply to each document
+        filters : list, optional
+            Additional [field, operator, value] filters, see `get_results`
+        resolve_blobs : bool, optional
+            If False, out of line output fields are returned as references, see `get_results`
+
+        Returns
+        -------
+        iterator of dict
+            The result documents as they are read from the database cursor.
+        """
+
+        parsed_query, proj = self._parse_results_query(query, projection, filters=filters)
+
+        cursor = self._iter_decode_arrays("results", self._tables["results"].find(parsed_query, projection=proj))
+
+        fields = self._projected_blob_fields("results", projection)
+        if resolve_blobs and fields:
+            return self._iter_resolve_blobs(cursor, fields)
+
+        return cursor
+
     def del_results(self, values, index="id"):
         """
         Removes a page from the database from its hash.
@@ -715,7 +1990,17 @@ class MongoSocket:
         """
         index = _translate_id_index(index)
 
-        return self._del_by_index("results", values, index=index)
+        if isinstance(values, str):
+            values = [values]
+        values = list(values)
+        if index == "_id":
+            _str_to_indices(values)
+
+        blob_ids = self._blob_references("results", {index: {"$in": values}})
+        ret = self._del_by_index("results", values, index=index)
+        self._del_blobs(blob_ids)
+
+        return ret
 
 ### Mongo procedure/service functions
 
@@ -726,12 +2011,27 @@ class MongoSocket:
 
         return ret
 
-    def get_procedures(self, query, projection=None):
+    def get_procedures(self, query, projection=None, limit=None, cursor=None, filters=None):
 
-        return self._get_generic(query, "procedures", allow_generic=True, projection=projection)
+        return self._get_generic(
+            query,
+            "procedures",
+            allow_generic=True,
+            projection=projection,
+            limit=limit,
+            cursor=cursor,
+            filters=filters)
+
+    def iter_procedures(self, query, projection=None, filters=None):
+
+        return self._iter_generic(query, "procedures", projection=projection, filters=filters)
 
     def add_services(self, data):
 
+        # Molecules pulled from the database hold NumPy arrays
+        for x in data:
+            x.update(storage_utils.arrays_to_lists(x))
+
         ret = self._add_generic(data, "service_queue", return_map=True)
         ret["meta"]["validation_errors"] = []  # TODO
 
@@ -750,15 +2050,80 @@ class MongoSocket:
 
         return self._get_generic(query, "service_queue", projection=projection, allow_generic=True)
 
+    def iter_services(self, query, projection=None):
+        """
+        Lazily iterates over all services matching a query, see `iter_results`.
+        """
+
+        return self._iter_generic(query, "service_queue", projection=projection)
+
     def update_services(self, updates):
+        """
+        Writes the new state of services back to the database in a single bulk write.
+
+        If the service as it was read is given only the fields which changed are written, and only
+        if no one else updated the service in the meantime. Each such write increments the
+        "version" of the service, which is checked against the version of the service as it was
+        read.
 
-        match_count = 0
-        modified_count = 0
-        for uid, data in updates:
-            result = self._tables["service_queue"].replace_one({"_id": ObjectId(uid)}, data)
-            match_count += result.matched_count
-            modified_count += result.modified_count
-        return (match_count, modified_count)
+        Parameters
+        ----------
+        updates : list of tuples
+            (id, data) pairs which replace the whole service, or (id, data, original) triples
+            where `original` is the service as it was read from the database
+
+        Returns
+        -------
+        tuple
+            The number of (matched, modified) services. Services without changes are not
+            written, services updated elsewhere since they were read are not matched.
+        """
+
+        commands = []
+        n_versioned = 0
+        for update in updates:
+            uid = update[0]
+            data = storage_utils.arrays_to_lists(update[1])
+            data = {k: v for k, v in data.items() if k not in ("id", "_id", "version")}
+
+            if len(update) == 2:
+                commands.append(pymongo.ReplaceOne({"_id": ObjectId(uid)}, data))
+                continue
+
+            original = storage_utils.arrays_to_lists(update[2])
+            version = original.get("version", None)
+            original = {k: v for k, v in original.items() if k not in ("id", "_id", "version")}
+
+            sets, unsets = _update_paths(original, data)
+            if not (sets or unsets):
+                continue
+
+            sets["version"] = (version or 0) + 1
+            ops = {"$set": sets}
+            if unsets:
+                ops["$unset"] = unsets
+
+            # A missing version (None) matches services which were never updated this way
+            commands.append(pymongo.UpdateOne({"_id": ObjectId(uid), "version": version}, ops))
+            n_versioned += 1
+
+        if len(commands) == 0:
+            return (0, 0)
+
+        try:
+            result = self._tables["service_queue"].bulk_write(commands, ordered=False).bulk_api_result
+        except pymongo.errors.BulkWriteError as e:
+            result = e.details
+            self.logger.warning("MongoSocket: Failed to update {} services: {}".format(
+                len(result["writeErrors"]), [x["errmsg"] for x in result["writeErrors"]]))
+
+        n_conflicts = len(commands) - len(result["writeErrors"]) - result["nMatched"]
+        if n_versioned and (n_conflicts > 0):
+            self.logger.warning(
+                "MongoSocket: {} services were updated elsewhere since they were read, their updates were "
+                "skipped.".format(n_conflicts))
+
+        return (result["nMatched"], result["nModified"])
 
     def del_services(self, values, index="id"):
 
@@ -772,6 +2137,9 @@ class MongoSocket:
 
         dt = datetime.datetime.utcnow()
         for x in data:
+            # Task specs are sent to compute workers in their list form
+            x.update(storage_utils.arrays_to_lists(x))
+
             x["status"] = "WAITING"
             x["tag"] = tag
             x["created_on"] = dt
@@ -854,9 +2222,47 @@ class MongoSocket:
 
         return found
 
-    def get_queue(self, query, projection=None):
+    def get_queue(self, query, projection=None, limit=None, cursor=None):
 
-        return self._get_generic(query, "task_queue", allow_generic=True, projection=projection)
+        return self._get_generic(
+            query, "task_queue", allow_generic=True, projection=projection, limit=limit, cursor=cursor)
+
+    def iter_queue(self, query, projection=None):
+        """
+        Lazily iterates over all tasks matching a query, see `iter_results`.
+        """
+
+        return self._iter_generic(query, "task_queue", projection=projection)
+
+    def queue_reset_status(self, ids):
+        """
+        Returns RUNNING tasks to WAITING so that they are handed out again, for example when the
+        queue adapter running them was lost.
+
+        Parameters
+        ----------
+        ids : list of str
+            The ids of the tasks to reset
+
+        Returns
+        -------
+        int
+            The number of tasks reset
+        """
+
+        if len(ids) == 0:
+            return 0
+
+        ret = self._tables["task_queue"].update_many({
+            "_id": {
+                "$in": [ObjectId(x) for x in ids]
+            },
+            "status": "RUNNING"
+        }, {"$set": {
+            "status": "WAITING",
+            "modified_on": datetime.datetime.utcnow()
+        }})
+        return ret.modified_count
 
     def queue_get_by_id(self, ids, n=100):
 
@@ -895,6 +2301,139 @@ class MongoSocket:
         ret = self._tables["task_queue"].bulk_write(bulk_commands, ordered=False)
         return ret
 
+    def queue_archive(self, retention, ttl=None, batch_size=1000):
+        """
+        Moves finished (COMPLETE or ERROR) tasks which have not been modified within the retention
+        window from the queue into the "task_archive" table. Archived tasks only keep their hash,
+        status, tag, timestamps, result location, and a summary of their error. Tasks still required
+        by a service are neither archived nor expired.
+
+        Parameters
+        ----------
+        retention : datetime.timedelta
+            How long finished tasks are kept in the queue
+        ttl : datetime.timedelta, optional
+            If given, archived tasks are removed once they have been archived this long
+        batch_size : int, optional
+            The number of tasks moved at once
+
+        Returns
+        -------
+        dict
+            The number of tasks archived ("n_archived") and removed from the archive ("n_expired")
+        """
+
+        now = datetime.datetime.utcnow()
+
+        # Services look up the tasks they wait on by id
+        required, _ = _str_to_indices_with_errors(self._tables["service_queue"].distinct("required_jobs"))
+
+        query = {
+            "_id": {
+                "$nin": required
+            },
+            "status": {
+                "$in": ["COMPLETE", "ERROR"]
+            },
+            "modified_on": {
+                "$lt": now - retention
+            }
+        }
+        projection = {
+            "hash_index": True,
+            "status": True,
+            "tag": True,
+            "created_on": True,
+            "modified_on": True,
+            "result_location": True,
+            "error": True
+        }
+
+        n_archived = 0
+        while True:
+            tasks = list(self._tables["task_queue"].find(query, projection=projection, limit=batch_size))
+            if len(tasks) == 0:
+                break
+
+            for task in tasks:
+                task["archived_on"] = now
+                if isinstance(task.get("error", None), str):
+                    task["error"] = task["error"][-self._archive_error_length:]
+
+            # A previous pass may have stopped between the insert and the delete
+            try:
+                self._tables["task_archive"].insert_many(tasks, ordered=False)
+            except pymongo.errors.BulkWriteError as e:
+                if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                    raise
+
+            ret = self._tables["task_queue"].delete_many({"_id": {"$in": [x["_id"] for x in tasks]}})
+            n_archived += ret.deleted_count
+            if ret.deleted_count == 0:
+                break
+
+        n_expired = 0
+        if ttl is not None:
+            n_expired = self._tables["task_archive"].delete_many({
+                "_id": {
+                    "$nin": required
+                },
+                "archived_on": {
+                    "$lt": now - ttl
+                }
+            }).deleted_count
+
+        if n_archived or n_expired:
+            self.logger.info("QUEUE: Archived {} finished tasks, expired {} archived tasks.".format(
+                n_archived, n_expired))
+
+        return {"n_archived": n_archived, "n_expired": n_expired}
+
+    def get_queue_archive(self, query, projection=None, limit=None, cursor=None):
+
+        return self._get_generic(
+            query, "task_archive", allow_generic=True, projection=projection, limit=limit, cursor=cursor)
+
+    def queue_get_complete(self, ids, projection=None):
+        """
+        Returns the COMPLETE tasks with the given ids, tasks which are no longer in the queue are
+        looked up in the task archive.
+
+        Parameters
+        ----------
+        ids : list of str
+            The ids of the tasks
+        projection : dict, optional
+            The projection to apply to each task, only fields kept by the archive are found for
+            archived tasks
+
+        Returns
+        -------
+        list of dict
+            The COMPLETE tasks found
+        """
+
+        ids, _ = _str_to_indices_with_errors(ids)
+
+        found = list(self._tables["task_queue"].find({
+            "_id": {
+                "$in": ids
+            },
+            "status": "COMPLETE"
+        }, projection=projection))
+
+        found_ids = {x["_id"] for x in found}
+        missing = [x for x in ids if x not in found_ids]
+        if missing:
+            found.extend(self._tables["task_archive"].find({
+                "_id": {
+                    "$in": missing
+                },
+                "status": "COMPLETE"
+            }, projection=projection))
+
+        return list(_translate_cursor_ids(found))
+
     def handle_hooks(self, hooks):
 
         # Very dangerous, we need to modify this substatially
@@ -959,8 +2498,9 @@ class MongoSocket:
             The username to verify
         password : str
             The password associated with the username
-        permission : str
-            The associated permissions of a user ['read', 'write', 'compute', 'admin']
+        permission : str or list of str
+            The associated permissions of a user ['read', 'write', 'compute', 'admin'], if a
+            list is given the user must have all permissions
 
         Returns
         -------
@@ -991,7 +2531,10 @@ class MongoSocket:
         if pwcheck is False:
             return (False, "Incorrect password.")
 
-        if permission.lower() not in data["permissions"]:
+        if isinstance(permission, str):
+            permission = [permission]
+
+        if any(p.lower() not in data["permissions"] for p in permission):
             return (False, "User has insufficient permissions.")
 
         return (True, "Success")
@@ -1020,7 +2563,7 @@ class MongoSocket:
         Parameters
         ----------
         hashes : list
-            A list of molecules hashes.
+            A list of molecule ids.
         field : str
             A page field.
 
@@ -1028,16 +2571,30 @@ class MongoSocket:
         -------
         dataframe
             Returns a dataframe with your results. The rows will have the
-            molecule hashes and the column will contain the name. Each cell
+            molecule ids and the column will contain the name. Each cell
             contains the field value for the molecule in that row.
 
         """
-        d = {}
-        for mol in hashes:
-            command = [{"$match": {"molecule_hash": mol}}, {"$group": {"_id": {}, "value": {"$push": "$" + field}}}]
-            results = list(self.project["results"].aggregate(command))
-            if len(results) == 0 or len(results[0]["value"]) == 0:
-                d[mol] = None
-            else:
-                d[mol] = results[0]["value"][0]
+        if _field_path.match(field) is None:
+            raise KeyError("Field '{}' is not a valid field name.".format(field))
+
+        command = [{
+            "$match": {
+                "molecule_id": {
+                    "$in": list(hashes)
+                }
+            }
+        }, {
+            "$group": {
+                "_id": "$molecule_id",
+                "value": {
+                    "$first": "$" + field
+                }
+            }
+        }]
+
+        d = {mol: None for mol in hashes}
+        for result in self._tables["results"].aggregate(command):
+            d[result["_id"]] = storage_utils.decode_array(result["value"])
+
         return pd.DataFrame(data=d, index=[field]).transpose()
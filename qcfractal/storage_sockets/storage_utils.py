@@ -3,9 +3,24 @@ Contains a number of utility functions for storage sockets
 """
 
 import json
+import zlib
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Constants
-_get_metadata = json.dumps({"errors": [], "n_found": 0, "success": False, "error_description": False, "missing": []})
+_get_metadata = json.dumps({
+    "errors": [],
+    "n_found": 0,
+    "success": False,
+    "error_description": False,
+    "missing": [],
+    "next_cursor": None
+})
 
 
 def translate_molecule_index(index):
@@ -30,6 +45,97 @@ def translate_generic_index(index):
         raise KeyError("Generic Index '{}' not understood".format(index))
 
 
+def compress_blob(value):
+    """
+    JSON encodes and compresses a value, zstd is used if available and zlib otherwise.
+
+    Returns
+    -------
+    tuple(str, int, bytes)
+        The compression used, the size of the encoded value, and the compressed data
+    """
+
+    raw = json.dumps(value).encode("UTF-8")
+    if zstandard is not None:
+        return ("zstd", len(raw), zstandard.ZstdCompressor().compress(raw))
+    else:
+        return ("zlib", len(raw), zlib.compress(raw))
+
+
+def decompress_blob(compression, data):
+    """
+    Reverses `compress_blob`.
+    """
+
+    if compression == "zstd":
+        if zstandard is None:
+            raise ImportError("Decompressing zstd blobs requires the zstandard module.")
+        raw = zstandard.ZstdDecompressor().decompress(data)
+    elif compression == "zlib":
+        raw = zlib.decompress(data)
+    else:
+        raise KeyError("Blob compression '{}' not understood".format(compression))
+
+    return json.loads(raw.decode("UTF-8"))
+
+
+# The keys of an encoded array
+_array_keys = {"dtype", "shape", "data"}
+
+
+def encode_array(value):
+    """
+    Encodes a numeric array (or nested list) as a {"dtype", "shape", "data"} document holding the
+    raw buffer, other values are returned unchanged.
+    """
+
+    if not isinstance(value, (list, tuple, np.ndarray)) or (len(value) == 0):
+        return value
+
+    try:
+        arr = np.asarray(value)
+    except ValueError:
+        # Ragged lists
+        return value
+
+    if arr.dtype.kind not in "fiu":
+        return value
+
+    arr = np.ascontiguousarray(arr)
+    return {"dtype": arr.dtype.str, "shape": list(arr.shape), "data": arr.tobytes()}
+
+
+def decode_array(value):
+    """
+    Reverses `encode_array`. The returned NumPy array is a read-only view of the stored buffer.
+    Numeric lists of documents written before arrays were encoded are returned as read-only
+    arrays as well, so that a field always decodes to the same type.
+    """
+
+    if isinstance(value, list):
+        value = encode_array(value)
+
+    if not isinstance(value, dict) or (value.keys() != _array_keys):
+        return value
+
+    return np.frombuffer(value["data"], dtype=np.dtype(value["dtype"])).reshape(value["shape"])
+
+
+def arrays_to_lists(obj):
+    """
+    Recursively converts the NumPy arrays and scalars of an object into their list form.
+    """
+
+    if isinstance(obj, dict):
+        return {k: arrays_to_lists(v) for k, v in obj.items()}
+    elif isinstance(obj, (list, tuple)):
+        return [arrays_to_lists(v) for v in obj]
+    elif isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    else:
+        return obj
+
+
 def get_metadata():
     """
     Returns a copy of the metadata for database getters
@@ -67,8 +173,9 @@ def mixed_molecule_get(socket, data):
 
     inv_id_mols = {v: k for k, v in id_mols.items()}
 
+    # Molecules are embedded in JSON task specs, so arrays are returned in list form
     for mol in id_mols_list:
-        ret_mols[inv_id_mols[mol["id"]]] = mol
+        ret_mols[inv_id_mols[mol["id"]]] = arrays_to_lists(mol)
 
     meta["success"] = True
     meta["n_found"] = len(ret_mols)
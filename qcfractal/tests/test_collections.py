@@ -52,6 +52,11 @@ def test_compute_dataset(fractal_compute_server):
     assert len(ret["submitted"]) == 3
     fractal_compute_server.objects["queue_nanny"].await_results()
 
+    # Nothing is resubmitted once computed
+    ret = ds.compute("SCF", "STO-3G")
+    assert len(ret["submitted"]) == 0
+    assert len(ret["completed"]) == 3
+
     # Query computed results
     assert ds.query("SCF", "STO-3G")
     assert pytest.approx(0.6024530476071095, 1.e-5) == ds.df.loc["He1", "SCF/STO-3G"]
@@ -2,6 +2,10 @@
 Tests the interface portal adapter to the REST API
 """
 
+import numpy as np
+import pytest
+import requests
+
 import qcfractal.interface as portal
 from qcfractal.testing import test_server
 
@@ -26,6 +30,11 @@ def test_molecule_portal(test_server):
     get_mol = client.get_molecules(["H4O2"], index="molecular_formula")
     assert water.compare(get_mol[0])
 
+    # Test paged iteration
+    get_mol = list(client.iter_molecules([ret["water"], ret["water"]], index="id", page_size=1))
+    assert len(get_mol) == 1
+    assert water.compare(get_mol[0])
+
 
 def test_options_portal(test_server):
 
@@ -54,5 +63,410 @@ def test_collection_portal(test_server):
     # Test get
     get_db = client.get_collection(db["collection"], db["name"], full_return=True)
     del get_db["data"][0]["id"]
+    del get_db["data"][0]["version"]
 
     assert db == get_db["data"][0]
+
+    # Test cached get is revalidated against the server version
+    cached = client.get_collection(db["collection"], db["name"], full_return=True)
+    assert cached["data"][0]["version"] == 1
+
+    cached["data"][0]["something"] = "new"
+    client.add_collection(cached["data"][0], overwrite=True)
+
+    get_db = client.get_collection(db["collection"], db["name"], full_return=True)
+    assert get_db["data"][0]["version"] == 2
+    assert get_db["data"][0]["something"] == "new"
+
+
+def test_dataset_portal_delta_save(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+
+    ds = portal.collections.Dataset("delta_save", client)
+    ds.add_rxn("rxn1", [(water, 1.0)])
+    ds.save()
+
+    stale = client.get_collection("dataset", "delta_save")
+
+    # Only the new reaction and changed fields are sent
+    ds.add_rxn("rxn2", [(water, 2.0)])
+    ds.data["provenance"] = {"creator": "delta"}
+    ds.save(overwrite=True)
+
+    ds = client.get_collection("dataset", "delta_save")
+    assert ds.get_index() == ["rxn1", "rxn2"]
+    assert ds.data["provenance"] == {"creator": "delta"}
+    assert ds.data["version"] == 2
+
+    # Replaced reactions are saved by position
+    ds.set_rxn("rxn1", [(water, 1.0)], attributes={"R": 2.5})
+    assert ds._build_delta()["set_entries"] == {"reactions": {"0": ds.get_rxn("rxn1")}}
+    ds.save(overwrite=True)
+
+    ds = client.get_collection("dataset", "delta_save")
+    assert ds.get_rxn("rxn1")["attributes"] == {"R": 2.5}
+    assert ds.data["version"] == 3
+
+    # Reactions are stored outside of the collection document
+    doc = test_server.storage._tables["collections"].find_one({"name": "delta_save"})
+    assert doc["reactions"] == []
+
+    # Saving an outdated copy is rejected
+    stale.add_rxn("rxn3", [(water, 1.0)])
+    with pytest.raises(ValueError):
+        stale.save(overwrite=True)
+
+
+def test_dataset_portal_lazy(test_server, monkeypatch):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    water2 = portal.data.get_molecule("water_dimer_stretch.psimol")
+
+    ds = portal.collections.Dataset("lazy_open", client)
+    for x in range(5):
+        ds.add_rxn("rxn" + str(x), {"default": [(water, 1.0), (water2, float(x))], "cp": [(water, 2.0)]})
+    ds.save()
+
+    full = client.get_collection("dataset", "lazy_open")
+
+    # Pull reactions two at a time
+    monkeypatch.setattr(portal.collections.Dataset, "_page_size", 2)
+    lazy = portal.collections.Dataset.from_server(client, "lazy_open", lazy=True)
+    assert lazy.data["reactions"] is None
+    assert lazy.get_index() == full.get_index()
+    assert list(lazy.df.index) == full.get_index()
+
+    # Only the requested stoichiometry is unrolled
+    assert lazy._get_rxn_index("cp").equals(full._get_rxn_index("cp"))
+    assert lazy.data["reactions"] is None
+
+    # Reactions are pulled when they are needed
+    assert lazy.get_rxn("rxn3") == full.get_rxn("rxn3")
+    assert lazy.data["reactions"] == full.data["reactions"]
+
+
+def test_dataset_portal_batch_query(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    water2 = portal.data.get_molecule("water_dimer_stretch.psimol")
+    mol_ids = client.add_molecules({"w1": water, "w2": water2})
+
+    ds = portal.collections.Dataset("batch_query", client)
+    for x in range(3):
+        ds.add_rxn("rxn" + str(x), {"default": [(water, 1.0), (water2, float(x))]})
+    ds.save()
+
+    results = []
+    for method, scale in [("bq1", 1.0), ("bq2", 2.0)]:
+        for key, value in [("w1", 1.0), ("w2", 0.25)]:
+            if (method, key) == ("bq2", "w2"):
+                continue
+            results.append({
+                "molecule_id": mol_ids[key],
+                "method": method,
+                "basis": "bqb",
+                "options": "default",
+                "program": "psi4",
+                "driver": "energy",
+                "return_result": scale * value,
+                "hash_index": "batch_query_" + method + key
+            })
+    test_server.storage.add_results(results)
+
+    ds = client.get_collection("dataset", "batch_query")
+    ds.batch_query([("bq1", "bqb"), ("bq2", "bqb"), ("bq3", "bqb")], scale=1.0)
+    assert list(ds.df.columns) == ["bq1/bqb", "bq2/bqb", "bq3/bqb"]
+    assert list(ds.df["bq1/bqb"]) == pytest.approx([1.0, 1.25, 1.5])
+
+    # A missing molecule nulls out every reaction that contains it
+    assert ds.df["bq2/bqb"].isnull().all()
+    assert ds.df["bq3/bqb"].isnull().all()
+
+    # The single query is the same path
+    ds.query("bq1", "bqb", prefix="single-", scale=1.0)
+    assert ds.df["single-bq1/bqb"].equals(ds.df["bq1/bqb"].rename("single-bq1/bqb"))
+
+
+def test_dataset_portal_query_cache(test_server, tmp_path, monkeypatch):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = client.add_molecules({"w1": water})["w1"]
+
+    ds = portal.collections.Dataset("query_cache", client)
+    ds.add_rxn("rxn0", {"default": [(water, 2.0)]})
+    ds.save()
+
+    def add_result(method):
+        test_server.storage.add_results([{
+            "molecule_id": mol_id,
+            "method": method,
+            "basis": "qcb",
+            "options": "default",
+            "program": "psi4",
+            "driver": "energy",
+            "return_result": 1.0,
+            "hash_index": "query_cache_" + method
+        }])
+
+    add_result("qc1")
+
+    pulls = []
+    get_results = client.get_results
+    monkeypatch.setattr(client, "get_results", lambda **kwargs: pulls.append(kwargs) or get_results(**kwargs))
+
+    ds = client.get_collection("dataset", "query_cache")
+    ds.set_query_cache(str(tmp_path))
+    ds.batch_query([("qc1", "qcb"), ("qc2", "qcb")], scale=1.0)
+    assert len(pulls) == 1
+
+    # A new session reads from disk
+    ds = client.get_collection("dataset", "query_cache")
+    ds.set_query_cache(portal.collections.QueryCache(str(tmp_path)))
+    ds.batch_query([("qc1", "qcb"), ("qc2", "qcb")], scale=1.0)
+    assert len(pulls) == 1
+    assert ds.df.loc["rxn0", "qc1/qcb"] == pytest.approx(2.0)
+    assert ds.df["qc2/qcb"].isnull().all()
+
+    # New results invalidate the entry
+    add_result("qc2")
+    ds.batch_query([("qc1", "qcb"), ("qc2", "qcb")], scale=1.0)
+    assert len(pulls) == 2
+    assert ds.df.loc["rxn0", "qc2/qcb"] == pytest.approx(2.0)
+
+    # Unsaved reactions bypass the cache
+    ds.add_rxn("rxn1", {"default": [(water, 1.0)]})
+    ds.batch_query([("qc1", "qcb"), ("qc2", "qcb")], scale=1.0)
+    assert len(pulls) == 3
+
+    # Saving clears the modified state, replacing a reaction sets it
+    ds.save(overwrite=True)
+    assert ds._matches_server()
+    ds.set_rxn("rxn1", {"default": [(water, 3.0)]})
+    ds._new_molecule_jsons = {}
+    assert not ds._matches_server()
+
+
+def test_dataset_portal_compute_missing(test_server, monkeypatch):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    water2 = portal.data.get_molecule("water_dimer_stretch.psimol")
+    water3 = portal.data.get_molecule("water_dimer_minima.psimol").get_fragment(0)
+    mol_ids = client.add_molecules({"w1": water, "w2": water2, "w3": water3})
+
+    ds = portal.collections.Dataset("compute_missing", client)
+    ds.add_rxn("rxn0", {"default": [(water, 1.0), (water2, 1.0), (water3, 1.0)]})
+    ds.save()
+
+    test_server.storage.add_results([{
+        "molecule_id": mol_ids["w1"],
+        "method": "cm1",
+        "basis": "cmb",
+        "options": "default",
+        "program": "psi4",
+        "driver": "energy",
+        "return_result": 1.0,
+        "hash_index": "compute_missing_w1"
+    }])
+
+    submitted = []
+
+    def add_compute(program, method, basis, driver, options, molecule_id, return_full=False):
+        submitted.append(list(molecule_id))
+        return {"meta": {"errors": []}, "data": {"submitted": molecule_id, "completed": [], "queue": []}}
+
+    monkeypatch.setattr(client, "add_compute", add_compute)
+    monkeypatch.setattr(portal.collections.Dataset, "_compute_chunk_size", 1)
+
+    ret = ds.compute("CM1", "CMB")
+    assert ret["completed"] == [mol_ids["w1"]]
+    assert sorted(ret["submitted"]) == sorted([mol_ids["w2"], mol_ids["w3"]])
+    assert sorted(submitted) == sorted([[mol_ids["w2"]], [mol_ids["w3"]]])
+
+
+def test_batch_portal(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = client.add_molecules({"water": water})["water"]
+
+    with client.batch() as batch:
+        mols = batch.get_molecules([mol_id], index="id")
+        formula = batch.get_molecules(["H4O2"], index="molecular_formula", full_return=True)
+        collections = batch.list_collections()
+        bad = batch.get_molecules([mol_id], index="bad_index")
+        assert mols.done() is False
+
+    assert water.compare(mols.result()[0])
+    assert formula.result()["meta"]["success"]
+    assert isinstance(collections.result(), dict)
+
+    with pytest.raises(KeyError):
+        bad.result()
+
+    # The client itself is left untouched
+    assert client._batch_slot is None
+    assert "_request" not in vars(client)
+
+    # A request failing on the server only fails its own entry
+    ret = client._request("post", "batch", {
+        "meta": {},
+        "data": [{
+            "endpoint": "locator",
+            "method": "get",
+            "payload": {
+                "data": {
+                    "table": "molecules"
+                }
+            }
+        }, {
+            "endpoint": "molecule",
+            "method": "get",
+            "payload": {
+                "meta": {
+                    "index": "id"
+                },
+                "data": [mol_id]
+            }
+        }]
+    })
+    assert ret["data"][0]["status"] == 400
+    assert ret["data"][1]["status"] == 200
+    assert len(ret["data"][1]["response"]["data"]) == 1
+
+    # Malformed batches are rejected as a whole
+    for data in [{}, [], [5], [{"endpoint": 5}], [{"endpoint": "molecule", "method": None}],
+                 [{"endpoint": "molecule", "payload": [mol_id]}]]:
+        with pytest.raises(requests.exceptions.HTTPError) as e:
+            client._request("post", "batch", {"meta": {}, "data": data})
+        assert "Batch" in str(e.value)
+
+
+def test_molecule_portal_msgpack(test_server):
+    pytest.importorskip("msgpack")
+
+    client = portal.FractalClient(test_server.get_address(""), encoding="msgpack")
+
+    water = portal.data.get_molecule("water_dimer_stretch2.psimol")
+
+    # Test add
+    ret = client.add_molecules({"water": water})
+
+    # Test get
+    get_mol = client.get_molecules(ret["water"], index="id")
+    assert water.compare(get_mol[0])
+
+    # Geometries are sent as typed buffers, JSON clients receive lists
+    assert isinstance(get_mol[0]["geometry"], np.ndarray)
+
+    json_client = portal.FractalClient(test_server.get_address(""))
+    assert isinstance(json_client.get_molecules(ret["water"], index="id")[0]["geometry"], list)
+
+
+def test_result_portal_blobs(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = client.add_molecules({"water": water})["water"]
+
+    stdout = "SCF iteration\n" * 1000
+    test_server.storage.add_results([{
+        "molecule_id": mol_id,
+        "method": "blob",
+        "basis": "blob",
+        "options": "default",
+        "program": "P1",
+        "driver": "energy",
+        "return_result": 1.0,
+        "stdout": stdout,
+        "hash_index": "portal_blob",
+    }])
+
+    # Results keep their schema
+    ret = client.get_results(method="blob")
+    assert ret[0]["stdout"] == stdout
+
+    ret = client.get_results(method="blob", projection={"stdout": True})
+    assert ret[0]["stdout"] == stdout
+
+    # References can be pulled later on
+    ret = client.get_results(method="blob", resolve_blobs=False)
+    assert set(ret[0]["stdout"]) == {"blob_id"}
+
+    client.resolve_blobs(ret)
+    assert ret[0]["stdout"] == stdout
+
+
+def test_result_portal_bad_filters(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    with pytest.raises(KeyError):
+        client.get_results(method="blob", filters=[["$where", "==", 5]])
+
+    ret = client.get_results(method="blob", filters=[["$where", "==", 5]], return_full=True)
+    assert ret["meta"]["success"] is False
+    assert "$where" in ret["meta"]["error_description"]
+
+
+def test_result_portal_stream(test_server):
+
+    client = portal.FractalClient(test_server.get_address(""))
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = client.add_molecules({"water": water})["water"]
+
+    results = []
+    for x in range(250):
+        results.append({
+            "molecule_id": mol_id,
+            "method": "stream" + str(x),
+            "basis": "B1",
+            "options": "default",
+            "program": "P1",
+            "driver": "energy",
+            "return_result": float(x),
+            "hash_index": "stream" + str(x),
+        })
+    ret = test_server.storage.add_results(results)
+    assert ret["meta"]["n_inserted"] == 250
+
+    # Stream across several flushed chunks
+    streamed = list(client.iter_results(molecule_id=mol_id, basis="B1", projection={"return_result": True}))
+    assert len(streamed) == 250
+    assert {x["return_result"] for x in streamed} == set(float(x) for x in range(250))
+
+    # Matches the non-streaming query
+    full = client.get_results(molecule_id=mol_id, basis="B1", projection={"return_result": True})
+    assert sorted(x["return_result"] for x in full) == sorted(x["return_result"] for x in streamed)
+
+    # Page through the same query
+    page = client.get_results(molecule_id=mol_id, basis="B1", limit=100, return_full=True)
+    assert page["meta"]["n_found"] == 100
+
+    paged = page["data"]
+    while page["meta"]["next_cursor"]:
+        page = client.get_results(
+            molecule_id=mol_id, basis="B1", limit=100, cursor=page["meta"]["next_cursor"], return_full=True)
+        paged.extend(page["data"])
+
+    assert len(paged) == 250
+    assert len({x["hash_index"] for x in paged}) == 250
+
+    # Streams honour the negotiated encoding
+    if portal.serialization.msgpack is not None:
+        mp_client = portal.FractalClient(test_server.get_address(""), encoding="msgpack")
+        streamed = list(mp_client.iter_results(molecule_id=mol_id, basis="B1", projection={"return_result": True}))
+        assert sorted(x["return_result"] for x in streamed) == sorted(x["return_result"] for x in full)
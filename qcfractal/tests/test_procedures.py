@@ -4,7 +4,7 @@ Tests the server compute capabilities.
 
 import qcfractal.interface as portal
 from qcfractal import testing
-from qcfractal.testing import fractal_compute_server
+from qcfractal.testing import fractal_compute_server, storage_socket_fixture as storage_socket
 import requests
 import pytest
 
@@ -131,4 +131,79 @@ def test_procedure_optimization(fractal_compute_server):
     # Check that duplicates are caught
     r = requests.post(fractal_compute_server.get_address("task_scheduler"), json=compute)
     assert r.status_code == 200
-    assert len(r.json()["data"]["completed"]) == 1
\ No newline at end of file
+    assert len(r.json()["data"]["completed"]) == 1
+
+
+def test_procedure_task_references(storage_socket):
+
+    from qcfractal import procedures
+
+    helium = portal.Molecule([[2, 0, 0, 0.0]], dtype="numpy", units="bohr")
+    mol_id = storage_socket.add_molecules({"helium": helium.to_json()})["data"]["helium"]
+
+    option = portal.data.get_options("psi_default")
+    storage_socket.add_options([option])
+
+    compute = {
+        "meta": {
+            "procedure": "single",
+            "driver": "energy",
+            "method": "reference",
+            "basis": "sto-3g",
+            "options": option["name"],
+            "program": "psi4",
+        },
+        "data": [mol_id],
+    }
+    tasks, complete, errors = procedures.get_procedure_input_parser("single")(storage_socket, compute)
+    assert len(tasks) == 1
+
+    # The queue only holds references to the molecule and options
+    args = tasks[0]["spec"]["args"][0]
+    assert args["molecule"] == {"__reference__": {"table": "molecules", "key": mol_id}}
+    assert args["keywords"] == {"__reference__": {"table": "options", "key": ["psi4", option["name"]]}}
+
+    queue_ids = storage_socket.queue_submit(tasks)["data"]
+    found = storage_socket.queue_get_next(n=10)
+    found = [x for x in found if x["id"] in queue_ids]
+
+    # Tasks whose documents are missing are reported instead of submitted
+    missing = dict(found[0], id="missing")
+    missing["spec"] = {"args": [{"molecule": procedures.procedures_util.task_reference("molecules", "bad")}]}
+
+    ready, errors = procedures.procedures_util.materialize_tasks(storage_socket, found + [missing])
+    assert len(ready) == 1
+    assert errors[0][0] == "missing"
+
+    args = ready[0]["spec"]["args"][0]
+    assert args["molecule"]["id"] == mol_id
+    assert args["molecule"]["symbols"] == ["HE"]
+    assert isinstance(args["molecule"]["geometry"], list)
+
+    assert args["keywords"] == {k: v for k, v in option.items() if k not in ["name", "program", "id"]}
+
+    # Optimization tasks reference their stored options as a template
+    opt_option = {"name": "reference_opt", "program": "geometric", "coordsys": "tric", "maxiter": 50}
+    storage_socket.add_options([opt_option])
+    compute = {
+        "meta": {
+            "procedure": "optimization",
+            "program": "geometric",
+            "options": opt_option["name"],
+            "qc_meta": compute["meta"],
+        },
+        "data": [mol_id],
+    }
+    tasks, complete, errors = procedures.get_procedure_input_parser("optimization")(storage_socket, compute)
+    assert tasks[0]["spec"]["args"][0]["keywords"] == {
+        "__reference__": {
+            "table": "options",
+            "key": ["geometric", "reference_opt"],
+            "update": {"program": "psi4"}
+        }
+    }
+
+    ready, errors = procedures.procedures_util.materialize_tasks(storage_socket, tasks)
+    assert errors == []
+    assert ready[0]["spec"]["args"][0]["keywords"] == {"coordsys": "tric", "maxiter": 50, "program": "psi4"}
+    assert ready[0]["spec"]["args"][0]["initial_molecule"]["id"] == mol_id
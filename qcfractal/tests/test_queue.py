@@ -140,3 +140,34 @@ def test_queue_duplicate_submissions(fractal_compute_server):
     # Cleanup
     fractal_compute_server.objects["storage_socket"].queue_mark_complete([(queue_id, "output")])
 
+
+@testing.using_rdkit
+def test_queue_recover(fractal_compute_server):
+
+    client = portal.FractalClient(fractal_compute_server.get_address())
+
+    he2 = portal.data.get_molecule("helium_dimer.json").to_json()
+    he2["name"] = "recover"
+    he2["geometry"][-1] += 0.5
+    mol_ret = client.add_molecules({"he2": he2})
+
+    ret = client.add_compute("rdkit", "UFF", "", "energy", "none", mol_ret["he2"])
+    queue_id = ret["submitted"][0]
+
+    # Forget the running task as if the server had restarted
+    nanny = fractal_compute_server.objects["queue_nanny"]
+    assert nanny.list_current_tasks() == [queue_id]
+    nanny.queue_adapter.queue.clear()
+
+    ret = nanny.recover()
+    assert ret["reattached"] == 0
+    assert ret["requeued"] == 1
+
+    db = fractal_compute_server.objects["storage_socket"]
+    assert db.get_queue({"id": queue_id})["data"][0]["status"] == "WAITING"
+
+    # The task is handed out and computed again
+    nanny.update()
+    assert nanny.list_current_tasks() == [queue_id]
+    nanny.await_results()
+    assert db.get_queue({"id": queue_id})["data"][0]["status"] == "COMPLETE"
@@ -100,9 +100,22 @@ def test_storage_socket(test_server):
     assert r.status_code == 200
 
     pdata = r.json()
+    etag = r.headers["ETag"]
+    assert pdata["data"][0]["version"] == 1
+
     del pdata["data"][0]["id"]
+    del pdata["data"][0]["version"]
     assert pdata["data"][0] == storage
 
+    # Unchanged collections are not resent
+    r = requests.get(
+        storage_api_addr,
+        json={"meta": {},
+              "data": [(storage["collection"], storage["name"])]},
+        headers={"If-None-Match": etag})
+    assert r.status_code == 304
+    assert r.content == b""
+
 
 def test_result_socket(test_server):
 
@@ -80,6 +80,27 @@ def test_service_torsiondrive_single(torsiondrive_fixture):
     assert "symbols" in result.final_molecules()[(-90, )]
 
 
+def test_service_torsiondrive_trajectories(torsiondrive_fixture):
+    """Tests that all trajectories are pulled in one request and match the per-optimization trajectories"""
+
+    spin_up_test, client = torsiondrive_fixture
+
+    spin_up_test()
+    result = client.get_procedures({"procedure": "torsiondrive"})[0]
+
+    trajectories = result.get_trajectories(projection={"return_result": True})
+    history = result.get_history()
+    assert trajectories.keys() == history.keys()
+
+    for key, optimizations in history.items():
+        assert len(trajectories[key]) == len(optimizations)
+
+        for trajectory, opt in zip(trajectories[key], optimizations):
+            assert len(trajectory) > 0
+            assert set(trajectory[0].keys()) <= {"id", "return_result"}
+            assert trajectory == opt.get_trajectory(projection={"return_result": True})
+
+
 def test_service_torsiondrive_duplicates(torsiondrive_fixture):
     """Ensure that duplicates are properly caught and yield the same results without calculation"""
 
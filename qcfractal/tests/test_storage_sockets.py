@@ -4,6 +4,12 @@ Tests the database wrappers
 All tests should be atomic, that is create and cleanup their data
 """
 
+import copy
+import datetime
+import logging
+
+import bson
+import numpy as np
 import pytest
 
 import qcfractal.interface as portal
@@ -96,6 +102,37 @@ def test_molecules_get(storage_socket):
     assert ret == 1
 
 
+def test_locator_batch(storage_socket):
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    water2 = portal.data.get_molecule("water_dimer_stretch.psimol")
+    mol_insert = storage_socket.add_molecules({"water1": water.to_json(), "water2": water2.to_json()})
+    id1, id2 = mol_insert["data"]["water1"], mol_insert["data"]["water2"]
+
+    locators = [
+        {"table": "molecules", "index": "id", "data": [id2, id1]},
+        {"table": "molecules", "index": "id", "data": id1, "projection": {"molecular_formula": True}},
+        {"table": "molecules", "index": "molecule_hash", "data": water2.get_hash(), "projection": {"symbols": True}},
+        {"table": "molecules", "index": "id", "data": "5b7f1fd57b87872d2c5d0a6d"},
+    ]
+    ret = storage_socket.locator(locators)
+    assert ret["meta"]["n_found"] == 4
+    assert ret["meta"]["missing"] == [(3, "5b7f1fd57b87872d2c5d0a6d")]
+
+    # Results are in input order
+    assert [x["id"] for x in ret["data"][0]] == [id2, id1]
+    assert set(ret["data"][1][0].keys()) == {"id", "molecular_formula"}
+    assert set(ret["data"][2][0].keys()) == {"id", "symbols"}
+    assert ret["data"][3] == []
+
+    # Single locators return the documents directly
+    ret = storage_socket.locator(locators[0])
+    assert [x["id"] for x in ret["data"]] == [id2, id1]
+
+    ret = storage_socket.del_molecules([id1, id2], index="id")
+    assert ret == 2
+
+
 def test_molecules_bad_get(storage_socket):
 
     water = portal.data.get_molecule("water_dimer_minima.psimol")
@@ -164,6 +201,29 @@ def test_collections_add(storage_socket):
     assert ret["meta"]["n_found"] == 0
 
 
+def test_collections_key_pagination(storage_socket):
+
+    keys = [("torsiondrive", "page" + str(x)) for x in range(3)]
+    for collection, name in keys:
+        storage_socket.add_collection({"collection": collection, "name": name})
+
+    # Key lists are limited and paged like any other query
+    ret = storage_socket.get_collections(keys, limit=2)
+    assert [x["name"] for x in ret["data"]] == ["page0", "page1"]
+    assert ret["meta"]["next_cursor"] == "2"
+
+    ret = storage_socket.get_collections(keys, limit=2, cursor=ret["meta"]["next_cursor"])
+    assert [x["name"] for x in ret["data"]] == ["page2"]
+    assert ret["meta"]["next_cursor"] is None
+
+    ret = storage_socket.get_collections(keys, limit=2, cursor="bad")
+    assert ret["meta"]["n_found"] == 0
+    assert "bad" in ret["meta"]["error_description"]
+
+    for collection, name in keys:
+        assert storage_socket.del_collection(collection, name) == 1
+
+
 def test_collections_overwrite(storage_socket):
 
     db = {"collection": "TorsionDrive", "name": "Torsion123", "something": "else", "array": ["54321"]}
@@ -196,6 +256,29 @@ def test_collections_overwrite(storage_socket):
     assert ret == 1
 
 
+def test_collections_legacy_entries(storage_socket):
+
+    # Collections written before entries had their own table hold them inline
+    legacy = {
+        "collection": "dataset",
+        "name": "legacy_entries",
+        "version": 1,
+        "reactions": [{"name": "a"}, {"name": "b"}]
+    }
+    uid = str(storage_socket._tables["collections"].insert_one(legacy).inserted_id)
+
+    ret = storage_socket.update_collection(uid, 1, push_fields={"reactions": [{"name": "c"}]})
+    assert ret["meta"]["success"] is True
+
+    ret = storage_socket.get_collections([("dataset", "legacy_entries")])
+    assert [x["name"] for x in ret["data"][0]["reactions"]] == ["a", "b", "c"]
+
+    ret = storage_socket.get_collection_entries(uid, "reactions")
+    assert [x["name"] for x in ret["data"]] == ["a", "b", "c"]
+
+    assert storage_socket.del_collection("dataset", "legacy_entries") == 1
+
+
 def test_results_add(storage_socket):
 
     # Add two waters
@@ -356,6 +439,78 @@ def test_results_query_driver(storage_results):
     assert ret["meta"]["n_found"] == 2
 
 
+def test_results_query_pagination(storage_results):
+    ret = storage_results.get_results({}, projection={"return_result": True}, limit=2)
+    assert ret["meta"]["n_found"] == 2
+    assert set(ret["data"][0].keys()) == {"return_result"}
+
+    found = ret["data"]
+    while ret["meta"]["next_cursor"]:
+        ret = storage_results.get_results({}, projection={"return_result": True}, limit=2,
+                                          cursor=ret["meta"]["next_cursor"])
+        found.extend(ret["data"])
+
+    assert sorted(x["return_result"] for x in found) == [5, 10, 15, 15, 20]
+
+    ret = storage_results.get_results({}, limit=2, cursor="bad_cursor")
+    assert ret["meta"]["n_found"] == 0
+    assert "bad_cursor" in ret["meta"]["error_description"]
+
+    assert storage_results.get_limit(10**6) == storage_results.get_limit()
+
+
+def test_results_query_filters(storage_results):
+    ret = storage_results.get_results({"program": "P1"}, filters=[["return_result", ">", 5]])
+    assert sorted(x["return_result"] for x in ret["data"]) == [10, 20]
+
+    ret = storage_results.get_results({}, filters=[["return_result", ">=", 10], ["return_result", "<", 20],
+                                                   ["method", "in", ["M1"]]])
+    assert sorted(x["return_result"] for x in ret["data"]) == [10, 15]
+
+    ret = storage_results.get_results({},
+                                      filters=[["return_result", "exists", True]],
+                                      projection={"return_result": True})
+    assert ret["meta"]["n_found"] == 5
+    assert set(ret["data"][0].keys()) == {"return_result"}
+
+    assert storage_results.get_results({}, filters=[["missing_field", "exists", True]])["meta"]["n_found"] == 0
+    assert storage_results.get_results({}, filters=[["driver", "!=", "energy"]])["meta"]["n_found"] == 3
+
+    # Malformed filters are rejected
+    for filters in [[["return_result", "$gt", 5]], [["$where", "==", 5]], [["return_result", ">", {"$gt": 5}]],
+                    [["return_result", "in", 5]], [["return_result", ">", 5, 6]], [["id", "==", "abc"]]]:
+        ret = storage_results.get_results({}, filters=filters)
+        assert ret["meta"]["n_found"] == 0
+        assert ret["meta"]["success"] is False
+        assert ret["meta"]["error_description"]
+
+
+def test_results_aggregate(storage_results):
+    ret = storage_results.aggregate_results({"driver": "gradient"}, group_by=["program", "method"])
+    assert ret["meta"]["success"]
+    assert ret["data"]["columns"] == ["program", "method", "count", "sum", "min", "max", "mean"]
+    assert ret["data"]["rows"] == [["p1", "m2", 1, 20, 20, 20, 20], ["p2", "m1", 1, 15, 15, 15, 15],
+                                   ["p2", "m2", 1, 15, 15, 15, 15]]
+
+    ret = storage_results.aggregate_results({}, group_by=[], stats=["count", "mean"])
+    assert ret["data"]["rows"] == [[5, 13]]
+
+    ret = storage_results.aggregate_results({}, field="$where")
+    assert ret["meta"]["success"] is False
+    assert "$where" in ret["meta"]["error_description"]
+
+    ret = storage_results.aggregate_results({}, stats=["median"])
+    assert "median" in ret["meta"]["error_description"]
+
+
+def test_results_search_qc_variable(storage_results):
+    mol_ids = list(set(x["molecule_id"] for x in storage_results.get_results({"program": "P1"})["data"]))
+
+    ret = storage_results.search_qc_variable(mol_ids + ["bad_id"], "method")
+    assert set(ret["method"][mol_ids]) <= {"m1", "m2"}
+    assert ret.loc["bad_id", "method"] is None
+
+
 # Builds tests for the queue
 
 
@@ -461,6 +616,7 @@ def test_user_permissions_default(storage_socket):
 
     # Verify incorrect permission
     assert storage_socket.verify_user("george", "shortpw", "admin")[0] is False
+    assert storage_socket.verify_user("george", "shortpw", ["read", "admin"])[0] is False
 
     assert storage_socket.remove_user("george") is True
 
@@ -475,9 +631,359 @@ def test_user_permissions_admin(storage_socket):
     assert storage_socket.verify_user("george", "shortpw", "write")[0] is True
     assert storage_socket.verify_user("george", "shortpw", "compute")[0] is True
     assert storage_socket.verify_user("george", "shortpw", "admin")[0] is True
+    assert storage_socket.verify_user("george", "shortpw", ["read", "write"])[0] is True
 
     assert storage_socket.remove_user("george") is True
 
 
 def test_project_name(storage_socket):
     assert 'qcf_local_values_test' == storage_socket.get_project_name()
+
+
+def test_storage_indices(storage_socket):
+
+    indices = [v["key"] for v in storage_socket._tables["task_queue"].index_information().values()]
+    assert [("status", 1), ("tag", 1), ("created_on", -1)] in indices
+
+    indices = [v["key"] for v in storage_socket._tables["procedures"].index_information().values()]
+    assert [("hash_index", 1)] in indices
+
+
+def test_storage_query_profiler():
+
+    from types import SimpleNamespace
+    from qcfractal.storage_sockets.mongo_socket import _QueryProfiler
+
+    class ListHandler(logging.Handler):
+        def __init__(self):
+            super().__init__()
+            self.records = []
+
+        def emit(self, record):
+            self.records.append(record.getMessage())
+
+    handler = ListHandler()
+    logger = logging.getLogger("test_query_profiler")
+    logger.addHandler(handler)
+
+    plan = {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}, "rejectedPlans": [{"stage": "IXSCAN"}]}}
+    profiler = _QueryProfiler(50, logger, explain=lambda database, command: plan)
+
+    def run(request_id, duration, command):
+        name = list(command)[0]
+        started = SimpleNamespace(command_name=name, command=command, connection_id="c", request_id=request_id)
+        profiler.started(started)
+        profiler.succeeded(
+            SimpleNamespace(
+                command_name=name,
+                connection_id="c",
+                request_id=request_id,
+                duration_micros=duration * 1000,
+                database_name="db"))
+
+    run(1, 10, {"find": "results", "filter": {"method": "b3lyp"}, "lsid": {}})
+    run(2, 100, {"find": "results", "filter": {"program": "psi4"}, "lsid": {}})
+
+    # Slow commands are explained in the background
+    profiler.wait()
+
+    stats = profiler.stats[("results", "find")]
+    assert stats["count"] == 2
+    assert stats["max_ms"] == pytest.approx(100)
+    assert stats["collscans"] == 1
+
+    # Only the slow query is logged with its plan
+    assert len(profiler.slow_queries) == 1
+    slow = profiler.slow_queries[0]
+    assert slow["plan"] == [("COLLSCAN", None)]
+    assert slow["query"] == {"filter": {"program": "psi4"}}
+
+    assert len(handler.records) == 1
+    assert "COLLSCAN" in handler.records[0]
+    assert "missing index" in handler.records[0]
+
+    # Without an explain slow commands are logged without their plan
+    profiler = _QueryProfiler(50, logger)
+    run(3, 100, {"find": "results", "filter": {"program": "psi4"}, "lsid": {}})
+    assert profiler.slow_queries[0]["plan"] is None
+    assert len(handler.records) == 2
+    assert "missing index" not in handler.records[1]
+
+    logger.removeHandler(handler)
+
+
+def test_results_blobs(storage_socket):
+
+    water = portal.data.get_molecule("water_dimer_minima.psimol")
+    mol_id = storage_socket.add_molecules({"water": water.to_json()})["data"]["water"]
+
+    stdout = "SCF iteration\n" * 1000
+    page = {
+        "molecule_id": mol_id,
+        "method": "blob",
+        "basis": "B1",
+        "options": "default",
+        "program": "P1",
+        "driver": "energy",
+        "return_result": 5,
+        "stdout": stdout,
+        "stderr": "small",
+        "hash_index": "blob",
+    }
+    ret = storage_socket.add_results([page])
+    assert ret["meta"]["n_inserted"] == 1
+    result_id = ret["data"][0][1]
+
+    # Large fields are stored compressed and out of line, small ones stay inline
+    blob = storage_socket._tables["blobs"].find_one()
+    assert blob["size"] > len(stdout)
+    assert len(blob["data"]) < len(stdout)
+
+    # Returned blob fields are resolved
+    ret = storage_socket.get_results({"id": [result_id]})["data"][0]
+    assert ret["stdout"] == stdout
+    assert ret["stderr"] == "small"
+
+    ret = storage_socket.get_results({"id": [result_id]}, projection={"stdout": True})["data"][0]
+    assert ret["stdout"] == stdout
+
+    ret = list(storage_socket.iter_results({"method": "blob"}, projection={"return_result": False}))
+    assert ret[0]["stdout"] == stdout
+
+    # Or left as references to pull later
+    ret = storage_socket.get_results({"id": [result_id]}, resolve_blobs=False)["data"][0]
+    assert set(ret["stdout"]) == {"blob_id"}
+    assert storage_socket.get_blobs(ret["stdout"]["blob_id"])["data"] == {ret["stdout"]["blob_id"]: stdout}
+
+    # A duplicate keeps its value and leaves no blob behind
+    dup = {k: v for k, v in page.items() if k != "id"}
+    dup["stdout"] = stdout
+    ret = storage_socket.add_results([dup])
+    assert ret["meta"]["n_inserted"] == 0
+    assert dup["stdout"] == stdout
+    assert storage_socket._tables["blobs"].count_documents({}) == 1
+
+    # Deleting the result removes its blobs, results may be deleted by any index
+    assert storage_socket.del_results("blob", index="hash_index") == 1
+    assert storage_socket._tables["blobs"].count_documents({}) == 0
+
+
+def test_binary_arrays(storage_socket):
+
+    neon = portal.data.get_molecule("neon_tetramer.psimol")
+    mol_id = storage_socket.add_molecules({"neon": neon.to_json()})["data"]["neon"]
+
+    # Geometries are stored as typed binary buffers
+    raw = storage_socket._tables["molecules"].find_one({"_id": bson.ObjectId(mol_id)})
+    assert raw["geometry"]["dtype"] == "<f8"
+    assert raw["geometry"]["shape"] == [3 * len(neon.symbols)]
+
+    mol = storage_socket.get_molecules([mol_id])["data"][0]
+    assert isinstance(mol["geometry"], np.ndarray)
+    assert neon.compare(mol)
+
+    gradient = np.arange(3.0 * len(neon.symbols)).reshape(-1, 3)
+    results = [{
+        "molecule_id": mol_id,
+        "method": "array",
+        "basis": "B1",
+        "options": "default",
+        "program": "P1",
+        "driver": driver,
+        "return_result": value,
+        "hash_index": "array" + driver,
+    } for driver, value in [("gradient", gradient.tolist()), ("energy", 5.0)]]
+    storage_socket.add_results(results)
+
+    # The input is left untouched
+    assert results[0]["return_result"] == gradient.tolist()
+
+    found = storage_socket.get_results({"method": "array", "driver": "gradient"})["data"][0]
+    assert np.array_equal(found["return_result"], gradient)
+    assert found["return_result"].flags.writeable is False
+
+    found = list(storage_socket.iter_results({"method": "array", "driver": "energy"}))[0]
+    assert found["return_result"] == 5.0
+
+    # Documents stored as lists decode to the same read-only arrays
+    storage_socket._tables["results"].update_one({"hash_index": "arraygradient"},
+                                                 {"$set": {"return_result": gradient.tolist()}})
+    found = storage_socket.get_results({"method": "array", "driver": "gradient"})["data"][0]
+    assert isinstance(found["return_result"], np.ndarray)
+    assert np.array_equal(found["return_result"], gradient)
+    assert found["return_result"].flags.writeable is False
+
+    storage_socket._tables["molecules"].update_one({"_id": bson.ObjectId(mol_id)},
+                                                   {"$set": {"geometry": mol["geometry"].tolist()}})
+    legacy = storage_socket.get_molecules([mol_id])["data"][0]
+    assert isinstance(legacy["geometry"], np.ndarray)
+    assert np.array_equal(legacy["geometry"], mol["geometry"])
+    assert neon.compare(legacy)
+
+    ret = storage_socket.del_results([x["id"] for x in results])
+    assert ret == 2
+    storage_socket.del_molecules(mol_id)
+
+
+def test_storage_queue_archive(storage_socket):
+
+    tasks = [{
+        "hash_index": "archive" + str(x),
+        "spec": {
+            "function": "qcengine.compute",
+            "args": [{
+                "json_blob": "data"
+            }],
+            "kwargs": {},
+        },
+        "hooks": [],
+    } for x in range(3)]
+    ids = storage_socket.queue_submit(tasks, tag="archive")["data"]
+
+    # One complete and one failed task finished long ago, one is still waiting
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    table = storage_socket._tables["task_queue"]
+    table.update_one({"_id": bson.ObjectId(ids[0])},
+                     {"$set": {"status": "COMPLETE", "modified_on": old, "result_location": "loc"}})
+    table.update_one({"_id": bson.ObjectId(ids[1])},
+                     {"$set": {"status": "ERROR", "modified_on": old, "error": "x" * 5000}})
+
+    ret = storage_socket.queue_archive(datetime.timedelta(days=7))
+    assert ret == {"n_archived": 2, "n_expired": 0}
+
+    assert [x["id"] for x in storage_socket.get_queue({"tag": "archive"})["data"]] == [ids[2]]
+
+    archived = {x["id"]: x for x in storage_socket.get_queue_archive({"id": ids[:2]})["data"]}
+    assert archived[ids[0]]["result_location"] == "loc"
+    assert "spec" not in archived[ids[0]]
+    assert len(archived[ids[1]]["error"]) == storage_socket._archive_error_length
+
+    # Nothing left to archive, the archive expires
+    storage_socket._tables["task_archive"].update_many({"_id": {"$in": [bson.ObjectId(x) for x in ids[:2]]}},
+                                                       {"$set": {"archived_on": old}})
+    ret = storage_socket.queue_archive(datetime.timedelta(days=7), ttl=datetime.timedelta(days=7))
+    assert ret == {"n_archived": 0, "n_expired": 2}
+
+    table.delete_many({"tag": "archive"})
+
+
+def test_storage_queue_archive_services(storage_socket):
+
+    tasks = [{
+        "hash_index": "archive_service" + str(x),
+        "spec": {
+            "function": "qcengine.compute",
+            "args": [{
+                "json_blob": "data"
+            }],
+            "kwargs": {},
+        },
+        "hooks": [],
+    } for x in range(3)]
+    ids = storage_socket.queue_submit(tasks, tag="archive_service")["data"]
+
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+    table = storage_socket._tables["task_queue"]
+    complete = {"$set": {"status": "COMPLETE", "modified_on": old, "result_location": "loc"}}
+
+    # The first task was archived before the service started to wait on it
+    table.update_one({"_id": bson.ObjectId(ids[0])}, complete)
+    assert storage_socket.queue_archive(datetime.timedelta(days=7))["n_archived"] == 1
+    table.update_many({"tag": "archive_service"}, complete)
+
+    service = {
+        "hash_index": "archive_service",
+        "status": "RUNNING",
+        "tag": None,
+        "service": "torsiondrive",
+        "required_jobs": ids[:2],
+    }
+    storage_socket.add_services([service])
+
+    # Required tasks are kept in the queue, the others are archived
+    ret = storage_socket.queue_archive(datetime.timedelta(days=7))
+    assert ret == {"n_archived": 1, "n_expired": 0}
+    assert [x["id"] for x in storage_socket.get_queue({"tag": "archive_service"})["data"]] == [ids[1]]
+
+    # Required tasks are found in both the queue and the archive
+    found = storage_socket.queue_get_complete(ids[:2], projection={"result_location": True})
+    assert {x["id"] for x in found} == set(ids[:2])
+    assert {x["result_location"] for x in found} == {"loc"}
+
+    # Required tasks do not expire
+    storage_socket._tables["task_archive"].update_many({}, {"$set": {"archived_on": old}})
+    ret = storage_socket.queue_archive(datetime.timedelta(days=7), ttl=datetime.timedelta(days=7))
+    assert ret == {"n_archived": 0, "n_expired": 1}
+    assert len(storage_socket.get_queue_archive({"id": ids})["data"]) == 1
+
+    storage_socket.del_services([service["id"]])
+    table.delete_many({"tag": "archive_service"})
+    storage_socket._tables["task_archive"].delete_many({"_id": {"$in": [bson.ObjectId(x) for x in ids]}})
+
+
+def test_storage_update_services(storage_socket):
+
+    service = {
+        "hash_index": "update_services",
+        "status": "READY",
+        "tag": None,
+        "service": "torsiondrive",
+        "state": {"grid": {"-90": 1, "90": 2}, "history": [1]},
+        "remaining_jobs": False,
+    }
+    storage_socket.add_services([service])
+    uid = service["id"]
+    read = storage_socket.get_services({"id": uid})["data"][0]
+
+    # Only the changed fields are written
+    new = copy.deepcopy(read)
+    new["status"] = "RUNNING"
+    new["state"]["grid"]["90"] = 3
+    new["state"]["history"].append(2)
+    del new["remaining_jobs"]
+    assert storage_socket.update_services([(uid, new, read)]) == (1, 1)
+
+    stored = storage_socket.get_services({"id": uid})["data"][0]
+    assert stored["version"] == 1
+    assert stored["status"] == "RUNNING"
+    assert stored["state"] == {"grid": {"-90": 1, "90": 3}, "history": [1, 2]}
+    assert "remaining_jobs" not in stored
+
+    # The stale read was updated in the meantime and is skipped
+    stale = copy.deepcopy(read)
+    stale["status"] = "ERROR"
+    assert storage_socket.update_services([(uid, stale, read)]) == (0, 0)
+    assert storage_socket.get_services({"id": uid})["data"][0]["status"] == "RUNNING"
+
+    # Unchanged services are not written
+    assert storage_socket.update_services([(uid, stored, stored)]) == (0, 0)
+
+    storage_socket.del_services([uid])
+
+
+def test_storage_queue_reset_status(storage_socket):
+
+    tasks = [{
+        "hash_index": "reset" + str(x),
+        "spec": {
+            "function": "qcengine.compute",
+            "args": [{
+                "json_blob": "data"
+            }],
+            "kwargs": {},
+        },
+        "hooks": [],
+    } for x in range(2)]
+    ids = storage_socket.queue_submit(tasks, tag="reset")["data"]
+
+    storage_socket._tables["task_queue"].update_many({"tag": "reset"}, {"$set": {"status": "RUNNING"}})
+    running = {x["id"] for x in storage_socket.iter_queue({"tag": "reset", "status": "RUNNING"})}
+    assert running == set(ids)
+
+    # Only RUNNING tasks are reset
+    assert storage_socket.queue_reset_status(ids[:1]) == 1
+    assert storage_socket.queue_reset_status(ids[:1]) == 0
+    assert storage_socket.get_queue({"id": ids[0]})["data"][0]["status"] == "WAITING"
+    assert storage_socket.get_queue({"id": ids[1]})["data"][0]["status"] == "RUNNING"
+
+    storage_socket._tables["task_queue"].delete_many({"tag": "reset"})
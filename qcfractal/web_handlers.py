@@ -1,9 +1,15 @@
 """
 Web handlers for the FractalServer
 """
+import copy
+import itertools
 import json
+import tornado.ioloop
 import tornado.web
 
+from .interface import serialization
+from .interface.collections.collection_utils import collection_etag
+
 
 class APIHandler(tornado.web.RequestHandler):
     """
@@ -12,23 +18,98 @@ class APIHandler(tornado.web.RequestHandler):
 
     def initialize(self, **objects):
         """
-        Initializes the request to JSON, adds objects, and logging.
+        Initializes the request encodings, adds objects, and logging.
         """
 
-        self.set_header("Content-Type", "application/json")
         self.objects = objects
         self.logger = objects["logger"]
 
-        #print(self.request.headers["Content-Type"])
-        self.json = json.loads(self.request.body.decode("UTF-8"))
+        # Figure out the incoming and outgoing wire formats, JSON is the default
+        self.encoding = serialization.get_encoding(self.request.headers.get("Content-Type", None))
+        self.response_encoding = serialization.get_encoding(self.request.headers.get("Accept", None))
+        self.set_header("Content-Type", serialization.get_mime_type(self.response_encoding))
+
+    def prepare(self):
+        """
+        Decodes the request body in the incoming encoding.
+        """
+        try:
+            self.json = serialization.deserialize(self.request.body, self.encoding)
+        except Exception:
+            raise tornado.web.HTTPError(status_code=400, reason="Could not decode {} body.".format(self.encoding))
+
+    def write(self, data):
+        """
+        Encodes a response in the requested encoding and adds it to the output buffer.
+        """
+        if isinstance(data, dict):
+            data = serialization.serialize(data, self.response_encoding)
+
+        super().write(data)
+
+    async def write_stream(self, documents, chunk_size=100):
+        """
+        Writes documents in the requested encoding as they are yielded, flushing every `chunk_size`
+        documents so that the response is sent with chunked transfer encoding. JSON documents are
+        newline-delimited, msgpack documents are concatenated.
+
+        Documents are pulled from `documents` and encoded on the default executor so that a
+        blocking database cursor does not stall the IOLoop.
+
+        Parameters
+        ----------
+        documents : iterable of dict
+            The documents to write
+        chunk_size : int, optional
+            The number of documents to write between flushes
+
+        Returns
+        -------
+        int
+            The number of documents written
+        """
+        self.set_header("Content-Type", serialization.get_stream_mime_type(self.response_encoding))
+
+        documents = iter(documents)
+        loop = tornado.ioloop.IOLoop.current()
+
+        def next_chunk():
+            chunk = list(itertools.islice(documents, chunk_size))
+            return len(chunk), serialization.serialize_stream(chunk, self.response_encoding)
+
+        n_written = 0
+        while True:
+            n_chunk, data = await loop.run_in_executor(None, next_chunk)
+            if n_chunk == 0:
+                break
+
+            super().write(data)
+            n_written += n_chunk
+
+            # Wait for the chunk to be sent before pulling more from the cursor
+            await self.flush()
+
+        return n_written
+
+    def page_options(self, meta):
+        """
+        Returns the pagination options of a request, the page size is capped by the server maximum.
+        """
+        try:
+            limit = self.objects["storage_socket"].get_limit(meta.get("limit", None))
+        except (TypeError, ValueError):
+            raise tornado.web.HTTPError(status_code=400, reason="Limit '{}' not understood.".format(meta["limit"]))
+
+        return {"limit": limit, "cursor": meta.get("cursor", None)}
 
     def authenticate(self, permission):
         """Authenticates request with a given permission setting
 
         Parameters
         ----------
-        permission : str
-            The required permission ["read", "write", "compute", "admin"]
+        permission : str or list of str
+            The required permission ["read", "write", "compute", "admin"], if a list
+            is given all permissions are required.
 
         """
         if "Authorization" in self.request.headers:
@@ -58,6 +139,8 @@ class MoleculeHandler(APIHandler):
         Request:
             "meta" - Overall options to the Molecule pull request
                 - "index" - What kind of index used to find the data ("id", "molecule_hash", "molecular_formula")
+                - "limit" - The maximum number of molecules to return, capped by the server
+                - "cursor" - The "next_cursor" of a previous page to continue from
             "data" - A dictionary of {key : index} requests
 
         Returns:
@@ -67,21 +150,25 @@ class MoleculeHandler(APIHandler):
                 - "success" - If the query was successful or not.
                 - "error_description" - A string based description of the error or False
                 - "missing" - A list of keys that were not found.
+                - "next_cursor" - The cursor of the next page or None if this is the last page.
             "data" - A dictionary of {key : molecule JSON} results
 
         """
         self.authenticate("read")
 
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
 
-        kwargs = {}
-        if "index" in self.json["meta"]:
-            kwargs["index"] = self.json["meta"]["index"]
+        kwargs = self.page_options(payload["meta"])
+        if "index" in payload["meta"]:
+            kwargs["index"] = payload["meta"]["index"]
 
-        ret = storage.get_molecules(self.json["data"], **kwargs)
+        ret = storage.get_molecules(payload["data"], **kwargs)
         self.logger.info("GET: Molecule - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
 
     def post(self):
         """
@@ -104,11 +191,15 @@ class MoleculeHandler(APIHandler):
 
         self.authenticate("write")
 
+        self.write(self.handle_post(self.json))
+
+    def handle_post(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.add_molecules(self.json["data"])
+        ret = storage.add_molecules(payload["data"])
         self.logger.info("POST: Molecule - {} inserted.".format(ret["meta"]["n_inserted"]))
-        self.write(ret)
+
+        return ret
 
 
 class OptionHandler(APIHandler):
@@ -119,22 +210,28 @@ class OptionHandler(APIHandler):
     def get(self):
         self.authenticate("read")
 
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.get_options(self.json["data"])
+        ret = storage.get_options(payload["data"])
         self.logger.info("GET: Options - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
 
     def post(self):
         self.authenticate("write")
 
+        self.write(self.handle_post(self.json))
+
+    def handle_post(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.add_options(self.json["data"])
+        ret = storage.add_options(payload["data"])
         self.logger.info("POST: Options - {} inserted.".format(ret["meta"]["n_inserted"]))
 
-        self.write(ret)
+        return ret
 
 
 class CollectionHandler(APIHandler):
@@ -145,23 +242,125 @@ class CollectionHandler(APIHandler):
     def get(self):
         self.authenticate("read")
 
+        # Single unprojected collections are tagged with their version so that clients may revalidate
+        tagged = self.json["meta"].get("projection", None) is None
+
+        etag = self.request.headers.get("If-None-Match", None)
+        if tagged and (etag is not None):
+            storage = self.objects["storage_socket"]
+            head = storage.get_collections(copy.deepcopy(self.json["data"]), projection={"version": True})["data"]
+            if (len(head) == 1) and ("version" in head[0]) and (collection_etag(head[0]) == etag):
+                self.logger.info("GET: Collections - not modified.")
+                self.set_status(304)
+                return
+
+        ret = self.handle_get(self.json)
+        if tagged and (len(ret["data"]) == 1) and ("version" in ret["data"][0]):
+            self.set_header("ETag", collection_etag(ret["data"][0]))
+
+        self.write(ret)
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.get_collections(self.json["data"], projection=self.json["meta"].get("projection", None))
+        ret = storage.get_collections(
+            payload["data"], projection=payload["meta"].get("projection", None), **self.page_options(payload["meta"]))
         self.logger.info("GET: Collections - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
 
     def post(self):
         self.authenticate("write")
 
+        self.write(self.handle_post(self.json))
+
+    def handle_post(self, payload):
         storage = self.objects["storage_socket"]
 
-        overwrite = self.json["meta"].get("overwrite", False)
-        ret = storage.add_collection(self.json["data"], overwrite=overwrite)
+        overwrite = payload["meta"].get("overwrite", False)
+        ret = storage.add_collection(payload["data"], overwrite=overwrite)
         self.logger.info("POST: Collections - {} inserted.".format(ret["meta"]["n_inserted"]))
 
-        self.write(ret)
+        return ret
+
+    def put(self):
+        """
+
+        Request:
+            "meta" - Overall options to the Collection update request
+                - "id" - The id of the collection to update
+                - "version" - The version of the collection the changes were made against
+            "data" - The changes to apply
+                - "set" - A {field : value} of top-level fields to replace
+                - "push" - A {field : values} of values to append to list fields
+                - "set_entries" - A {field : {position : entry}} of entries to replace
+
+        Returns:
+            "meta" - Metadata associated with the update
+                - "success" - If the collection was at the given version and updated.
+                - "version" - The new version of the collection.
+            "data" - A list of (key, id) of the updated collection
+
+        """
+        self.authenticate("write")
+
+        self.write(self.handle_put(self.json))
+
+    def handle_put(self, payload):
+        storage = self.objects["storage_socket"]
+
+        meta = payload["meta"]
+        changes = payload["data"]
+        if ("id" not in meta) or ("version" not in meta):
+            raise tornado.web.HTTPError(status_code=400, reason="Collection updates require an 'id' and 'version'.")
+
+        ret = storage.update_collection(
+            meta["id"],
+            meta["version"],
+            set_fields=changes.get("set", None),
+            push_fields=changes.get("push", None),
+            set_entries=changes.get("set_entries", None))
+        self.logger.info("PUT: Collections - {} updated.".format(ret["meta"]["n_inserted"]))
+
+        return ret
+
+
+class CollectionEntryHandler(APIHandler):
+    """
+    A handler to page through the entries of a collection.
+    """
+
+    def get(self):
+        """
+
+        Request:
+            "meta" - Overall options to the entry pull request
+                - "limit" - The maximum number of entries to return, capped by the server
+                - "cursor" - The "next_cursor" of a previous page to continue from
+            "data" - The entries to pull
+                - "id" - The id of the collection
+                - "field" - The list field to page through
+                - "fields" - Optional, the keys of each entry to return
+
+        Returns:
+            "meta" - Metadata associated with the query
+                - "next_cursor" - The cursor of the next page or None if this is the last page.
+            "data" - A list of entries in order
+
+        """
+        self.authenticate("read")
+
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
+        storage = self.objects["storage_socket"]
+
+        query = payload["data"]
+        ret = storage.get_collection_entries(
+            query["id"], query["field"], fields=query.get("fields", None), **self.page_options(payload["meta"]))
+        self.logger.info("GET: Collection entries - {} pulls.".format(len(ret["data"])))
+
+        return ret
 
 
 class ResultHandler(APIHandler):
@@ -169,26 +368,77 @@ class ResultHandler(APIHandler):
     A handler to push and get molecules.
     """
 
-    def get(self):
+    async def get(self):
         self.authenticate("read")
 
+        if self.json["meta"].get("stream", False):
+            storage = self.objects["storage_socket"]
+            try:
+                cursor = storage.iter_results(
+                    self.json["data"],
+                    projection=self.json["meta"].get("projection", None),
+                    filters=self.json["meta"].get("filters", None),
+                    resolve_blobs=self.json["meta"].get("resolve_blobs", True))
+            except KeyError as e:
+                raise tornado.web.HTTPError(status_code=400, reason=str(e.args[0]))
+
+            n_written = await self.write_stream(cursor)
+            self.logger.info("GET: Results - {} streamed.".format(n_written))
+            return
+
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
-        proj = self.json["meta"].get("projection", None)
 
-        ret = storage.get_results(self.json["data"], projection=proj)
+        if payload["meta"].get("summary", False):
+            ret = storage.get_results_summary(payload["data"])
+            self.logger.info("GET: Results - summary of {} results.".format(ret["data"].get("n_found", 0)))
+            return ret
+
+        proj = payload["meta"].get("projection", None)
+        ret = storage.get_results(
+            payload["data"],
+            projection=proj,
+            filters=payload["meta"].get("filters", None),
+            resolve_blobs=payload["meta"].get("resolve_blobs", True),
+            **self.page_options(payload["meta"]))
         self.logger.info("GET: Results - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
 
     def post(self):
         self.authenticate("write")
 
+        self.write(self.handle_post(self.json))
+
+    def handle_post(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.add_results(self.json["data"])
+        ret = storage.add_results(payload["data"])
         self.logger.info("POST: Results - {} inserted.".format(ret["meta"]["n_inserted"]))
 
-        self.write(ret)
+        return ret
+
+
+class ResultAggregateHandler(APIHandler):
+    """
+    A handler to compute grouped statistics of results on the server.
+    """
+
+    def get(self):
+        self.authenticate("read")
+
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
+        storage = self.objects["storage_socket"]
+
+        kwargs = {k: payload["meta"][k] for k in ["group_by", "field", "stats", "filters"] if k in payload["meta"]}
+        ret = storage.aggregate_results(payload["data"], **kwargs)
+        self.logger.info("GET: Results - {} groups aggregated.".format(len(ret["data"].get("rows", []))))
+
+        return ret
 
 
 class ProcedureHandler(APIHandler):
@@ -196,15 +446,55 @@ class ProcedureHandler(APIHandler):
     A handler to push and get molecules.
     """
 
-    def get(self):
+    async def get(self):
         self.authenticate("read")
 
+        if self.json["meta"].get("stream", False):
+            storage = self.objects["storage_socket"]
+            try:
+                cursor = storage.iter_procedures(
+                    self.json["data"],
+                    projection=self.json["meta"].get("projection", None),
+                    filters=self.json["meta"].get("filters", None))
+            except (KeyError, TypeError) as e:
+                raise tornado.web.HTTPError(status_code=400, reason=str(e.args[0]))
+
+            n_written = await self.write_stream(cursor)
+            self.logger.info("GET: Procedures - {} streamed.".format(n_written))
+            return
+
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.get_procedures(self.json["data"])
+        ret = storage.get_procedures(
+            payload["data"],
+            projection=payload["meta"].get("projection", None),
+            filters=payload["meta"].get("filters", None),
+            **self.page_options(payload["meta"]))
         self.logger.info("GET: Procedures - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
+
+
+class BlobHandler(APIHandler):
+    """
+    A handler to pull large result fields which are stored out of line
+    """
+
+    def get(self):
+        self.authenticate("read")
+
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
+        storage = self.objects["storage_socket"]
+
+        ret = storage.get_blobs(payload["data"])
+        self.logger.info("GET: Blob - {} pulls.".format(len(ret["data"])))
+
+        return ret
 
 
 class LocatorHandler(APIHandler):
@@ -215,12 +505,15 @@ class LocatorHandler(APIHandler):
     def get(self):
         self.authenticate("read")
 
+        self.write(self.handle_get(self.json))
+
+    def handle_get(self, payload):
         storage = self.objects["storage_socket"]
 
-        ret = storage.locator(self.json["data"])
+        ret = storage.locator(payload["data"])
         self.logger.info("GET: Locator - {} pulls.".format(len(ret["data"])))
 
-        self.write(ret)
+        return ret
 
     # def post(self):
 
@@ -274,3 +567,106 @@ class LocatorHandler(APIHandler):
     #         ret["mongo_data"] = (mongod.url, mongod.port)
     #         ret["dask_data"] = str(queue.host) + ":" + str(queue.port)
     #         self.write(json.dumps(ret))
+
+
+class BatchHandler(APIHandler):
+    """
+    A handler to run a list of requests against the other endpoints in a single call.
+    """
+
+    # Maps {endpoint : handler} for all endpoints that may be batched
+    endpoints = {
+        "molecule": MoleculeHandler,
+        "option": OptionHandler,
+        "collection": CollectionHandler,
+        "collection_entry": CollectionEntryHandler,
+        "result": ResultHandler,
+        "result_aggregate": ResultAggregateHandler,
+        "procedure": ProcedureHandler,
+        "locator": LocatorHandler,
+        "blob": BlobHandler,
+    }
+
+    # Maps {method : required permission}
+    permissions = {"get": "read", "post": "write", "put": "write"}
+
+    def post(self):
+        """
+
+        Request:
+            "meta" - Overall options to the Batch request
+                - No current options
+            "data" - A list of {"endpoint": str, "method": str, "payload": dict} requests
+
+        Returns:
+            "meta" - Metadata associated with the batch
+                - "n_requests" - The number of requests run.
+                - "success" - If the batch was successful or not.
+            "data" - A list of {"status": int, "reason": str, "response": dict} in request order
+
+        """
+
+        data = self.json.get("data", None) if isinstance(self.json, dict) else None
+        if not isinstance(data, list):
+            raise tornado.web.HTTPError(status_code=400, reason="Batch data must be a list of requests.")
+
+        if len(data) == 0:
+            raise tornado.web.HTTPError(status_code=400, reason="Batch must contain at least one request.")
+
+        requests = []
+        permissions = set()
+        for num, request in enumerate(data):
+            if not isinstance(request, dict):
+                raise tornado.web.HTTPError(status_code=400, reason="Batch request {} must be a dict.".format(num))
+
+            endpoint = request.get("endpoint", "")
+            method = request.get("method", "get")
+            payload = request.get("payload", {})
+            if not isinstance(endpoint, str) or not isinstance(method, str):
+                raise tornado.web.HTTPError(
+                    status_code=400, reason="Batch request {} endpoint and method must be strings.".format(num))
+
+            if not isinstance(payload, dict):
+                raise tornado.web.HTTPError(
+                    status_code=400, reason="Batch request {} payload must be a dict.".format(num))
+
+            endpoint = endpoint.strip("/").lower()
+            method = method.lower()
+            if endpoint not in self.endpoints:
+                raise tornado.web.HTTPError(
+                    status_code=400, reason="Batch request {} endpoint '{}' not understood.".format(num, endpoint))
+
+            if not hasattr(self.endpoints[endpoint], "handle_" + method):
+                raise tornado.web.HTTPError(
+                    status_code=400, reason="Batch request {} method '{}' not understood.".format(num, method))
+
+            # Each request is run by its own handler instance
+            handler = self.endpoints[endpoint](self.application, self.request, **self.objects)
+            handler = getattr(handler, "handle_" + method)
+
+            payload.setdefault("meta", {})
+            payload.setdefault("data", {})
+
+            requests.append((handler, payload))
+            permissions.add(self.permissions[method])
+
+        # Authenticate once for the whole batch
+        self.authenticate(sorted(permissions))
+
+        # A failing request does not fail the others
+        responses = []
+        for num, (handler, payload) in enumerate(requests):
+            try:
+                responses.append({"status": 200, "reason": "OK", "response": handler(payload)})
+            except tornado.web.HTTPError as e:
+                responses.append({"status": e.status_code, "reason": e.reason, "response": None})
+            except (KeyError, TypeError, ValueError) as e:
+                responses.append({"status": 400, "reason": "Bad request: {}".format(e), "response": None})
+            except Exception as e:
+                self.logger.exception("POST: Batch - request {} failed.".format(num))
+                responses.append({"status": 500, "reason": "Internal error: {}".format(e), "response": None})
+
+        self.logger.info("POST: Batch - {} requests.".format(len(responses)))
+
+        meta = {"n_requests": len(responses), "success": True, "errors": [], "error_description": False}
+        self.write({"meta": meta, "data": responses})